@@ -0,0 +1,115 @@
+"""
+Analysis Cache - Cache kết quả phân tích DeepFace theo dấu vân tay (perceptual hash) của khuôn mặt
+Frame webcam liên tiếp gần như giống hệt nhau -> khuôn mặt trùng hoặc gần trùng (khoảng cách Hamming
+của dHash nhỏ) được trả lại thuộc tính đã tính thay vì chạy lại các CNN.
+LRU (giới hạn số entry) + TTL (entry quá hạn bị bỏ), có bộ đếm hit / miss / eviction.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def dhash(image, hash_size=8):
+    """Difference hash 64 bit của ảnh (grayscale, thu nhỏ về (hash_size+1) x hash_size rồi so pixel kề nhau)"""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class AnalysisCache:
+    """
+    Entry: fingerprint -> kết quả DeepFace (dict) của các action đã tính, mỗi field có thời điểm tính riêng.
+    get() trả về kết quả nếu có entry trùng/gần trùng còn hạn và đã có đủ action được yêu cầu.
+    put() chỉ gộp vào entry có fingerprint trùng chính xác; gần trùng thì lưu entry riêng (không ghi đè
+    kết quả của khuôn mặt khác có dHash gần giống).
+    """
+
+    def __init__(self, max_entries=256, ttl=30, max_distance=4):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries = OrderedDict()  # fingerprint -> (kết quả, {field: thời điểm tính})
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'bypassed': 0}
+
+    def _expire(self, now):
+        """Bỏ các field quá hạn; entry không còn field nào thì xóa"""
+        for key in list(self._entries):
+            result, computed_at = self._entries[key]
+            stale = [field for field, at in computed_at.items() if now - at > self.ttl]
+            if not stale:
+                continue
+            if len(stale) == len(computed_at):
+                del self._entries[key]
+                self._stats['expirations'] += 1
+                continue
+            result = {field: value for field, value in result.items() if field not in stale}
+            computed_at = {field: at for field, at in computed_at.items() if field not in stale}
+            self._entries[key] = (result, computed_at)
+
+    def _find(self, fingerprint):
+        """Entry trùng chính xác, nếu không có thì entry gần nhất trong max_distance (gallery nhỏ -> quét tuyến tính)"""
+        if fingerprint in self._entries:
+            return fingerprint
+        best_key = None
+        best_distance = self.max_distance + 1
+        for key in self._entries:
+            distance = hamming(fingerprint, key)
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    def get(self, fingerprint, actions):
+        with self._lock:
+            self._expire(time.time())
+            key = self._find(fingerprint)
+            if key is not None:
+                result = self._entries[key][0]
+                if all(action in result for action in actions):
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return result
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, fingerprint, result):
+        """Lưu kết quả; entry cùng fingerprint (trùng chính xác) được gộp thêm các action mới tính"""
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            computed_at = dict.fromkeys(result, now)
+            existing = self._entries.pop(fingerprint, None)
+            if existing is not None:
+                cached, cached_at = existing
+                result = {**cached, **result}
+                computed_at = {**cached_at, **computed_at}
+            self._entries[fingerprint] = (result, computed_at)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats['bypassed'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        stats.update({'max_entries': self.max_entries, 'ttl': self.ttl, 'max_distance': self.max_distance})
+        return stats
@@ -0,0 +1,267 @@
+"""
+ANN Index - Tìm kiếm lân cận gần nhất cho gallery rất lớn (CPU, chỉ cần numpy)
+- brute: tìm kiếm chính xác trên toàn bộ ma trận của FaceGallery (mặc định)
+- ivf:   IVF-Flat - chia gallery thành nlist cụm bằng k-means, mỗi truy vấn chỉ quét nprobe cụm gần nhất
+"""
+import os
+import threading
+
+import numpy as np
+
+from face_gallery import ENCODING_SIZE
+
+# Gallery nhỏ hơn ngưỡng này thì IVF không có lợi -> vẫn quét toàn bộ
+IVF_MIN_TRAIN_SIZE = 1000
+
+
+def _nearest_centroids(data, centroids, count=1, chunk_size=8192):
+    """Trả về chỉ số `count` centroid gần nhất cho mỗi hàng (tính theo từng khối để giới hạn RAM)"""
+    centroid_sq = np.einsum('ij,ij->i', centroids, centroids)
+    result = np.empty((len(data), count), dtype=np.int64)
+    for start in range(0, len(data), chunk_size):
+        block = data[start:start + chunk_size]
+        partial = centroid_sq - 2.0 * (block @ centroids.T)
+        if count == 1:
+            result[start:start + len(block), 0] = np.argmin(partial, axis=1)
+        else:
+            top = np.argpartition(partial, count - 1, axis=1)[:, :count]
+            order = np.argsort(np.take_along_axis(partial, top, axis=1), axis=1)
+            result[start:start + len(block)] = np.take_along_axis(top, order, axis=1)
+    return result
+
+
+def train_kmeans(data, k, iterations=10, sample_size=50000, seed=0):
+    """K-means đơn giản (Lloyd) để tạo các centroid cho IVF"""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    if len(data) > sample_size:
+        data = data[rng.choice(len(data), sample_size, replace=False)]
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assign = _nearest_centroids(data, centroids)[:, 0]
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Cụm rỗng -> khởi tạo lại bằng điểm ngẫu nhiên
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids
+
+
+class BruteForceIndex:
+    """Exact search: không cần cấu trúc phụ, FaceGallery tự quét toàn bộ ma trận"""
+
+    kind = 'brute'
+    centroids = None
+
+    def build(self, vectors, centroids=None):
+        pass
+
+    def set(self, row, vector):
+        pass
+
+    def remove(self, row, last):
+        pass
+
+    def needs_training(self, size):
+        return False
+
+    def as_replica(self):
+        return self
+
+    def search(self, gallery, queries):
+        return gallery.search_exact(queries)
+
+    def save(self, path):
+        pass
+
+    def stats(self):
+        return {'type': self.kind}
+
+
+class IVFIndex:
+    """
+    IVF-Flat: mỗi cụm là 1 mảng chỉ số hàng (int32) trỏ vào ma trận của FaceGallery - không copy vector,
+    cập nhật tăng dần khi đăng ký/xóa người. Chỉ centroid được lưu xuống đĩa.
+    Gallery chưa đủ IVF_MIN_TRAIN_SIZE người thì quét toàn bộ; FaceGallery train ở background khi vượt ngưỡng.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, nlist=None, nprobe=8, dim=ENCODING_SIZE, path=None):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.dim = dim
+        self.path = path
+        self.auto_train = True  # False ở bản sao trong process worker: centroid do process chính gửi sang
+        self.training = False
+        self.centroids = None
+        self._lists = []
+        self._assign = np.empty(0, dtype=np.int32)  # hàng -> cụm (-1 = chưa gán)
+        self._lock = threading.RLock()
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def _default_nlist(self, size):
+        # Quy tắc phổ biến cho IVF: nlist ~ 4 * sqrt(N)
+        return self.nlist or max(1, int(4 * np.sqrt(size)))
+
+    def needs_training(self, size):
+        """Gallery vừa vượt ngưỡng mà index chưa có centroid (và chưa train ở background)"""
+        return self.auto_train and not self.training and self.centroids is None and size >= IVF_MIN_TRAIN_SIZE
+
+    def as_replica(self):
+        """Bản sao trong process worker: chỉ dùng centroid process chính gửi sang, không tự train / ghi file"""
+        self.auto_train = False
+        self.path = None
+        return self
+
+    def train(self, vectors):
+        """K-means trên bản sao vector - trả về centroid, chưa gán vào index (chạy được ngoài lock của gallery)"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        return train_kmeans(vectors, self._default_nlist(len(vectors)))
+
+    def build(self, vectors, centroids=None):
+        """
+        Build lại các cụm từ toàn bộ ma trận gallery (hàng i = người thứ i).
+        centroids: dùng centroid có sẵn (train ở background / process chính gửi sang); None = load file hoặc tự train
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            if centroids is not None:
+                self.centroids = np.asarray(centroids, dtype=np.float32)
+                if self.path and self.auto_train:
+                    self.save(self.path)
+            if self.centroids is None and self.path and os.path.exists(self.path):
+                self.load(self.path)
+            if self.centroids is None:
+                if not self.auto_train or len(vectors) < IVF_MIN_TRAIN_SIZE:
+                    self._lists = []
+                    self._assign = np.empty(0, dtype=np.int32)
+                    return
+                self.centroids = self.train(vectors)
+                if self.path:
+                    self.save(self.path)
+
+            assign = (_nearest_centroids(vectors, self.centroids)[:, 0].astype(np.int32)
+                      if len(vectors) else np.empty(0, dtype=np.int32))
+            order = np.argsort(assign, kind='stable').astype(np.int32)
+            counts = np.bincount(assign, minlength=len(self.centroids))
+            self._lists = np.split(order, np.cumsum(counts)[:-1])
+            self._assign = assign
+
+    def _ensure_assign(self, row):
+        if row < len(self._assign):
+            return
+        assign = np.full(max(row + 1, 2 * len(self._assign), 1024), -1, dtype=np.int32)
+        assign[:len(self._assign)] = self._assign
+        self._assign = assign
+
+    def _drop(self, list_id, row):
+        rows = self._lists[list_id]
+        self._lists[list_id] = rows[rows != row]
+
+    def set(self, row, vector):
+        """Hàng `row` được thêm/cập nhật - chuyển sang cụm khác nếu centroid gần nhất thay đổi"""
+        with self._lock:
+            if not self.trained:
+                return
+            vector = np.asarray(vector, dtype=np.float32).reshape(1, self.dim)
+            list_id = int(_nearest_centroids(vector, self.centroids)[0, 0])
+            self._ensure_assign(row)
+            old_list = int(self._assign[row])
+            if old_list == list_id:
+                return
+            if old_list >= 0:
+                self._drop(old_list, row)
+            self._lists[list_id] = np.append(self._lists[list_id], np.int32(row))
+            self._assign[row] = list_id
+
+    def remove(self, row, last):
+        """Hàng `row` bị xóa và hàng cuối `last` được FaceGallery chuyển vào chỗ trống"""
+        with self._lock:
+            if not self.trained or row >= len(self._assign):
+                return
+            list_id = int(self._assign[row])
+            if list_id >= 0:
+                self._drop(list_id, row)
+            self._assign[row] = -1
+            if last != row and last < len(self._assign):
+                last_list = int(self._assign[last])
+                if last_list >= 0:
+                    rows = self._lists[last_list].copy()
+                    rows[rows == last] = row
+                    self._lists[last_list] = rows
+                self._assign[row] = last_list
+                self._assign[last] = -1
+
+    def search(self, gallery, queries):
+        """
+        Trả về (names, distances) gần đúng - chỉ quét nprobe cụm gần nhất của mỗi truy vấn.
+        Gọi trong lock của gallery (FaceGallery.search) nên đọc trực tiếp ma trận / norm của gallery.
+        """
+        with self._lock:
+            if not self.trained:
+                return gallery.search_exact(queries)
+            nprobe = min(self.nprobe, len(self.centroids))
+            probes = _nearest_centroids(queries, self.centroids, count=nprobe)
+            names = []
+            distances = np.full(len(queries), np.inf, dtype=np.float32)
+            for i, query in enumerate(queries):
+                rows = np.concatenate([self._lists[list_id] for list_id in probes[i]])
+                if len(rows) == 0:
+                    names.append(None)
+                    continue
+                partial = gallery._sq_norms[rows] - 2.0 * (gallery._matrix[rows] @ query)
+                best = int(np.argmin(partial))
+                names.append(gallery._names[rows[best]])
+                distances[i] = np.sqrt(max(float(partial[best] + query @ query), 0.0))
+            return names, distances
+
+    def save(self, path):
+        """Lưu centroid ra file .npz (ghi file tạm rồi rename để không bị hỏng giữa chừng)"""
+        with self._lock:
+            if self.centroids is None:
+                return
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = path + '.tmp.npz'
+            np.savez(tmp_path, centroids=self.centroids, nprobe=self.nprobe)
+            os.replace(tmp_path, path)
+
+    def load(self, path):
+        with self._lock:
+            with np.load(path) as data:
+                centroids = data['centroids'].astype(np.float32)
+            if centroids.ndim != 2 or centroids.shape[1] != self.dim:
+                return False
+            self.centroids = centroids
+            return True
+
+    def stats(self):
+        with self._lock:
+            sizes = [len(rows) for rows in self._lists]
+            return {
+                'type': self.kind,
+                'trained': self.trained,
+                'training': self.training,
+                'nlist': len(self._lists),
+                'nprobe': self.nprobe,
+                'largest_list': max(sizes) if sizes else 0
+            }
+
+
+def create_index(kind, **kwargs):
+    """Tạo index theo tên cấu hình ('brute' hoặc 'ivf')"""
+    if kind == 'ivf':
+        return IVFIndex(**kwargs)
+    if kind == 'brute':
+        return BruteForceIndex()
+    raise ValueError(f'ANN index không hợp lệ: {kind}')
@@ -1,352 +1,789 @@
+"""
+Flask Web Application cho Face Recognition Project
+Tự động quản lý 2 môi trường Anaconda riêng biệt
+"""
+from flask import Flask, render_template, request, jsonify, Response, g, has_request_context
+import subprocess
+import os
+import shutil
+import sys
+import cv2
+import base64
+import numpy as np
+import json
+import re
+import time
+import uuid
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from env_manager import CondaEnvironmentManager
+from service_health import ServiceHealthMonitor, STARTING, UNKNOWN, READY
+from service_client import ServiceClient
+from realtime_stream import run_recognition_stream
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None  # Không có flask-sock -> browser tự dùng HTTP polling
+
+app = Flask(__name__)
+app.config['SECRET_KEY'] = 'your-secret-key-here'
+app.config['UPLOAD_FOLDER'] = 'uploads'
+
+# Kênh WebSocket cho nhận diện realtime (tùy chọn)
+sock = Sock(app) if Sock else None
+
+# Tạo thư mục uploads nếu chưa có
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+# Khởi tạo Environment Manager
+env_manager = CondaEnvironmentManager()
+
+# Service URLs - các service riêng biệt chạy trong môi trường Anaconda
+FACE_RECOGNITION_SERVICE = 'http://localhost:5001'
+DEEPFACE_SERVICE = 'http://localhost:5002'
+REQUEST_TIMEOUT = 30  # seconds
+HEALTH_CHECK_INTERVAL = 5  # seconds - chu kỳ poll /health ở background
+CIRCUIT_FAILURE_THRESHOLD = 3  # số lỗi liên tiếp trước khi ngắt mạch
+CIRCUIT_RESET_TIMEOUT = 10  # seconds - thời gian chờ trước khi cho 1 request thử lại
+
+# Connection pool keep-alive gateway -> service
+POOL_SIZE = int(os.environ.get('GATEWAY_POOL_SIZE', '20'))  # số kết nối tối đa mỗi service
+CONNECT_TIMEOUT = float(os.environ.get('GATEWAY_CONNECT_TIMEOUT', '2'))  # seconds
+MAX_RETRIES = int(os.environ.get('GATEWAY_MAX_RETRIES', '2'))  # chỉ retry khi không kết nối được
+POOL_TIMEOUT = float(os.environ.get('GATEWAY_POOL_TIMEOUT', '5'))  # seconds chờ kết nối rảnh
+# Service đang khởi động (/readyz 503): request chờ tối đa bấy nhiêu giây rồi mới bị từ chối với 503 + Retry-After
+READY_WAIT_TIMEOUT = float(os.environ.get('GATEWAY_READY_WAIT', '10'))
+
+SERVICE_DISPLAY_NAMES = {
+    'face_recognition': 'Face Recognition Service',
+    'deepface': 'DeepFace Service'
+}
+
+service_clients = {
+    name: ServiceClient(
+        url,
+        pool_size=POOL_SIZE,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=REQUEST_TIMEOUT,
+        max_retries=MAX_RETRIES,
+        pool_timeout=POOL_TIMEOUT
+    )
+    for name, url in (('face_recognition', FACE_RECOGNITION_SERVICE), ('deepface', DEEPFACE_SERVICE))
+}
+
+# Thread gọi song song 2 service cho /api/recognize-analyze
+_fanout_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='gateway-fanout')
+
+# Theo dõi health ở background - forwarding path chỉ đọc trạng thái đã cache
+health_monitor = ServiceHealthMonitor(
+    {
+        'face_recognition': FACE_RECOGNITION_SERVICE,
+        'deepface': DEEPFACE_SERVICE
+    },
+    interval=HEALTH_CHECK_INTERVAL,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=CIRCUIT_RESET_TIMEOUT
+)
+
+@app.before_request
+def start_health_monitor():
+    """Khởi động health monitor ở request đầu tiên (idempotent)"""
+    health_monitor.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.upstream_time = 0.0
+
+@app.after_request
+def add_server_timing(response):
     """
-    Flask Web Application cho Face Recognition Project
-    Tự động quản lý 2 môi trường Anaconda riêng biệt
+    Header Server-Timing: gateway = tổng thời gian xử lý trong gateway, upstream = thời gian request chờ service
+    (load test dùng để tách overhead từng chặng: client <-> gateway, gateway, gateway <-> service)
     """
-    from flask import Flask, render_template, request, jsonify, Response
-    import subprocess
-    import os
-    import sys
-    import cv2
-    import base64
-    import numpy as np
-    import json
-    import requests
-    from env_manager import CondaEnvironmentManager
-
-    app = Flask(__name__)
-    app.config['SECRET_KEY'] = 'your-secret-key-here'
-    app.config['UPLOAD_FOLDER'] = 'uploads'
-
-    # Tạo thư mục uploads nếu chưa có
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-    # Khởi tạo Environment Manager
-    env_manager = CondaEnvironmentManager()
-
-    # Service URLs - các service riêng biệt chạy trong môi trường Anaconda
-    FACE_RECOGNITION_SERVICE = 'http://localhost:5001'
-    DEEPFACE_SERVICE = 'http://localhost:5002'
-    REQUEST_TIMEOUT = 30  # seconds
-
-    def check_service_health(service_url, service_name):
-        """Kiểm tra health của service"""
-        try:
-            response = requests.get(f'{service_url}/health', timeout=2)
-            if response.status_code == 200:
-                return True, response.json()
-            return False, None
-        except Exception as e:
-            return False, str(e)
+    if 'request_start' in g:
+        gateway_ms = (time.perf_counter() - g.request_start) * 1000
+        response.headers['Server-Timing'] = f'gateway;dur={gateway_ms:.2f}, upstream;dur={g.upstream_time * 1000:.2f}'
+    return response
 
+@contextmanager
+def upstream_timer():
+    """Cộng thời gian request hiện tại chờ service vào upstream của Server-Timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and 'upstream_time' in g:
+            g.upstream_time += time.perf_counter() - start
 
+class RequestBodyStream:
+    """
+    Bọc request.stream của Flask để requests gửi body sang service theo từng khối
+    (không đọc toàn bộ body vào RAM, không parse/serialize lại JSON)
+    """
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.length = length
+    
+    def __len__(self):
+        return self.length
+    
+    def read(self, size=-1):
+        return self.stream.read(size)
 
-    @app.route('/')
-    def index():
-        """Trang chủ"""
-        return render_template('index.html')
+def forward_image_request(service_name, path):
+    """
+    Forward body của request hiện tại (ảnh binary, multipart hoặc JSON base64) sang service.
+    Body được stream nguyên vẹn kèm Content-Type và query string gốc (vd ?actions=); trả về None nếu request không có dữ liệu.
+    """
+    if request.content_length:
+        body = RequestBodyStream(request.stream, request.content_length)
+    else:
+        # Client gửi chunked (không có Content-Length) -> đọc vào bộ nhớ
+        body = request.get_data()
+    
+    if not body:
+        return None
+    
+    with upstream_timer():
+        return service_clients[service_name].post(
+            path,
+            data=body,
+            params=request.args,
+            headers={'Content-Type': request.content_type or 'application/octet-stream'}
+        )
 
-    @app.route('/api/check-environments', methods=['GET'])
-    def check_environments():
-        """API kiểm tra trạng thái các môi trường và services"""
-        try:
-            status = {}
-            
-            # Kiểm tra môi trường Anaconda
-            for env_name in env_manager.envs.keys():
-                env_exists = env_manager.check_env_exists(env_name)
-                packages_ok = env_manager.check_packages_installed(env_name) if env_exists else False
-                
-                status[env_name] = {
-                    'exists': env_exists,
-                    'packages_installed': packages_ok,
-                    'ready': env_exists and packages_ok
-                }
-            
-            # Kiểm tra services
-            fr_healthy, fr_info = check_service_health(FACE_RECOGNITION_SERVICE, 'face_recognition')
-            df_healthy, df_info = check_service_health(DEEPFACE_SERVICE, 'deepface')
-            
-            status['services'] = {
-                'face_recognition': {
-                    'running': fr_healthy,
-                    'url': FACE_RECOGNITION_SERVICE,
-                    'info': fr_info
-                },
-                'deepface': {
-                    'running': df_healthy,
-                    'url': DEEPFACE_SERVICE,
-                    'info': df_info
-                }
-            }
-            
-            return jsonify({
-                'success': True,
-                'environments': status
-            })
-        except Exception as e:
+def read_request_image_bytes():
+    """Đọc bytes ảnh của request 1 lần (binary, multipart field 'image' hoặc JSON base64 / data URL)"""
+    mimetype = request.mimetype
+    if mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        return request.get_data()
+    if mimetype == 'multipart/form-data':
+        image_file = request.files.get('image')
+        return image_file.read() if image_file else None
+    
+    data = request.get_json(silent=True)
+    image_data = data.get('image') if isinstance(data, dict) else None
+    if not image_data:
+        return None
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
+
+def service_unavailable(service_name):
+    """
+    Kiểm tra trước khi gửi request tới service: trả về None nếu gửi được,
+    ngược lại (payload lỗi, status, headers). Service đang khởi động -> request chờ (xếp hàng) tối đa
+    READY_WAIT_TIMEOUT giây, quá thời gian thì báo "đang khởi động" thay vì "chưa chạy".
+    """
+    display_name = SERVICE_DISPLAY_NAMES[service_name]
+    if health_monitor.wait_until_ready(service_name, READY_WAIT_TIMEOUT) == STARTING:
+        return {
+            'success': False,
+            'starting': True,
+            'error': f'{display_name} đang khởi động, vui lòng thử lại sau ít giây',
+            'readiness': health_monitor.get_status(service_name)['readiness']
+        }, 503, {'Retry-After': '2'}
+    if not health_monitor.allow_request(service_name):
+        return {
+            'success': False,
+            'error': f'{display_name} chưa chạy. Vui lòng khởi động service trước.'
+        }, 503, {}
+    return None
+
+def proxy_response(response):
+    """Trả response của service về browser nguyên vẹn (không parse rồi jsonify lại)"""
+    return Response(
+        response.content,
+        status=response.status_code,
+        content_type=response.headers.get('Content-Type', 'application/json')
+    )
+
+
+
+@app.route('/')
+def index():
+    """Trang chủ"""
+    return render_template('index.html')
+
+@app.route('/api/check-environments', methods=['GET'])
+def check_environments():
+    """API kiểm tra trạng thái các môi trường và services"""
+    try:
+        # Kiểm tra môi trường Anaconda (cache theo TTL + mtime thư mục env, probe các env song song)
+        # ?refresh=1 bỏ qua cache
+        max_age = 0 if request.args.get('refresh') in ('1', 'true') else None
+        status = env_manager.get_all_env_status(max_age=max_age)
+        
+        # Trạng thái services (đã cache bởi health monitor, không gọi HTTP ở đây)
+        status['services'] = {
+            'face_recognition': health_monitor.get_status('face_recognition'),
+            'deepface': health_monitor.get_status('deepface')
+        }
+        
+        return jsonify({
+            'success': True,
+            'environments': status
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/setup-environment/<env_name>', methods=['POST'])
+def setup_environment(env_name):
+    """API thiết lập môi trường"""
+    try:
+        if env_name not in env_manager.envs:
             return jsonify({
                 'success': False,
-                'error': str(e)
-            }), 500
+                'error': f'Môi trường {env_name} không hợp lệ'
+            }), 400
+        
+        success = env_manager.setup_environment(env_name)
+        
+        return jsonify({
+            'success': success,
+            'message': f'Môi trường {env_name} đã được thiết lập' if success else 'Có lỗi xảy ra'
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-    @app.route('/api/setup-environment/<env_name>', methods=['POST'])
-    def setup_environment(env_name):
-        """API thiết lập môi trường"""
-        try:
-            if env_name not in env_manager.envs:
-                return jsonify({
-                    'success': False,
-                    'error': f'Môi trường {env_name} không hợp lệ'
-                }), 400
-            
-            success = env_manager.setup_environment(env_name)
-            
-            return jsonify({
-                'success': success,
-                'message': f'Môi trường {env_name} đã được thiết lập' if success else 'Có lỗi xảy ra'
-            })
-        except Exception as e:
+@app.route('/api/activate-environment/<env_name>', methods=['POST'])
+def activate_environment(env_name):
+    """API kích hoạt môi trường (kiểm tra và tự động thiết lập nếu cần)"""
+    try:
+        if env_name not in env_manager.envs:
             return jsonify({
                 'success': False,
-                'error': str(e)
-            }), 500
-
-    @app.route('/api/activate-environment/<env_name>', methods=['POST'])
-    def activate_environment(env_name):
-        """API kích hoạt môi trường (kiểm tra và tự động thiết lập nếu cần)"""
-        try:
-            if env_name not in env_manager.envs:
-                return jsonify({
-                    'success': False,
-                    'error': f'Môi trường {env_name} không hợp lệ'
-                }), 400
-            
-            # Kiểm tra môi trường có sẵn sàng không
-            env_exists = env_manager.check_env_exists(env_name)
-            
-            if not env_exists:
-                return jsonify({
-                    'success': False,
-                    'needs_setup': True,
-                    'error': f'Môi trường {env_name} chưa được thiết lập'
-                })
-            
-            packages_ok = env_manager.check_packages_installed(env_name)
-            
-            if not packages_ok:
-                return jsonify({
-                    'success': False,
-                    'needs_setup': True,
-                    'error': f'Môi trường {env_name} thiếu các packages cần thiết'
-                })
-            
+                'error': f'Môi trường {env_name} không hợp lệ'
+            }), 400
+        
+        # Kiểm tra môi trường có sẵn sàng không (exists + packages từ cùng 1 lần probe / cache)
+        env_status = env_manager.get_env_status(env_name)
+        
+        if not env_status['exists']:
             return jsonify({
-                'success': True,
-                'message': f'Môi trường {env_name} đã sẵn sàng',
-                'needs_setup': False
+                'success': False,
+                'needs_setup': True,
+                'error': f'Môi trường {env_name} chưa được thiết lập'
             })
-            
-        except Exception as e:
+        
+        if not env_status['packages_installed']:
             return jsonify({
                 'success': False,
-                'error': str(e)
-            }), 500
+                'needs_setup': True,
+                'error': f'Môi trường {env_name} thiếu các packages cần thiết'
+            })
+        
+        return jsonify({
+            'success': True,
+            'message': f'Môi trường {env_name} đã sẵn sàng',
+            'needs_setup': False
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-    @app.route('/api/face-recognition/register', methods=['POST'])
-    def register_face():
-        """API đăng ký khuôn mặt mới"""
-        try:
-            # Kiểm tra môi trường
-            if not env_manager.check_env_exists('face_recognition'):
-                return jsonify({
-                    'success': False,
-                    'error': 'Môi trường face_recognition chưa được thiết lập'
-                }), 400
-            
+@app.route('/api/face-recognition/register', methods=['POST'])
+def register_face():
+    """API đăng ký khuôn mặt mới"""
+    try:
+        # Kiểm tra môi trường (hot path: chỉ đọc cache / thư mục env, không spawn conda)
+        if not env_manager.env_exists_fast('face_recognition'):
+            return jsonify({
+                'success': False,
+                'error': 'Môi trường face_recognition chưa được thiết lập'
+            }), 400
+        
+        if request.mimetype == 'multipart/form-data':
+            # Browser gửi canvas.toBlob qua FormData (không base64)
+            name = request.form.get('name')
+            image_file = request.files.get('image')
+            image_bytes = image_file.read() if image_file else None
+        else:
             data = request.json
             name = data.get('name')
             image_data = data.get('image')
-            
-            if not name or not image_data:
-                return jsonify({
-                    'success': False,
-                    'error': 'Thiếu thông tin tên hoặc ảnh'
-                }), 400
-            
-            # Decode base64 image
-            image_bytes = base64.b64decode(image_data.split(',')[1])
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            # Tạo thư mục cho người dùng
-            user_folder = os.path.join('dataset', name)
-            os.makedirs(user_folder, exist_ok=True)
-            
-            # Đếm số ảnh hiện có
-            count = len(os.listdir(user_folder))
-            
-            # Lưu ảnh
-            filename = os.path.join(user_folder, f'img_{count}.jpg')
-            cv2.imwrite(filename, image)
-            
-            # QUAN TRỌNG: Thông báo cho service reload dataset
-            try:
-                requests.post(f'{FACE_RECOGNITION_SERVICE}/reload-dataset', timeout=5)
-            except:
-                pass  # Không báo lỗi nếu service chưa chạy
-            
-            return jsonify({
-                'success': True,
-                'message': f'Đã lưu ảnh {count + 1} cho {name}',
-                'count': count + 1
-            })
-        except Exception as e:
+            image_bytes = base64.b64decode(image_data.split(',')[1]) if image_data else None
+        
+        if not name or not image_bytes:
             return jsonify({
                 'success': False,
-                'error': str(e)
-            }), 500
-
-    @app.route('/api/face-recognition/recognize', methods=['POST'])
-    def recognize_face():
-        """API nhận diện khuôn mặt - Forward request đến face_recognition_service"""
+                'error': 'Thiếu thông tin tên hoặc ảnh'
+            }), 400
+        
+        # Decode ảnh
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        
+        # Tạo thư mục cho người dùng
+        user_folder = os.path.join('dataset', name)
+        os.makedirs(user_folder, exist_ok=True)
+        
+        # Đếm số ảnh hiện có
+        existing = os.listdir(user_folder)
+        count = len(existing)
+        
+        # Lưu ảnh: số thứ tự = số lớn nhất đã có + 1 (không dùng số file - sau khi xóa 1 ảnh sẽ trùng tên ảnh cũ),
+        # mở file với 'xb' để 2 lần đăng ký cùng lúc không ghi đè ảnh của nhau
+        success, encoded = cv2.imencode('.jpg', image)
+        if not success:
+            raise ValueError('Không encode được ảnh')
+        indices = [int(match.group(1)) for match in (re.fullmatch(r'img_(\d+)\.jpg', f) for f in existing) if match]
+        index = max(indices, default=-1) + 1
+        while True:
+            image_name = f'img_{index}.jpg'
+            try:
+                with open(os.path.join(user_folder, image_name), 'xb') as f:
+                    f.write(encoded.tobytes())
+                break
+            except FileExistsError:
+                index += 1
+        
+        # QUAN TRỌNG: Thông báo cho service encode ảnh mới (chỉ ảnh này, không reload cả dataset)
         try:
-            # Kiểm tra service có chạy không
-            service_healthy, _ = check_service_health(FACE_RECOGNITION_SERVICE, 'face_recognition')
-            if not service_healthy:
-                return jsonify({
-                    'success': False,
-                    'error': 'Face Recognition Service chưa chạy. Vui lòng khởi động service trước.'
-                }), 503
-            
-            data = request.json
-            image_data = data.get('image')
-            
-            if not image_data:
-                return jsonify({
-                    'success': False,
-                    'error': 'Không có dữ liệu ảnh'
-                }), 400
-            
-            # Forward request đến service
-            response = requests.post(
-                f'{FACE_RECOGNITION_SERVICE}/recognize',
-                json={'image': image_data},
-                timeout=REQUEST_TIMEOUT
+            service_clients['face_recognition'].post(
+                '/gallery/add',
+                json={'name': name, 'images': [image_name]}
             )
-            
-            return jsonify(response.json()), response.status_code
-            
-        except requests.exceptions.Timeout:
+        except:
+            pass  # Không báo lỗi nếu service chưa chạy
+        
+        return jsonify({
+            'success': True,
+            'message': f'Đã lưu ảnh {count + 1} cho {name}',
+            'count': count + 1
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/face-recognition/users/<name>', methods=['DELETE'])
+def delete_user(name):
+    """API xóa người dùng (hoặc 1 ảnh qua ?image=...) khỏi dataset và gallery của service"""
+    try:
+        image_name = request.args.get('image')
+        if os.path.basename(name) != name or name in ('.', '..') or \
+                (image_name is not None and os.path.basename(image_name) != image_name):
             return jsonify({
                 'success': False,
-                'error': 'Request timeout - Vui lòng thử lại'
-            }), 504
-        except requests.exceptions.ConnectionError:
+                'error': 'Tên người dùng hoặc tên ảnh không hợp lệ'
+            }), 400
+        
+        user_folder = os.path.join('dataset', name)
+        if not os.path.isdir(user_folder):
             return jsonify({
                 'success': False,
-                'error': 'Không thể kết nối đến Face Recognition Service'
-            }), 503
-        except Exception as e:
+                'error': f'Không tìm thấy người dùng {name}'
+            }), 404
+        
+        if image_name:
+            image_path = os.path.join(user_folder, image_name)
+            if not os.path.isfile(image_path):
+                return jsonify({
+                    'success': False,
+                    'error': f'Không tìm thấy ảnh {image_name}'
+                }), 404
+            os.remove(image_path)
+            payload = {'name': name, 'image': image_name}
+            message = f'Đã xóa ảnh {image_name} của {name}'
+        else:
+            shutil.rmtree(user_folder)
+            payload = {'name': name}
+            message = f'Đã xóa người dùng {name}'
+        
+        # Cập nhật gallery của service (chỉ người/ảnh bị xóa)
+        try:
+            service_clients['face_recognition'].post('/gallery/remove', json=payload)
+        except:
+            pass  # Không báo lỗi nếu service chưa chạy
+        
+        return jsonify({
+            'success': True,
+            'message': message
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/face-recognition/recognize', methods=['POST'])
+def recognize_face():
+    """API nhận diện khuôn mặt - Forward request đến face_recognition_service"""
+    try:
+        # Kiểm tra service qua trạng thái đã cache + circuit breaker (không probe /health mỗi request)
+        unavailable = service_unavailable('face_recognition')
+        if unavailable:
+            payload, status, headers = unavailable
+            return jsonify(payload), status, headers
+        
+        # Forward request đến service (stream body binary/JSON, không decode lại)
+        try:
+            response = forward_image_request('face_recognition', '/recognize')
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            health_monitor.record_failure('face_recognition')
+            raise
+        health_monitor.record_success('face_recognition')
+        
+        if response is None:
             return jsonify({
                 'success': False,
-                'error': str(e)
-            }), 500
+                'error': 'Không có dữ liệu ảnh'
+            }), 400
+        
+        return proxy_response(response)
+        
+    except requests.exceptions.Timeout:
+        return jsonify({
+            'success': False,
+            'error': 'Request timeout - Vui lòng thử lại'
+        }), 504
+    except requests.exceptions.ConnectionError:
+        return jsonify({
+            'success': False,
+            'error': 'Không thể kết nối đến Face Recognition Service'
+        }), 503
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def process_stream_frame(frame_bytes, session_id):
+    """Gửi 1 frame của phiên streaming tới face_recognition_service qua connection pool"""
+    unavailable = service_unavailable('face_recognition')
+    if unavailable:
+        return unavailable[0]
+    
+    try:
+        response = service_clients['face_recognition'].post(
+            '/recognize',
+            data=frame_bytes,
+            headers={'Content-Type': 'image/jpeg', 'X-Session-Id': session_id}
+        )
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+        health_monitor.record_failure('face_recognition')
+        return {
+            'success': False,
+            'error': 'Không thể kết nối đến Face Recognition Service'
+        }
+    
+    health_monitor.record_success('face_recognition')
+    return stream_frame_result(response.status_code, response.json)
+
+def stream_frame_result(status_code, read_json):
+    """
+    Kết quả 1 frame streaming từ response của backend. Response lỗi / không phải JSON (vd trang lỗi HTML của proxy)
+    trả về dict lỗi thay vì raise, để phiên WebSocket không bị đóng và browser tiếp tục gửi frame.
+    """
+    try:
+        result = read_json()
+    except ValueError:
+        result = None
+    if not isinstance(result, dict):
+        return {
+            'success': False,
+            'error': f'Face Recognition Service trả về response không hợp lệ (HTTP {status_code})'
+        }
+    if not 200 <= status_code < 300:
+        result['success'] = False
+        result.setdefault('error', f'Face Recognition Service lỗi (HTTP {status_code})')
+    return result
+
+if sock is not None:
+    @sock.route('/ws/recognize')
+    def recognize_stream(ws):
+        """
+        WebSocket nhận diện realtime: browser gửi frame khi đã nhận kết quả frame trước,
+        gateway chỉ xử lý frame mới nhất và đẩy kết quả kèm frame_id
+        """
+        health_monitor.start()
+        session_id = uuid.uuid4().hex
+        run_recognition_stream(ws, lambda frame_bytes: process_stream_frame(frame_bytes, session_id))
 
-    @app.route('/api/deepface/analyze', methods=['POST'])
-    def analyze_face():
-        """API phân tích khuôn mặt với DeepFace - Forward request đến deepface_service"""
+@app.route('/api/deepface/analyze', methods=['POST'])
+def analyze_face():
+    """API phân tích khuôn mặt với DeepFace - Forward request đến deepface_service"""
+    try:
+        # Kiểm tra service qua trạng thái đã cache + circuit breaker (không probe /health mỗi request)
+        unavailable = service_unavailable('deepface')
+        if unavailable:
+            payload, status, headers = unavailable
+            return jsonify(payload), status, headers
+        
+        # Forward request đến service (stream body binary/JSON, không decode lại)
         try:
-            # Kiểm tra service có chạy không
-            service_healthy, _ = check_service_health(DEEPFACE_SERVICE, 'deepface')
-            if not service_healthy:
-                return jsonify({
-                    'success': False,
-                    'error': 'DeepFace Service chưa chạy. Vui lòng khởi động service trước.'
-                }), 503
-            
-            data = request.json
-            image_data = data.get('image')
-            
-            if not image_data:
+            response = forward_image_request('deepface', '/analyze')
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            health_monitor.record_failure('deepface')
+            raise
+        health_monitor.record_success('deepface')
+        
+        if response is None:
+            return jsonify({
+                'success': False,
+                'error': 'Không có dữ liệu ảnh'
+            }), 400
+        
+        return proxy_response(response)
+        
+    except requests.exceptions.Timeout:
+        return jsonify({
+            'success': False,
+            'error': 'Request timeout - Phân tích mất quá nhiều thời gian'
+        }), 504
+    except requests.exceptions.ConnectionError:
+        return jsonify({
+            'success': False,
+            'error': 'Không thể kết nối đến DeepFace Service'
+        }), 503
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Lỗi không xác định: {str(e)}'
+        }), 500
+
+def _call_service(service_name, path, image_bytes, params):
+    """POST ảnh binary tới service, ghi nhận kết quả cho circuit breaker; trả về (JSON kết quả, thời gian, status)"""
+    start = time.time()
+    try:
+        # Gọi từ thread fanout (không có request context) thì không tính vào upstream - request chỉ chờ ở result()
+        with upstream_timer():
+            response = service_clients[service_name].post(
+                path,
+                data=image_bytes,
+                params=params,
+                headers={'Content-Type': 'application/octet-stream'}
+            )
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+        health_monitor.record_failure(service_name)
+        raise
+    health_monitor.record_success(service_name)
+    return response.json(), round(time.time() - start, 3), response.status_code
+
+def upstream_error_status(status_code):
+    """Status trả client khi service báo success: false - giữ status lỗi của service (400 ảnh hỏng, 503 đang khởi động...)"""
+    return status_code if status_code >= 400 else 500
+
+def no_faces_result(timing, start_time):
+    """Kết quả /api/recognize-analyze khi /detect không tìm thấy khuôn mặt nào"""
+    return {
+        'success': True,
+        'faces': [],
+        'total_faces': 0,
+        'timing': timing,
+        'processing_time': round(time.time() - start_time, 3),
+        'message': 'Không tìm thấy khuôn mặt'
+    }
+
+def analysis_request_params(query_params, body, boxes_param):
+    """
+    Tham số gửi deepface_service /analyze: query string của client, 'actions' trong body JSON
+    (chỉ khi query string không có) và các box đã detect để DeepFace không detect lại.
+    """
+    params = dict(query_params)
+    if body is not None and 'actions' not in params:
+        actions = body.get('actions')
+        if actions:
+            params['actions'] = actions if isinstance(actions, str) else ','.join(actions)
+    params.update({'faces': 'all', 'boxes': boxes_param})
+    return params
+
+def deepface_skipped_error():
+    """Lý do không có thuộc tính khi không gửi được request tới DeepFace"""
+    if health_monitor.get_state('deepface') == STARTING:
+        return 'DeepFace Service đang khởi động'
+    return 'DeepFace Service chưa chạy'
+
+def merge_recognition_analysis(recognition, analysis, analysis_error, timing, start_time):
+    """
+    Gộp kết quả /recognize và /analyze theo từng khuôn mặt (cùng thứ tự box đã detect).
+    analysis None (DeepFace lỗi / chưa chạy) hoặc không success -> vẫn trả về danh tính,
+    thuộc tính để trống kèm analysis_error.
+    """
+    analysis_faces = [None] * len(recognition['faces'])
+    if analysis is not None:
+        if analysis.get('success'):
+            analysis_faces = analysis['faces']
+            analysis_error = None
+        else:
+            analysis_error = analysis.get('error')
+    
+    faces = []
+    for face, attributes in zip(recognition['faces'], analysis_faces):
+        if attributes is not None:
+            attributes = {key: value for key, value in attributes.items() if key not in ('region', 'face_confidence')}
+        faces.append({**face, 'attributes': attributes})
+    
+    result = {
+        'success': True,
+        'faces': faces,
+        'total_faces': len(faces),
+        'timing': timing,
+        'processing_time': round(time.time() - start_time, 3)
+    }
+    if analysis_error:
+        result['analysis_error'] = analysis_error
+    return result
+
+@app.route('/api/recognize-analyze', methods=['POST'])
+def recognize_and_analyze():
+    """
+    API nhận diện + phân tích thuộc tính trong 1 request:
+    đọc ảnh 1 lần -> face_recognition_service /detect (detect 1 lần) -> song song /recognize và
+    deepface /analyze trên cùng các box (không service nào detect lại) -> gộp kết quả theo từng khuôn mặt.
+    Query string (vd ?actions=emotion,age, ?cache=0) được chuyển sang deepface_service.
+    """
+    try:
+        unavailable = service_unavailable('face_recognition')
+        if unavailable:
+            payload, status, headers = unavailable
+            return jsonify(payload), status, headers
+        
+        body = None
+        if request.is_json:
+            body = request.get_json(silent=True)
+            if not isinstance(body, dict):
                 return jsonify({
                     'success': False,
-                    'error': 'Không có dữ liệu ảnh'
+                    'error': 'Body JSON phải là object'
                 }), 400
-            
-            # Forward request đến service
-            response = requests.post(
-                f'{DEEPFACE_SERVICE}/analyze',
-                json={'image': image_data},
-                timeout=REQUEST_TIMEOUT
-            )
-            
-            return jsonify(response.json()), response.status_code
-            
-        except requests.exceptions.Timeout:
-            return jsonify({
-                'success': False,
-                'error': 'Request timeout - Phân tích mất quá nhiều thời gian'
-            }), 504
-        except requests.exceptions.ConnectionError:
-            return jsonify({
-                'success': False,
-                'error': 'Không thể kết nối đến DeepFace Service'
-            }), 503
-        except Exception as e:
+        
+        image_bytes = read_request_image_bytes()
+        if not image_bytes:
             return jsonify({
                 'success': False,
-                'error': f'Lỗi không xác định: {str(e)}'
-            }), 500
-
-    @app.route('/api/get-registered-users', methods=['GET'])
-    def get_registered_users():
-        """API lấy danh sách người dùng đã đăng ký"""
+                'error': 'Không có dữ liệu ảnh'
+            }), 400
+        
+        start_time = time.time()
+        timing = {}
+        detection, timing['detect'], status = _call_service('face_recognition', '/detect', image_bytes, None)
+        if not detection.get('success'):
+            return jsonify(detection), upstream_error_status(status)
+        
+        boxes = detection['boxes']
+        if not boxes:
+            return jsonify(no_faces_result(timing, start_time))
+        
+        boxes_param = json.dumps(boxes)
+        analysis_params = analysis_request_params(request.args.to_dict(), body, boxes_param)
+        
+        # Không chờ DeepFace đang khởi động: vẫn trả về danh tính, thuộc tính để trống
+        analysis_future = None
+        if health_monitor.get_state('deepface') in (READY, UNKNOWN) and health_monitor.allow_request('deepface'):
+            analysis_future = _fanout_executor.submit(
+                _call_service, 'deepface', '/analyze', image_bytes, analysis_params
+            )
+        
+        # Nhận diện chạy trên thread của request trong lúc DeepFace phân tích
         try:
-            dataset_path = 'dataset'
-            if not os.path.exists(dataset_path):
-                return jsonify({
-                    'success': True,
-                    'users': []
-                })
-            
-            users = []
-            for user_folder in os.listdir(dataset_path):
-                folder_path = os.path.join(dataset_path, user_folder)
-                if os.path.isdir(folder_path):
-                    image_count = len([f for f in os.listdir(folder_path) if f.endswith(('.jpg', '.jpeg', '.png'))])
-                    users.append({
-                        'name': user_folder,
-                        'image_count': image_count
-                    })
-            
+            recognition, timing['recognize'], status = _call_service(
+                'face_recognition', '/recognize', image_bytes, {'boxes': boxes_param}
+            )
+        except Exception:
+            if analysis_future is not None:
+                analysis_future.cancel()
+            raise
+        if not recognition.get('success'):
+            return jsonify(recognition), upstream_error_status(status)
+        
+        # DeepFace lỗi / chưa chạy -> vẫn trả về danh tính, kèm lý do không có thuộc tính
+        analysis = None
+        analysis_error = deepface_skipped_error()
+        if analysis_future is not None:
+            try:
+                with upstream_timer():
+                    analysis, timing['analyze'], _ = analysis_future.result()
+            except requests.exceptions.RequestException as e:
+                analysis_error = f'Không thể kết nối đến DeepFace Service: {str(e)}'
+        
+        return jsonify(merge_recognition_analysis(recognition, analysis, analysis_error, timing, start_time))
+        
+    except requests.exceptions.Timeout:
+        return jsonify({
+            'success': False,
+            'error': 'Request timeout - Vui lòng thử lại'
+        }), 504
+    except requests.exceptions.ConnectionError:
+        return jsonify({
+            'success': False,
+            'error': 'Không thể kết nối đến Face Recognition Service'
+        }), 503
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/gateway/stats', methods=['GET'])
+def gateway_stats():
+    """API thống kê connection pool gateway -> service (để tinh chỉnh GATEWAY_POOL_SIZE)"""
+    return jsonify({
+        'success': True,
+        'pools': {name: client.stats() for name, client in service_clients.items()}
+    })
+
+@app.route('/api/get-registered-users', methods=['GET'])
+def get_registered_users():
+    """API lấy danh sách người dùng đã đăng ký"""
+    try:
+        dataset_path = 'dataset'
+        if not os.path.exists(dataset_path):
             return jsonify({
                 'success': True,
-                'users': users
+                'users': []
             })
-        except Exception as e:
-            return jsonify({
-                'success': False,
-                'error': str(e)
-            }), 500
-
-    if __name__ == '__main__':
-        print("\n" + "="*60)
-        print("KHỞI ĐỘNG FACE RECOGNITION WEB APPLICATION")
-        print("="*60)
-        print("Đang kiểm tra các môi trường...")
-        
-        # Kiểm tra trạng thái môi trường
-        for env_name in env_manager.envs.keys():
-            exists = env_manager.check_env_exists(env_name)
-            if exists:
-                packages_ok = env_manager.check_packages_installed(env_name)
-                status = "✓ SẴN SÀNG" if packages_ok else "⚠ THIẾU PACKAGES"
-            else:
-                status = "✗ CHƯA CÀI"
-            print(f"  {env_name}: {status}")
-        
-        print("\nServer đang chạy tại: http://localhost:5000")
-        print("Nhấn Ctrl+C để dừng server")
-        print("="*60 + "\n")
-        
-        app.run(debug=True, host='0.0.0.0', port=5000)
+        
+        users = []
+        for user_folder in os.listdir(dataset_path):
+            folder_path = os.path.join(dataset_path, user_folder)
+            if os.path.isdir(folder_path):
+                image_count = len([f for f in os.listdir(folder_path) if f.endswith(('.jpg', '.jpeg', '.png'))])
+                users.append({
+                    'name': user_folder,
+                    'image_count': image_count
+                })
+        
+        return jsonify({
+            'success': True,
+            'users': users
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+if __name__ == '__main__':
+    print("\n" + "="*60)
+    print("KHỞI ĐỘNG FACE RECOGNITION WEB APPLICATION")
+    print("="*60)
+    print("Đang kiểm tra các môi trường...")
+    
+    # Kiểm tra trạng thái môi trường (song song, kết quả được cache cho các request sau)
+    for env_name, env_status in env_manager.get_all_env_status().items():
+        if env_status['exists']:
+            status = "✓ SẴN SÀNG" if env_status['packages_installed'] else "⚠ THIẾU PACKAGES"
+        else:
+            status = "✗ CHƯA CÀI"
+        print(f"  {env_name}: {status}")
+    
+    print("\nServer đang chạy tại: http://localhost:5000")
+    print("Nhấn Ctrl+C để dừng server")
+    print("="*60 + "\n")
+    
+    app.run(debug=True, host='0.0.0.0', port=5000)
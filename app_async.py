@@ -0,0 +1,485 @@
+"""
+Async Gateway - Chế độ phục vụ bất đồng bộ (asyncio + aiohttp) cho gateway
+Flask dev server (app.py) giữ 1 thread cho mỗi request suốt thời gian chờ backend (tới REQUEST_TIMEOUT giây),
+nên số phiên webcam đồng thời bị giới hạn bởi số thread. Ở đây các route nóng chạy trên 1 event loop,
+gọi backend bằng HTTP non-blocking (aiohttp, keep-alive), các lần gọi độc lập (recognize + analyze) chạy song song:
+- /api/face-recognition/recognize, /api/deepface/analyze, /api/recognize-analyze, /ws/recognize
+- /api/check-environments, /api/gateway/stats
+Các route còn lại (trang chủ, static, đăng ký, thiết lập môi trường...) được chuyển cho Flask app của app.py
+trong thread pool, nên giao diện hoạt động y như chạy app.py. Config, health monitor, circuit breaker dùng chung app.py.
+Chạy (thay cho python app.py):
+    pip install aiohttp
+    python app_async.py --port 5000
+"""
+import argparse
+import asyncio
+import base64
+import contextvars
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+import app as sync_app
+from realtime_stream import run_recognition_stream_async
+from service_health import STARTING, UNKNOWN, READY
+
+# Số kết nối keep-alive tối đa mỗi backend (request vượt quá chờ kết nối rảnh, không tạo thread)
+ASYNC_POOL_SIZE = int(os.environ.get('GATEWAY_ASYNC_POOL_SIZE', '100'))
+# Thread chạy các route Flask không có bản async (đăng ký, thiết lập môi trường, static...)
+FALLBACK_THREADS = int(os.environ.get('GATEWAY_FALLBACK_THREADS', '8'))
+
+# Header hop-by-hop không chuyển tiếp giữa Flask app và client
+_HOP_BY_HOP_HEADERS = {'connection', 'content-length', 'transfer-encoding', 'keep-alive'}
+
+# Thời gian request hiện tại chờ service (upstream của Server-Timing, giống g.upstream_time của app.py)
+_upstream_time = contextvars.ContextVar('upstream_time', default=None)
+
+
+class BackendResponse:
+    """Response của backend đã đọc xong body"""
+
+    def __init__(self, status, content_type, body):
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class AsyncServiceClient:
+    """Client keep-alive non-blocking cho 1 backend (tương ứng ServiceClient của gateway sync)"""
+
+    def __init__(self, base_url, pool_size=100, connect_timeout=2, read_timeout=30, max_retries=2):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self._session = None
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._requests = 0
+        self._errors = 0
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def post(self, path, data=None, params=None, headers=None):
+        """POST và đọc body; chỉ retry khi không kết nối được (request chưa được gửi đi) - an toàn cho POST"""
+        self._requests += 1
+        self._in_flight += 1
+        self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    async with self._session.post(f'{self.base_url}{path}', data=data, params=params,
+                                                  headers=headers) as response:
+                        body = await response.read()
+                        return BackendResponse(response.status, response.content_type, body)
+                except aiohttp.ClientConnectorError:
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(0.1 * (2 ** attempt))
+        except Exception:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+    def stats(self):
+        connector = self._session.connector if self._session is not None else None
+        return {
+            'base_url': self.base_url,
+            'pool_size': self.pool_size,
+            'in_flight': self._in_flight,
+            'peak_in_flight': self._peak_in_flight,
+            'requests': self._requests,
+            'errors': self._errors,
+            'open_connections': len(connector._conns) if connector is not None else 0
+        }
+
+
+# Lỗi backend giống nhánh except requests.exceptions.Timeout / ConnectionError của gateway sync
+BACKEND_TIMEOUT_ERRORS = (asyncio.TimeoutError, aiohttp.ServerTimeoutError)
+BACKEND_CONNECTION_ERRORS = (aiohttp.ClientConnectionError,)
+
+service_clients = {
+    name: AsyncServiceClient(
+        url,
+        pool_size=ASYNC_POOL_SIZE,
+        connect_timeout=sync_app.CONNECT_TIMEOUT,
+        read_timeout=sync_app.REQUEST_TIMEOUT,
+        max_retries=sync_app.MAX_RETRIES
+    )
+    for name, url in (('face_recognition', sync_app.FACE_RECOGNITION_SERVICE),
+                      ('deepface', sync_app.DEEPFACE_SERVICE))
+}
+
+health_monitor = sync_app.health_monitor
+_fallback_executor = ThreadPoolExecutor(max_workers=FALLBACK_THREADS, thread_name_prefix='gateway-wsgi')
+
+
+@web.middleware
+async def server_timing(request, handler):
+    """Header Server-Timing (gateway, upstream) như app.py để load test tách overhead từng chặng"""
+    start = time.perf_counter()
+    upstream = [0.0]
+    token = _upstream_time.set(upstream)
+    try:
+        response = await handler(request)
+    finally:
+        _upstream_time.reset(token)
+    if not response.prepared:  # WebSocket đã gửi header
+        gateway_ms = (time.perf_counter() - start) * 1000
+        response.headers['Server-Timing'] = f'gateway;dur={gateway_ms:.2f}, upstream;dur={upstream[0] * 1000:.2f}'
+    return response
+
+
+async def upstream(awaitable):
+    """Chờ 1 lời gọi service, cộng thời gian chờ vào upstream của request hiện tại"""
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        accumulated = _upstream_time.get()
+        if accumulated is not None:
+            accumulated[0] += time.perf_counter() - start
+
+
+def error_response(message, status, headers=None, **extra):
+    return web.json_response({'success': False, 'error': message, **extra}, status=status, headers=headers)
+
+
+async def service_unavailable(service_name):
+    """
+    Bản async của app.service_unavailable: service đang khởi động -> chờ (không chiếm thread)
+    tối đa READY_WAIT_TIMEOUT giây; trả về None nếu gửi được, ngược lại response lỗi 503.
+    """
+    deadline = time.time() + sync_app.READY_WAIT_TIMEOUT
+    while health_monitor.get_state(service_name) == STARTING and time.time() < deadline:
+        await asyncio.sleep(min(0.1, max(0.0, deadline - time.time())))
+
+    display_name = sync_app.SERVICE_DISPLAY_NAMES[service_name]
+    if health_monitor.get_state(service_name) == STARTING:
+        return error_response(
+            f'{display_name} đang khởi động, vui lòng thử lại sau ít giây', 503,
+            headers={'Retry-After': '2'},
+            starting=True,
+            readiness=health_monitor.get_status(service_name)['readiness']
+        )
+    if not health_monitor.allow_request(service_name):
+        return error_response(f'{display_name} chưa chạy. Vui lòng khởi động service trước.', 503)
+    return None
+
+
+async def read_request_image_bytes(request):
+    """Đọc bytes ảnh của request (binary, multipart field 'image' hoặc JSON base64 / data URL)"""
+    content_type = request.content_type
+    if content_type.startswith('image/') or content_type == 'application/octet-stream':
+        return await request.read()
+    if content_type == 'multipart/form-data':
+        form = await request.post()
+        image_file = form.get('image')
+        return image_file.file.read() if image_file is not None and hasattr(image_file, 'file') else None
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    image_data = (data or {}).get('image') if isinstance(data, dict) else None
+    if not image_data:
+        return None
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
+
+
+async def call_service(service_name, path, data, params=None, headers=None):
+    """POST tới service, ghi nhận kết quả cho circuit breaker"""
+    try:
+        response = await service_clients[service_name].post(path, data=data, params=params, headers=headers)
+    except BACKEND_TIMEOUT_ERRORS + BACKEND_CONNECTION_ERRORS:
+        health_monitor.record_failure(service_name)
+        raise
+    health_monitor.record_success(service_name)
+    return response
+
+
+async def forward_image_request(request, service_name, path, timeout_message):
+    """Forward nguyên body + Content-Type + query string của request sang service, trả response về nguyên vẹn"""
+    unavailable = await service_unavailable(service_name)
+    if unavailable is not None:
+        return unavailable
+
+    body = await request.read()
+    if not body:
+        return error_response('Không có dữ liệu ảnh', 400)
+
+    display_name = sync_app.SERVICE_DISPLAY_NAMES[service_name]
+    try:
+        response = await upstream(call_service(
+            service_name, path, body,
+            params=request.query,
+            headers={'Content-Type': request.headers.get('Content-Type', 'application/octet-stream')}
+        ))
+    except BACKEND_TIMEOUT_ERRORS:
+        return error_response(timeout_message, 504)
+    except BACKEND_CONNECTION_ERRORS:
+        return error_response(f'Không thể kết nối đến {display_name}', 503)
+    return web.Response(body=response.body, status=response.status,
+                        content_type=response.content_type or 'application/json')
+
+
+async def recognize_face(request):
+    """API nhận diện khuôn mặt - Forward request đến face_recognition_service"""
+    try:
+        return await forward_image_request(request, 'face_recognition', '/recognize',
+                                           'Request timeout - Vui lòng thử lại')
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+async def analyze_face(request):
+    """API phân tích khuôn mặt với DeepFace - Forward request đến deepface_service"""
+    try:
+        return await forward_image_request(request, 'deepface', '/analyze',
+                                           'Request timeout - Phân tích mất quá nhiều thời gian')
+    except Exception as e:
+        return error_response(f'Lỗi không xác định: {str(e)}', 500)
+
+
+async def _call_json(service_name, path, image_bytes, params):
+    """(JSON kết quả, thời gian, status) của 1 lần gọi service với ảnh binary"""
+    start = time.time()
+    response = await call_service(service_name, path, image_bytes, params=params,
+                                  headers={'Content-Type': 'application/octet-stream'})
+    return response.json(), round(time.time() - start, 3), response.status
+
+
+async def recognize_and_analyze(request):
+    """
+    Giống /api/recognize-analyze của app.py: /detect 1 lần rồi recognize (face_recognition_service)
+    và analyze (deepface_service) trên cùng các box chạy song song trên event loop.
+    """
+    try:
+        unavailable = await service_unavailable('face_recognition')
+        if unavailable is not None:
+            return unavailable
+
+        body = None
+        if request.content_type == 'application/json':
+            try:
+                body = await request.json()
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                return error_response('Body JSON phải là object', 400)
+
+        image_bytes = await read_request_image_bytes(request)
+        if not image_bytes:
+            return error_response('Không có dữ liệu ảnh', 400)
+
+        start_time = time.time()
+        timing = {}
+        detection, timing['detect'], status = await upstream(
+            _call_json('face_recognition', '/detect', image_bytes, None)
+        )
+        if not detection.get('success'):
+            return web.json_response(detection, status=sync_app.upstream_error_status(status))
+
+        boxes = detection['boxes']
+        if not boxes:
+            return web.json_response(sync_app.no_faces_result(timing, start_time))
+
+        boxes_param = json.dumps(boxes)
+        analysis_params = sync_app.analysis_request_params(request.query, body, boxes_param)
+
+        # Không chờ DeepFace đang khởi động: vẫn trả về danh tính, thuộc tính để trống
+        analysis_task = None
+        if health_monitor.get_state('deepface') in (READY, UNKNOWN) and health_monitor.allow_request('deepface'):
+            analysis_task = asyncio.ensure_future(
+                _call_json('deepface', '/analyze', image_bytes, analysis_params)
+            )
+
+        try:
+            recognition, timing['recognize'], status = await upstream(_call_json(
+                'face_recognition', '/recognize', image_bytes, {'boxes': boxes_param}
+            ))
+        except Exception:
+            if analysis_task is not None:
+                analysis_task.cancel()
+            raise
+        if not recognition.get('success'):
+            if analysis_task is not None:
+                analysis_task.cancel()
+            return web.json_response(recognition, status=sync_app.upstream_error_status(status))
+
+        # DeepFace lỗi / chưa chạy -> vẫn trả về danh tính, kèm lý do không có thuộc tính
+        analysis = None
+        analysis_error = sync_app.deepface_skipped_error()
+        if analysis_task is not None:
+            try:
+                analysis, timing['analyze'], _ = await upstream(analysis_task)
+            # ValueError: DeepFace trả trang lỗi không phải JSON (requests coi là RequestException ở gateway sync)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                analysis_error = f'Không thể kết nối đến DeepFace Service: {str(e)}'
+
+        return web.json_response(
+            sync_app.merge_recognition_analysis(recognition, analysis, analysis_error, timing, start_time)
+        )
+
+    except BACKEND_TIMEOUT_ERRORS:
+        return error_response('Request timeout - Vui lòng thử lại', 504)
+    except BACKEND_CONNECTION_ERRORS:
+        return error_response('Không thể kết nối đến Face Recognition Service', 503)
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+async def check_environments(request):
+    """API kiểm tra trạng thái các môi trường và services (probe conda chạy trong thread, không chặn event loop)"""
+    try:
+        max_age = 0 if request.query.get('refresh') in ('1', 'true') else None
+        loop = asyncio.get_running_loop()
+        status = await loop.run_in_executor(
+            _fallback_executor, lambda: sync_app.env_manager.get_all_env_status(max_age=max_age)
+        )
+        status['services'] = {
+            'face_recognition': health_monitor.get_status('face_recognition'),
+            'deepface': health_monitor.get_status('deepface')
+        }
+        return web.json_response({'success': True, 'environments': status})
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+async def gateway_stats(request):
+    """API thống kê kết nối gateway -> service"""
+    return web.json_response({
+        'success': True,
+        'mode': 'async',
+        'pools': {name: client.stats() for name, client in service_clients.items()}
+    })
+
+
+async def process_stream_frame(frame_bytes, session_id):
+    """Gửi 1 frame của phiên streaming tới face_recognition_service"""
+    unavailable = await service_unavailable('face_recognition')
+    if unavailable is not None:
+        return json.loads(unavailable.body)
+
+    try:
+        response = await call_service(
+            'face_recognition', '/recognize', frame_bytes,
+            headers={'Content-Type': 'image/jpeg', 'X-Session-Id': session_id}
+        )
+    except BACKEND_TIMEOUT_ERRORS + BACKEND_CONNECTION_ERRORS:
+        return {
+            'success': False,
+            'error': 'Không thể kết nối đến Face Recognition Service'
+        }
+    return sync_app.stream_frame_result(response.status, response.json)
+
+
+async def recognize_stream(request):
+    """WebSocket nhận diện realtime (cùng giao thức với /ws/recognize của app.py), mỗi phiên là 1 coroutine"""
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    session_id = uuid.uuid4().hex
+
+    async def receive():
+        message = await ws.receive()
+        if message.type == aiohttp.WSMsgType.BINARY:
+            return message.data
+        if message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING,
+                            aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+            return None
+        return b''  # Message text -> bỏ qua
+
+    await run_recognition_stream_async(
+        receive, ws.send_str, lambda frame_bytes: process_stream_frame(frame_bytes, session_id)
+    )
+    await ws.close()
+    return ws
+
+
+async def wsgi_fallback(request):
+    """Chuyển request của các route chưa có bản async cho Flask app (chạy trong thread pool)"""
+    body = await request.read()
+    builder = EnvironBuilder(
+        path=request.path,
+        method=request.method,
+        headers=[(key, value) for key, value in request.headers.items() if key.lower() != 'content-length'],
+        data=body,
+        query_string=request.query_string
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    environ['REMOTE_ADDR'] = request.remote or ''
+
+    loop = asyncio.get_running_loop()
+    response = await loop.run_in_executor(
+        _fallback_executor, lambda: WerkzeugResponse.from_app(sync_app.app.wsgi_app, environ, buffered=True)
+    )
+    headers = [(key, value) for key, value in response.headers.items() if key.lower() not in _HOP_BY_HOP_HEADERS]
+    return web.Response(body=response.get_data(), status=response.status_code, headers=headers)
+
+
+async def _on_startup(application):
+    for client in service_clients.values():
+        await client.start()
+    health_monitor.start()
+
+
+async def _on_cleanup(application):
+    for client in service_clients.values():
+        await client.close()
+
+
+def create_app():
+    # Mặc định aiohttp giới hạn body 1 MB - ảnh upload có thể lớn hơn
+    application = web.Application(client_max_size=32 * 1024 ** 2, middlewares=[server_timing])
+    application.router.add_get('/api/check-environments', check_environments)
+    application.router.add_post('/api/face-recognition/recognize', recognize_face)
+    application.router.add_post('/api/deepface/analyze', analyze_face)
+    application.router.add_post('/api/recognize-analyze', recognize_and_analyze)
+    application.router.add_get('/api/gateway/stats', gateway_stats)
+    application.router.add_get('/ws/recognize', recognize_stream)
+    application.router.add_route('*', '/{tail:.*}', wsgi_fallback)
+    application.on_startup.append(_on_startup)
+    application.on_cleanup.append(_on_cleanup)
+    return application
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gateway async (aiohttp)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("KHỞI ĐỘNG FACE RECOGNITION WEB APPLICATION (ASYNC)")
+    print("="*60)
+    print(f"Server đang chạy tại: http://localhost:{args.port}")
+    print(f"Kết nối tối đa mỗi backend: {ASYNC_POOL_SIZE}")
+    print("Nhấn Ctrl+C để dừng server")
+    print("="*60 + "\n")
+    web.run_app(create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
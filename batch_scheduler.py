@@ -0,0 +1,111 @@
+"""
+Batch Scheduler - Gom các request đồng thời thành batch nhỏ (micro-batching)
+Request được xếp hàng, 1 thread worker gom các request tới trong cửa sổ window_ms (hoặc đủ max_batch_size)
+rồi gọi process_batch 1 lần cho cả batch; mỗi caller nhận lại đúng kết quả của mình.
+Chỉ chờ hết cửa sổ khi có request khác đang xếp hàng / đang được service xử lý (in_flight_fn):
+request lẻ lúc tải thấp được xử lý ngay.
+Các request không còn tranh GIL / BLAS thread với nhau và bước so khớp gallery chỉ cần 1 phép nhân ma trận.
+"""
+import queue
+import threading
+import time
+
+
+class _PendingItem:
+    __slots__ = ('payload', 'result', 'error', 'done')
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatchScheduler:
+    """
+    process_batch(list payload) -> list kết quả cùng thứ tự.
+    Lỗi của process_batch được trả về cho mọi caller trong batch đó.
+    in_flight_fn() -> số request service đang xử lý (kể cả request hiện tại), vd request còn đang decode ảnh
+    và sắp vào hàng; None = chỉ xét hàng đợi.
+    """
+
+    def __init__(self, process_batch, window_ms=5, max_batch_size=8, name='micro-batch', in_flight_fn=None):
+        self.process_batch = process_batch
+        self.in_flight_fn = in_flight_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'items': 0,
+            'max_batch': 0,
+            'immediate': 0,
+            'queue_wait_total': 0.0
+        }
+        self._worker = threading.Thread(target=self._run, daemon=True, name=name)
+        self._worker.start()
+
+    def submit(self, payload):
+        """Xếp hàng 1 request và chờ kết quả (chạy trên thread của caller)"""
+        item = _PendingItem(payload)
+        self._queue.put((time.perf_counter(), item))
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _collect(self):
+        """
+        Lấy request đầu tiên (chờ không giới hạn). Không có request nào khác đang chờ / đang xử lý -> chạy ngay;
+        ngược lại gom thêm tới hết cửa sổ hoặc đủ batch.
+        """
+        batch = [self._queue.get()]
+        if self._queue.empty() and (self.in_flight_fn is None or self.in_flight_fn() <= 1):
+            with self._lock:
+                self._stats['immediate'] += 1
+            return batch
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            items = [item for _, item in batch]
+            try:
+                results = self.process_batch([item.payload for item in items])
+                for item, result in zip(items, results):
+                    item.result = result
+            except Exception as e:
+                for item in items:
+                    item.error = e
+            finally:
+                for item in items:
+                    item.done.set()
+
+            with self._lock:
+                self._stats['batches'] += 1
+                self._stats['items'] += len(items)
+                self._stats['max_batch'] = max(self._stats['max_batch'], len(items))
+                self._stats['queue_wait_total'] += sum(started - enqueued for enqueued, _ in batch)
+
+    def queue_depth(self):
+        """Số request đang chờ được gom vào batch"""
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self.queue_depth()
+        stats['window_ms'] = self.window * 1000
+        stats['max_batch_size'] = self.max_batch_size
+        stats['avg_batch'] = round(stats['items'] / stats['batches'], 2) if stats['batches'] else 0
+        stats['avg_queue_wait_ms'] = round(stats.pop('queue_wait_total') / stats['items'] * 1000, 2) if stats['items'] else 0
+        return stats
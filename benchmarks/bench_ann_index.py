@@ -0,0 +1,70 @@
+"""
+Benchmark: recall@1 và độ trễ của IVF index so với tìm kiếm chính xác (brute force)
+Chạy:
+    python benchmarks/bench_ann_index.py --size 100000 --nprobe 1 2 4 8 16 32
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import IVFIndex
+from face_gallery import FaceGallery
+
+
+def timed_search(gallery, queries, batch):
+    """Trả về (names, thời gian trung bình ms cho mỗi frame gồm `batch` khuôn mặt)"""
+    names = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch):
+        found, _ = gallery.search(queries[i:i + batch])
+        names.extend(found)
+    elapsed = time.perf_counter() - start
+    frames = (len(queries) + batch - 1) // batch
+    return names, elapsed * 1000 / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IVF recall vs latency')
+    parser.add_argument('--size', type=int, default=100000, help='Số người trong gallery')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=1, help='Số khuôn mặt mỗi frame')
+    parser.add_argument('--nlist', type=int, default=0, help='0 = tự chọn (4*sqrt(N))')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--clusters', type=int, default=2000,
+                        help='Số cụm giả lập (encoding thật không phân bố đều trong không gian)')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(0, 0.09, size=(args.clusters, 128))
+    encodings = centers[rng.integers(0, args.clusters, args.size)] + rng.normal(0, 0.04, size=(args.size, 128))
+    names = [f'person_{i}' for i in range(args.size)]
+    # Truy vấn = người trong gallery chụp lại (nhiễu nhỏ)
+    picks = rng.integers(0, args.size, args.queries)
+    queries = (encodings[picks] + rng.normal(0, 0.02, size=(args.queries, 128))).astype(np.float32)
+
+    exact = FaceGallery.from_encodings(names, encodings)
+    truth, exact_ms = timed_search(exact, queries, args.batch)
+
+    start = time.perf_counter()
+    index = IVFIndex(nlist=args.nlist or None)
+    ivf = FaceGallery.from_encodings(names, encodings, ann_index=index)
+    build_time = time.perf_counter() - start
+
+    print(f"Gallery: {args.size} người, {args.queries} truy vấn, {args.batch} mặt/frame")
+    print(f"IVF build: {build_time:.2f}s, nlist={len(index.centroids)}")
+    print(f"{'Index':<14}{'Recall@1':>10}{'ms/frame':>12}{'Speedup':>10}")
+    print(f"{'exact':<14}{1.0:>10.3f}{exact_ms:>12.3f}{1.0:>9.1f}x")
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        found, ivf_ms = timed_search(ivf, queries, args.batch)
+        recall = np.mean([a == b for a, b in zip(found, truth)])
+        print(f"{'ivf/' + str(nprobe):<14}{recall:>10.3f}{ivf_ms:>12.3f}{exact_ms / ivf_ms:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark micro-batching cho /recognize: throughput và latency p50/p99 khi nhiều client gửi frame đồng thời
+- direct:  mỗi request tự detect + encode + so khớp trên thread của nó (cách cũ, Flask threaded=True)
+- batched: MicroBatchScheduler gom request trong cửa sổ window_ms / tối đa max_batch_size frame
+Chạy:
+    python benchmarks/bench_batch_scheduler.py --clients 1 4 8 --windows 2 5 10 --requests 64
+"""
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)  # face_recognition_service dùng đường dẫn tương đối 'dataset'
+
+import face_recognition_service as service
+from batch_scheduler import MicroBatchScheduler
+
+
+def load_frames(width):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(service.DATASET_DIR, '*', '*.jpg'))):
+        image = Image.open(path).convert('RGB')
+        height = int(round(image.height * width / float(image.width)))
+        frames.append(np.asarray(image.resize((width, height), Image.BICUBIC)))
+    return frames
+
+
+def run_clients(recognize, frames, clients, total_requests):
+    """Mỗi client gửi tuần tự; trả về (request/s, list latency giây)"""
+    latencies = []
+    lock = threading.Lock()
+    per_client = max(1, total_requests // clients)
+
+    def client(offset):
+        local = []
+        for i in range(per_client):
+            frame = frames[(offset + i * clients) % len(frames)]
+            start = time.perf_counter()
+            recognize(frame)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--windows', type=float, nargs='+', default=[2, 5, 10], help='Cửa sổ gom batch (ms)')
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--width', type=int, default=640)
+    args = parser.parse_args()
+
+    frames = load_frames(args.width)
+    service.load_face_dataset()
+    gallery = service._dataset_cache['gallery']
+    print(f'{len(frames)} frame {args.width}px, gallery {len(gallery)} người, {args.requests} request mỗi cấu hình')
+
+    modes = [('direct', lambda frame: service._detect_and_match(frame, gallery), None)]
+    for window in args.windows:
+        scheduler = MicroBatchScheduler(
+            lambda images: service._detect_and_match_batch(images, gallery),
+            window_ms=window,
+            max_batch_size=args.max_batch
+        )
+        modes.append((f'batch/{window:g}ms', scheduler.submit, scheduler))
+
+    print(f'{"mode":>13} {"clients":>8} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"avg batch":>10}')
+    for clients in args.clients:
+        for name, recognize, scheduler in modes:
+            before = scheduler.stats() if scheduler else None
+            throughput, latencies = run_clients(recognize, frames, clients, args.requests)
+            avg_batch = '-'
+            if scheduler:
+                after = scheduler.stats()
+                batches = after['batches'] - before['batches']
+                avg_batch = f'{(after["items"] - before["items"]) / max(1, batches):.2f}'
+            p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+            print(f'{name:>13} {clients:>8} {throughput:>8.1f} {p50:>8.1f} {p99:>8.1f} {avg_batch:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark phân tích thuộc tính nhiều khuôn mặt (deepface_service ?faces=all)
+- per-face: mỗi khuôn mặt chạy riêng qua từng model (cách DeepFace.analyze làm)
+- batch:    các khuôn mặt ghép thành 1 tensor, mỗi model chạy 1 lần (deepface_batch.analyze_face_batch)
+Chỉ đo phần model (khuôn mặt đã cắt sẵn), không tính detection.
+Cần weights trong ~/.deepface; thêm --random-weights để dựng model với trọng số ngẫu nhiên
+(độ trễ như nhau, dùng khi máy không tải được weights). Kiểm tra luôn kết quả 2 cách giống nhau.
+Chạy:
+    python benchmarks/bench_deepface_batch.py --faces 1,2,4,8,12,16,20 --actions emotion,age
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from deepface.modules import modeling
+
+from deepface_batch import analyze_face_batch, prepare_face_batch
+from deepface_models import ACTION_MODELS, parse_actions
+
+
+def use_random_weights():
+    """Bỏ bước tải / nạp weights: model giữ trọng số khởi tạo ngẫu nhiên"""
+    from deepface.commons import weight_utils
+    weight_utils.download_weights_if_necessary = lambda file_name, source_url, compress_type=None: file_name
+    weight_utils.load_model_weights = lambda model, weight_file: model
+
+
+def analyze_per_face(face_batch, actions):
+    """Giống vòng lặp của DeepFace.analyze: 1 lần gọi model cho mỗi khuôn mặt x mỗi action"""
+    results = []
+    for face in face_batch:
+        results.extend(analyze_face_batch(face[np.newaxis], actions))
+    return results
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--faces', default='1,2,4,8,12,16,20', help='Số khuôn mặt trong ảnh')
+    parser.add_argument('--actions', default='emotion,age,gender,race')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--random-weights', action='store_true')
+    args = parser.parse_args()
+
+    if args.random_weights:
+        use_random_weights()
+    actions, _ = parse_actions(args.actions)
+    for action in actions:
+        modeling.build_model(task='facial_attribute', model_name=ACTION_MODELS[action])
+
+    rng = np.random.default_rng(0)
+    counts = [int(n) for n in args.faces.split(',')]
+    crops = [rng.integers(0, 256, size=(int(rng.integers(80, 200)),) * 2 + (3,), dtype=np.uint8)
+             for _ in range(max(counts))]
+    face_batch = prepare_face_batch(crops)
+
+    # Khởi động (tạo graph cho batch 1 và batch lớn)
+    analyze_per_face(face_batch[:1], actions)
+    analyze_face_batch(face_batch[:2], actions)
+
+    print(f'actions={",".join(actions)}, repeat={args.repeat} (median)')
+    print(f'{"faces":>6} {"per-face ms":>12} {"batch ms":>10} {"speedup":>8} {"ms/face batch":>14} {"same result":>12}')
+    for n in counts:
+        per_face_time, per_face = timed(lambda: analyze_per_face(face_batch[:n], actions), args.repeat)
+        batch_time, batch = timed(lambda: analyze_face_batch(face_batch[:n], actions), args.repeat)
+        same = all(
+            a.get('age') == b.get('age') and all(
+                a.get(f'dominant_{action}') == b.get(f'dominant_{action}') for action in ('emotion', 'gender', 'race'))
+            for a, b in zip(per_face, batch)
+        )
+        print(f'{n:>6} {per_face_time * 1000:>12.1f} {batch_time * 1000:>10.1f} '
+              f'{per_face_time / batch_time:>7.2f}x {batch_time * 1000 / n:>14.1f} {str(same):>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark phần chuẩn bị ảnh của /analyze (deepface_service): file tạm vs trong RAM
+- tempfile: decode PIL -> nén lại JPEG vào thư mục tạm -> DeepFace đọc + decode file -> xóa file (cách cũ)
+- inmemory: decode thẳng ra mảng BGR (cv2.imdecode) -> DeepFace nhận trực tiếp mảng numpy
+Đo đúng bước nạp ảnh của DeepFace (deepface.commons.image_utils.load_image) nên không cần weights của model;
+thêm --full để đo cả DeepFace.analyze (cần weights đã tải về ~/.deepface)
+Chạy:
+    python benchmarks/bench_deepface_inmemory.py --width 1280 --repeat 5
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from deepface import DeepFace
+from deepface.commons import image_utils
+
+import deepface_service as service
+
+ACTIONS = ['age', 'gender', 'race', 'emotion']
+
+
+def prepare_tempfile(image_bytes):
+    """Đường cũ: trả về (ảnh BGR DeepFace đọc được, đường dẫn file tạm cần xóa)"""
+    image_pil = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    temp_file = os.path.join(tempfile.gettempdir(), f'deepface_analyze_{int(time.time() * 1000)}.jpg')
+    image_pil.save(temp_file, 'JPEG')
+    image, _ = image_utils.load_image(temp_file)
+    return image, temp_file
+
+
+def prepare_inmemory(image_bytes):
+    image, _ = image_utils.load_image(service._decode_image_bgr(image_bytes))
+    return image
+
+
+def load_uploads(width):
+    """Ảnh trong dataset, phóng về chiều rộng cho trước và nén JPEG như browser gửi lên"""
+    uploads = []
+    for path in sorted(glob.glob(os.path.join(ROOT_DIR, 'dataset', '*', '*.jpg'))):
+        image = Image.open(path).convert('RGB')
+        height = int(round(image.height * width / float(image.width)))
+        buffer = io.BytesIO()
+        image.resize((width, height), Image.BICUBIC).save(buffer, 'JPEG', quality=90)
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--full', action='store_true', help='Đo cả DeepFace.analyze (cần weights)')
+    args = parser.parse_args()
+
+    uploads = load_uploads(args.width)
+    print(f'{len(uploads)} ảnh upload {args.width}px, {args.repeat} lần mỗi ảnh')
+
+    timings = {'tempfile': [], 'inmemory': []}
+    max_diff = 0
+    for _ in range(args.repeat):
+        for image_bytes in uploads:
+            start = time.perf_counter()
+            old_image, temp_file = prepare_tempfile(image_bytes)
+            if args.full:
+                DeepFace.analyze(img_path=temp_file, actions=ACTIONS, enforce_detection=False, silent=True)
+            os.remove(temp_file)
+            timings['tempfile'].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            new_image = prepare_inmemory(image_bytes)
+            if args.full:
+                DeepFace.analyze(img_path=new_image, actions=ACTIONS, enforce_detection=False, silent=True)
+            timings['inmemory'].append(time.perf_counter() - start)
+
+            # Sai khác do lần nén JPEG thứ 2 của đường cũ
+            max_diff = max(max_diff, int(np.abs(old_image.astype(np.int16) - new_image.astype(np.int16)).max()))
+
+    stage = 'analyze' if args.full else 'chuẩn bị ảnh'
+    print(f'{"mode":>9} {"mean ms":>8} {"p50 ms":>8} {"p99 ms":>8}   ({stage})')
+    for mode, values in timings.items():
+        values = np.array(values) * 1000
+        print(f'{mode:>9} {values.mean():>8.2f} {np.percentile(values, 50):>8.2f} {np.percentile(values, 99):>8.2f}')
+    saved = (np.mean(timings['tempfile']) - np.mean(timings['inmemory'])) * 1000
+    print(f'Tiết kiệm {saved:.2f} ms / request; sai khác pixel tối đa do nén lại JPEG: {max_diff}')
+
+
+if __name__ == '__main__':
+    main()
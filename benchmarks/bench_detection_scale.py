@@ -0,0 +1,98 @@
+"""
+Benchmark độ phân giải detect của /recognize: latency và độ chính xác theo từng scale
+- detect: HOG trên ảnh thu nhỏ theo scale, box đổi về tọa độ ảnh gốc
+- encode + so khớp: luôn trên ảnh gốc (giống face_recognition_service._detect_and_match)
+Độ chính xác: recall detect so với scale 1.0 (IoU >= 0.5) và tỉ lệ nhận đúng tên (tên thư mục trong dataset)
+Chạy:
+    python benchmarks/bench_detection_scale.py --width 1280 --scales 1.0 0.75 0.5 0.35 0.25
+    python benchmarks/bench_detection_scale.py --images "frames/*/*.jpg"   # ảnh webcam riêng, tên = thư mục cha
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)  # face_recognition_service dùng đường dẫn tương đối 'dataset'
+
+import face_recognition
+import face_recognition_service as service
+from face_tracker import box_iou
+
+
+def load_images(pattern, width):
+    """Ảnh RGB phóng to về cùng chiều rộng (mô phỏng frame webcam độ phân giải cao)"""
+    images = []
+    for path in sorted(glob.glob(pattern)):
+        image = Image.open(path).convert('RGB')
+        if width:
+            height = int(round(image.height * width / float(image.width)))
+            image = image.resize((width, height), Image.BICUBIC)
+        images.append((os.path.basename(os.path.dirname(path)), np.asarray(image)))
+    return images
+
+
+def run_scale(images, gallery, scale):
+    """Trả về (ms detect / ảnh, ms tổng / ảnh, list box, list tên nhận được)"""
+    detect_time = 0.0
+    total_time = 0.0
+    boxes = []
+    names = []
+    for _, image in images:
+        start = time.perf_counter()
+        locations = service._detect_faces(image, scale)
+        detect_time += time.perf_counter() - start
+        matched = []
+        if locations:
+            encodings = face_recognition.face_encodings(image, locations)
+            matched, _ = gallery.match(encodings, tolerance=service.MATCH_TOLERANCE)
+        total_time += time.perf_counter() - start
+        boxes.append(locations)
+        names.append(matched)
+    count = max(1, len(images))
+    return detect_time / count * 1000, total_time / count * 1000, boxes, names
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', default=os.path.join(service.DATASET_DIR, '*', '*.jpg'))
+    parser.add_argument('--width', type=int, default=1280, help='Phóng ảnh về chiều rộng này (0 = giữ nguyên)')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.75, 0.5, 0.35, 0.25])
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.width)
+    if not images:
+        print(f'❌ Không có ảnh khớp {args.images}')
+        return
+    service.load_face_dataset()
+    gallery = service._dataset_cache['gallery']
+    print(f'{len(images)} ảnh, chiều rộng {args.width or "gốc"}, gallery {len(gallery)} người, '
+          f'FR_DETECTION_SCALE={service.DETECTION_SCALE} -> scale ảnh đầu = {service._detection_scale(images[0][1].shape):.2f} '
+          f'(FR_DETECTION_MIN_SIDE={service.DETECTION_MIN_SIDE}, FR_MIN_FACE_SIZE={service.MIN_FACE_SIZE})')
+
+    reference = None
+    print(f'{"scale":>6} {"detect ms":>10} {"total ms":>9} {"speedup":>8} {"faces":>6} {"recall":>7} {"name acc":>9}')
+    for scale in sorted(args.scales, reverse=True):
+        detect_ms, total_ms, boxes, names = run_scale(images, gallery, scale)
+        if reference is None:
+            reference = (total_ms, boxes)
+
+        found = 0
+        reference_faces = 0
+        for ref_boxes, scaled_boxes in zip(reference[1], boxes):
+            reference_faces += len(ref_boxes)
+            found += sum(1 for ref in ref_boxes if any(box_iou(ref, box) >= 0.5 for box in scaled_boxes))
+        correct = sum(1 for (person, _), matched in zip(images, names) if person in matched)
+
+        print(f'{scale:>6.2f} {detect_ms:>10.1f} {total_ms:>9.1f} {reference[0] / total_ms:>7.1f}x '
+              f'{sum(len(b) for b in boxes):>6} {found / max(1, reference_faces):>7.1%} '
+              f'{correct / len(images):>9.1%}')
+
+
+if __name__ == '__main__':
+    main()
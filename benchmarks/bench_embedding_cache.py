@@ -0,0 +1,54 @@
+"""
+Benchmark: load dataset lần đầu (cache rỗng) so với khởi động lại (cache ấm)
+Chạy trong môi trường face_recognition:
+    python benchmarks/bench_embedding_cache.py --dataset dataset --repeat 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_recognition_service as frs
+from embedding_store import EmbeddingStore
+
+
+def timed_load():
+    """Load dataset như khi service khởi động (bỏ qua cache trong RAM)"""
+    frs._dataset_cache['loaded'] = False
+    frs._dataset_cache['timestamp'] = 0
+    start = time.perf_counter()
+    encodings, names = frs.load_face_dataset()
+    return time.perf_counter() - start, len(names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold vs warm load_face_dataset')
+    parser.add_argument('--dataset', default='dataset', help='Thư mục dataset')
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần đo warm load')
+    args = parser.parse_args()
+
+    frs.DATASET_DIR = args.dataset
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        frs._embedding_store = EmbeddingStore(os.path.join(tmp_dir, 'embeddings.sqlite3'))
+
+        cold_time, persons = timed_load()
+        warm_times = [timed_load()[0] for _ in range(args.repeat)]
+        cached_images = frs._embedding_store.count()
+
+    warm_best = min(warm_times)
+    print("\n" + "=" * 60)
+    print(f"Dataset: {args.dataset} ({persons} người, {cached_images} ảnh)")
+    print("=" * 60)
+    print(f"{'Lần load':<25}{'Thời gian (s)':>15}")
+    print(f"{'Cold (cache rỗng)':<25}{cold_time:>15.3f}")
+    print(f"{'Warm (best of %d)' % args.repeat:<25}{warm_best:>15.3f}")
+    print(f"Tăng tốc: {cold_time / max(warm_best, 1e-9):.1f}x")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
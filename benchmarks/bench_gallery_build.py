@@ -0,0 +1,72 @@
+"""
+Benchmark build gallery lạnh (chưa có embedding cache): encode tuần tự vs song song nhiều process
+Báo cáo ảnh/giây cho từng số worker (đã tính cả thời gian khởi động process + load model dlib ở mỗi worker)
+và kiểm tra encoding giống hệt cách tuần tự.
+--copies N nhân bản dataset N lần vào thư mục tạm để có job đủ lớn.
+Chạy trong môi trường face_recognition:
+    python benchmarks/bench_gallery_build.py --dataset dataset --copies 10 --workers 1,2,4,8
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery_builder import BuildProgress, encode_images, scan_dataset
+
+
+def make_dataset(source_dir, copies):
+    """Nhân bản ảnh của dataset `copies` lần (mỗi bản là 1 file riêng)"""
+    target_dir = os.path.join(tempfile.gettempdir(), 'bench_gallery_build')
+    shutil.rmtree(target_dir, ignore_errors=True)
+    for person_name, path in scan_dataset(source_dir):
+        person_dir = os.path.join(target_dir, person_name)
+        os.makedirs(person_dir, exist_ok=True)
+        name, ext = os.path.splitext(os.path.basename(path))
+        for i in range(copies):
+            shutil.copyfile(path, os.path.join(person_dir, f'{name}_{i}{ext}'))
+    return target_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sequential vs process-pool gallery build')
+    parser.add_argument('--dataset', default='dataset')
+    parser.add_argument('--copies', type=int, default=5, help='Số lần nhân bản dataset')
+    parser.add_argument('--workers', default='1,2,4', help='Các số worker cần đo (1 = tuần tự trong process)')
+    parser.add_argument('--chunk-size', type=int, default=8)
+    args = parser.parse_args()
+
+    dataset_dir = make_dataset(args.dataset, args.copies)
+    paths = [path for _, path in scan_dataset(dataset_dir)]
+    print(f'{len(paths)} ảnh, chunk {args.chunk_size}, {os.cpu_count()} CPU core')
+    print(f'{"workers":>8} {"time s":>8} {"images/s":>9} {"speedup":>8} {"no face":>8} {"errors":>7} {"same":>5}')
+
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(',')]:
+        progress = BuildProgress()
+        start = time.perf_counter()
+        encodings, errors = encode_images(paths, workers=workers, chunk_size=args.chunk_size, progress=progress)
+        elapsed = time.perf_counter() - start
+        snap = progress.snapshot()
+
+        if baseline is None:
+            baseline = (elapsed, encodings)
+        same = all(
+            (encodings.get(p) is None and baseline[1].get(p) is None) or
+            (encodings.get(p) is not None and baseline[1].get(p) is not None and
+             np.allclose(encodings[p], baseline[1][p]))
+            for p in paths
+        )
+        print(f'{workers:>8} {elapsed:>8.2f} {len(paths) / elapsed:>9.1f} {baseline[0] / elapsed:>7.2f}x '
+              f'{snap["no_face"]:>8} {len(errors):>7} {str(same):>5}')
+
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
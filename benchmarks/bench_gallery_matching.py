@@ -0,0 +1,92 @@
+"""
+Micro-benchmark: so khớp khuôn mặt với gallery 1k / 10k / 100k người
+- list: cách cũ (list numpy array, compare_faces + face_distance cho từng khuôn mặt)
+- matrix: FaceGallery (ma trận float32 + norm tính sẵn, 1 phép tính cho cả frame)
+Chạy:
+    python benchmarks/bench_gallery_matching.py --faces 1 4 --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_gallery import FaceGallery
+
+try:
+    import face_recognition
+    compare_faces = face_recognition.compare_faces
+    face_distance = face_recognition.face_distance
+except ImportError:
+    # Cùng công thức với face_recognition.api khi chưa cài dlib
+    def face_distance(face_encodings, face_to_compare):
+        if len(face_encodings) == 0:
+            return np.empty((0))
+        return np.linalg.norm(face_encodings - face_to_compare, axis=1)
+
+    def compare_faces(known_face_encodings, face_encoding_to_check, tolerance=0.6):
+        return list(face_distance(np.array(known_face_encodings), face_encoding_to_check) <= tolerance)
+
+TOLERANCE = 0.5
+
+
+def match_list(known_encodings, known_names, face_encodings):
+    """Đường cũ trong /recognize"""
+    names = []
+    for face_encoding in face_encodings:
+        matches = compare_faces(known_encodings, face_encoding, tolerance=TOLERANCE)
+        name = None
+        face_distances = face_distance(known_encodings, face_encoding)
+        if len(face_distances) > 0:
+            best_match_index = np.argmin(face_distances)
+            if matches[best_match_index]:
+                name = known_names[best_match_index]
+        names.append(name)
+    return names
+
+
+def bench(fn, repeat):
+    """Trả về thời gian trung bình (ms) mỗi lần gọi"""
+    fn()  # warmup
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List vs FaceGallery matching')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--faces', type=int, nargs='+', default=[1, 4], help='Số khuôn mặt mỗi frame')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'Gallery':>10}{'Faces':>7}{'list (ms)':>12}{'matrix (ms)':>13}{'Speedup':>10}")
+    for size in args.sizes:
+        # Encoding giả lập: phân phối gần giống encoding thật (norm ~ 1)
+        encodings = rng.normal(0, 0.09, size=(size, 128))
+        names = [f'person_{i}' for i in range(size)]
+        known_encodings = list(encodings)
+        gallery = FaceGallery.from_encodings(names, encodings)
+
+        for faces in args.faces:
+            # Một nửa là người trong gallery (có nhiễu nhỏ), một nửa là người lạ
+            picks = rng.integers(0, size, faces)
+            queries = encodings[picks] + rng.normal(0, 0.01, size=(faces, 128))
+            queries[faces // 2 + faces % 2:] = rng.normal(0, 0.09, size=(faces // 2, 128))
+
+            expected = match_list(known_encodings, names, queries)
+            got, _ = gallery.match(queries, tolerance=TOLERANCE)
+            assert expected == got, 'Kết quả FaceGallery khác cách cũ'
+
+            t_list = bench(lambda: match_list(known_encodings, names, queries), args.repeat)
+            t_matrix = bench(lambda: gallery.match(queries, tolerance=TOLERANCE), args.repeat)
+            print(f"{size:>10}{faces:>7}{t_list:>12.3f}{t_matrix:>13.3f}{t_list / t_matrix:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
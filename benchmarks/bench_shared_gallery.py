@@ -0,0 +1,86 @@
+"""
+Benchmark bộ nhớ gallery khi chạy nhiều process worker (FR_WORKERS)
+- copy:   mỗi worker nhận 1 bản sao gallery qua pipe (FR_SHARED_GALLERY=0)
+- shared: gallery ghi thành file memory-mapped, mọi worker map chung (FR_SHARED_GALLERY=1)
+Báo cáo cho mỗi worker trước / sau khi nhận gallery: RSS, PSS (RSS chia đều phần dùng chung)
+và private (phần riêng của worker), cùng thời gian publish 1 version gallery (reload)
+Chỉ chạy trên Linux (đọc /proc/<pid>/smaps_rollup)
+Chạy:
+    python benchmarks/bench_shared_gallery.py --size 200000 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+import face_recognition_service as service
+from face_gallery import ENCODING_SIZE
+from worker_pool import RecognitionWorkerPool
+
+
+def memory_mb(pid):
+    """(RSS, PSS, private) theo MB từ /proc/<pid>/smaps_rollup"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1]) / 1024.0
+    private = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return values.get('Rss', 0), values.get('Pss', 0), private
+
+
+def worker_memory(pool):
+    return [memory_mb(worker['pid']) for worker in pool.stats()['per_worker']]
+
+
+def run_mode(mode, names, matrix, num_workers):
+    pool = RecognitionWorkerPool(num_workers, service._detect_and_match, shared_gallery=mode == 'shared')
+    pool.start()
+    pool.publish_gallery([], np.zeros((0, ENCODING_SIZE), dtype=np.float32))  # Chờ worker khởi động xong
+    before = worker_memory(pool)
+
+    start = time.perf_counter()
+    pool.publish_gallery(names, matrix)
+    publish_time = time.perf_counter() - start
+    after = worker_memory(pool)
+
+    # Reload lần 2: version mới thay version cũ
+    start = time.perf_counter()
+    pool.publish_gallery(names, matrix)
+    reload_time = time.perf_counter() - start
+    reloaded = worker_memory(pool)
+
+    pool.close()
+    return before, after, reloaded, publish_time, reload_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=200000, help='Số người trong gallery')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(0, 0.1, size=(args.size, ENCODING_SIZE)).astype(np.float32)
+    names = [f'person_{i}' for i in range(args.size)]
+    print(f'Gallery {args.size} người = {matrix.nbytes / 2**20:.1f} MB, {args.workers} worker')
+
+    print(f'{"mode":>7} {"stage":>8} {"RSS/worker":>11} {"PSS/worker":>11} {"private/worker":>15} {"publish s":>10}')
+    for mode in ('copy', 'shared'):
+        before, after, reloaded, publish_time, reload_time = run_mode(mode, names, matrix, args.workers)
+        for stage, memory, elapsed in (('before', before, None), ('after', after, publish_time),
+                                       ('reload', reloaded, reload_time)):
+            rss, pss, private = np.mean(memory, axis=0)
+            elapsed_text = f'{elapsed:.3f}' if elapsed is not None else '-'
+            print(f'{mode:>7} {stage:>8} {rss:>10.1f}M {pss:>10.1f}M {private:>14.1f}M {elapsed_text:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark detect-then-track trên 1 video đã quay
+- full:  detect + encode + so khớp trên mọi frame (cách cũ)
+- track: FaceTracker - chỉ detect + encode ở keyframe, giữa các keyframe dời box theo optical flow
+Báo cáo: thời gian trung bình / frame, speedup, tỉ lệ đổi danh tính (identity switch) của track
+và tỉ lệ frame có tên khác với kết quả full
+Chạy:
+    python benchmarks/bench_tracking.py --video clip.mp4 --intervals 5 10 20
+    python benchmarks/bench_tracking.py   # không có --video: tự tạo video từ ảnh trong dataset
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)  # face_recognition_service dùng đường dẫn tương đối 'dataset'
+
+import face_recognition_service as service
+from face_tracker import FaceTracker, box_iou
+
+
+def make_synthetic_video(path, frames=200, size=(640, 480), fps=15, seed=0):
+    """Tạo video ảnh khuôn mặt trong dataset trôi chậm trên nền xám (mô phỏng người đứng trước webcam)"""
+    rng = random.Random(seed)
+    images = sorted(glob.glob(os.path.join(service.DATASET_DIR, '*', '*.jpg')))
+    persons = {}
+    for image_path in images:
+        persons.setdefault(os.path.basename(os.path.dirname(image_path)), image_path)
+    faces = [cv2.resize(cv2.imread(p), (200, 200)) for p in list(persons.values())[:2]]
+
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    starts = [(40, 120), (380, 140)]
+    phases = [rng.uniform(0, 6.28) for _ in faces]
+    for i in range(frames):
+        canvas = np.full((height, width, 3), 90, dtype=np.uint8)
+        for face, (x0, y0), phase in zip(faces, starts, phases):
+            x = int(x0 + 30 * np.sin(i / 25.0 + phase))
+            y = int(y0 + 20 * np.cos(i / 30.0 + phase))
+            canvas[y:y + 200, x:x + 200] = face
+        writer.write(canvas)
+    writer.release()
+    return path
+
+
+def read_frames(path, scale):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        if scale != 1.0:
+            frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    capture.release()
+    return frames
+
+
+def run_full(frames, gallery):
+    results = []
+    start = time.perf_counter()
+    for frame in frames:
+        results.append(service._detect_and_match(frame, gallery))
+    return results, time.perf_counter() - start
+
+
+def run_tracker(frames, gallery, interval):
+    tracker = FaceTracker(keyframe_interval=interval)
+    results = []
+    start = time.perf_counter()
+    for frame in frames:
+        tracks, _ = tracker.process(frame, lambda image: service._detect_and_match(image, gallery))
+        results.append(tracks)
+    return results, time.perf_counter() - start, tracker.keyframes
+
+
+def identity_stats(track_results, full_results):
+    """(số lần 1 track đổi tên / số track-frame, số mặt khác tên với full / số mặt được ghép)"""
+    last_name = {}
+    switches = 0
+    track_frames = 0
+    mismatches = 0
+    compared = 0
+    for tracks, reference in zip(track_results, full_results):
+        for track in tracks:
+            track_frames += 1
+            track_id = track['track_id']
+            if track_id in last_name and last_name[track_id] != track['name']:
+                switches += 1
+            last_name[track_id] = track['name']
+
+            best = max(reference, key=lambda det: box_iou(det[0], track['location']), default=None)
+            if best is not None and box_iou(best[0], track['location']) >= 0.3:
+                compared += 1
+                if best[1] != track['name']:
+                    mismatches += 1
+    return switches / max(1, track_frames), mismatches / max(1, compared), len(last_name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video', help='File video đã quay')
+    parser.add_argument('--synthetic', help='Tạo video mẫu từ dataset tại đường dẫn này nếu không có --video')
+    parser.add_argument('--scale', type=float, default=0.5, help='Thu nhỏ frame trước khi xử lý')
+    parser.add_argument('--max-frames', type=int, default=300)
+    parser.add_argument('--intervals', type=int, nargs='+', default=[5, 10, 20])
+    args = parser.parse_args()
+
+    video = args.video
+    if not video:
+        video = make_synthetic_video(args.synthetic or os.path.join(tempfile.gettempdir(), 'synthetic_faces.avi'))
+        print(f'🎞️  Đã tạo video mẫu: {video}')
+
+    frames = read_frames(video, args.scale)[:args.max_frames]
+    if not frames:
+        print(f'❌ Không đọc được frame nào từ {video}')
+        return
+
+    service.load_face_dataset()
+    gallery = service._dataset_cache['gallery']
+    print(f'Video: {video} - {len(frames)} frame {frames[0].shape[1]}x{frames[0].shape[0]}, gallery {len(gallery)} người')
+
+    full_results, full_time = run_full(frames, gallery)
+    print(f'{"mode":>12} {"ms/frame":>10} {"speedup":>8} {"keyframes":>10} {"tracks":>7} {"id switch":>10} {"mismatch":>9}')
+    print(f'{"full":>12} {full_time / len(frames) * 1000:>10.1f} {1.0:>7.1f}x {len(frames):>10} {"-":>7} {"-":>10} {"-":>9}')
+
+    for interval in args.intervals:
+        track_results, track_time, keyframes = run_tracker(frames, gallery, interval)
+        switch_rate, mismatch_rate, track_count = identity_stats(track_results, full_results)
+        print(f'{"track/" + str(interval):>12} {track_time / len(frames) * 1000:>10.1f} '
+              f'{full_time / track_time:>7.1f}x {keyframes:>10} {track_count:>7} '
+              f'{switch_rate:>9.2%} {mismatch_rate:>9.2%}')
+
+
+if __name__ == '__main__':
+    main()
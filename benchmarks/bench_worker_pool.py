@@ -0,0 +1,91 @@
+"""
+Benchmark khả năng mở rộng theo số core của chế độ nhiều process worker (FR_WORKERS)
+- inproc:    detect + encode + so khớp ngay trong process (như FR_WORKERS=0)
+- workers/N: RecognitionWorkerPool với N process, dispatcher chọn worker ít việc nhất
+Mỗi cấu hình chạy 2*N client gửi frame liên tục, báo cáo frame/s, hiệu suất so với 1 worker và p99
+Chạy:
+    python benchmarks/bench_worker_pool.py --workers 1 2 4 8 --requests 64
+"""
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)  # face_recognition_service dùng đường dẫn tương đối 'dataset'
+
+import face_recognition_service as service
+from worker_pool import RecognitionWorkerPool
+
+
+def load_frames(width):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(service.DATASET_DIR, '*', '*.jpg'))):
+        image = Image.open(path).convert('RGB')
+        height = int(round(image.height * width / float(image.width)))
+        frames.append(np.asarray(image.resize((width, height), Image.BICUBIC)))
+    return frames
+
+
+def run_clients(recognize, frames, clients, total_requests):
+    latencies = []
+    lock = threading.Lock()
+    per_client = max(1, total_requests // clients)
+
+    def client(offset):
+        local = []
+        for i in range(per_client):
+            start = time.perf_counter()
+            recognize(frames[(offset + i * clients) % len(frames)])
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies) / (time.perf_counter() - start), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--width', type=int, default=640)
+    args = parser.parse_args()
+
+    frames = load_frames(args.width)
+    service.load_face_dataset()
+    gallery = service._dataset_cache['gallery']
+    print(f'{len(frames)} frame {args.width}px, gallery {len(gallery)} người, {os.cpu_count()} CPU')
+
+    throughput, latencies = run_clients(lambda f: service._detect_and_match(f, gallery), frames, 2, args.requests)
+    print(f'{"mode":>11} {"clients":>8} {"frame/s":>8} {"scaling":>8} {"p99 ms":>8}')
+    print(f'{"inproc":>11} {2:>8} {throughput:>8.1f} {"-":>8} {np.percentile(latencies, 99) * 1000:>8.1f}')
+
+    base = None
+    for num_workers in args.workers:
+        pool = RecognitionWorkerPool(num_workers, service._detect_and_match, index_factory=service._create_ann_index)
+        pool.start()
+        pool.publish_gallery(gallery.names, gallery.matrix)
+        run_clients(pool.recognize, frames, num_workers, num_workers)  # warm-up
+
+        clients = 2 * num_workers
+        throughput, latencies = run_clients(pool.recognize, frames, clients, args.requests)
+        base = base or throughput
+        print(f'{"workers/" + str(num_workers):>11} {clients:>8} {throughput:>8.1f} '
+              f'{throughput / base:>7.2f}x {np.percentile(latencies, 99) * 1000:>8.1f}')
+        pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+"""
+Load test end-to-end gateway: Flask sync (app.py) vs async (app_async.py)
+Mỗi chế độ gateway được khởi động thành process riêng, trỏ tới backend ở port 5001/5002:
+stub backends (benchmarks/stub_backends.py - độ trễ / jitter / lỗi giả lập, không cần model hay mạng)
+hoặc service thật đang chạy (--no-stub).
+N client webcam giả lập gửi frame JPEG (độ phân giải --resolution) theo --fps (0 = gửi liên tục),
+mỗi client chờ kết quả frame trước rồi mới gửi frame sau (như browser). Với mỗi tổ hợp mode x clients x fps x
+resolution báo cáo: throughput, tỉ lệ lỗi, latency p50/p95/p99 và overhead từng chặng từ header Server-Timing:
+    client_gateway = client đo - gateway xử lý   (mạng + xếp hàng trước khi gateway nhận request)
+    gateway        = gateway xử lý - upstream    (overhead của chính gateway)
+    upstream       = gateway chờ service         (mạng gateway <-> service + service)
+    backend        = processing_time service tự báo (route forward thẳng /recognize, /analyze)
+--json ghi kết quả dạng máy đọc được để theo dõi regression giữa các lần chạy.
+Chạy:
+    python benchmarks/loadtest_gateway.py --modes sync,async --concurrency 10,100,1000 --duration 10
+    python benchmarks/loadtest_gateway.py --fps 10 --resolution 640x480,1280x720 --json results.json
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import cv2
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GATEWAY_COMMANDS = {
+    # Giống python app.py nhưng không bật debug reloader (reloader tạo process con)
+    'sync': [sys.executable, '-c',
+             "import sys, app; app.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"],
+    'async': [sys.executable, 'app_async.py', '--host', '127.0.0.1', '--port'],
+}
+
+# Route forward nguyên response của service -> processing_time trong body là thời gian của service
+FORWARDED_PATHS = ('/api/face-recognition/recognize', '/api/deepface/analyze')
+HOPS = ('client_gateway', 'gateway', 'upstream', 'backend')
+FRAMES_PER_RESOLUTION = 8
+
+
+def start_process(command, log_name):
+    log = open(os.path.join(tempfile.gettempdir(), log_name), 'w')
+    return subprocess.Popen(command, cwd=ROOT_DIR, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def make_frames(face_path, width, height, count=FRAMES_PER_RESOLUTION):
+    """
+    Frame webcam giả lập: nền nhiễu + ảnh khuôn mặt (cao ~1/2 frame) dịch dần qua các frame,
+    nén JPEG như canvas.toBlob của browser
+    """
+    face = cv2.imread(face_path)
+    scale = (height / 2) / face.shape[0]
+    face = cv2.resize(face, (max(1, int(face.shape[1] * scale)), max(1, int(face.shape[0] * scale))))[:, :width]
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        frame = rng.integers(60, 120, size=(height, width, 3), dtype=np.uint8)
+        top = (height - face.shape[0]) // 2
+        left = min(max(0, (width - face.shape[1]) // 2 + (i - count // 2) * 4), width - face.shape[1])
+        frame[top:top + face.shape[0], left:left + face.shape[1]] = face
+        frames.append(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+    return frames
+
+
+def parse_server_timing(header):
+    """'gateway;dur=1.2, upstream;dur=0.8' -> {'gateway': 1.2, 'upstream': 0.8} (ms)"""
+    timings = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur':
+                try:
+                    timings[name] = float(value)
+                except ValueError:
+                    pass
+    return timings
+
+
+async def wait_until_serving(url, path, image_bytes, timeout=60):
+    """Chờ gateway trả lời 200 cho 1 request thật (gateway đã lên + health monitor đã thấy backend)"""
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.post(url + path, data=image_bytes,
+                                        headers={'Content-Type': 'image/jpeg'}) as response:
+                    await response.read()
+                    if response.status == 200:
+                        return True
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    return False
+
+
+async def run_load(url, path, frames, concurrency, fps, duration, request_timeout):
+    """
+    concurrency client webcam, mỗi client gửi frame tuần tự tới khi hết thời gian.
+    fps > 0: frame tiếp theo được gửi đúng lịch (nếu kết quả về sớm) hoặc ngay khi kết quả về (trễ lịch = late).
+    """
+    samples = []  # (latency ms, {hop: ms}) của các request thành công
+    errors = {}
+    counters = {'late': 0}
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
+    interval = 1.0 / fps if fps > 0 else 0.0
+    forwarded = path in FORWARDED_PATHS
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def client(index):
+            # Lệch pha các client để không gửi cùng lúc
+            next_send = time.perf_counter() + (interval * index / concurrency if interval else 0.0)
+            frame_index = index
+            while next_send < deadline:
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                start = time.perf_counter()
+                try:
+                    async with session.post(url + path, data=frames[frame_index % len(frames)],
+                                            headers={'Content-Type': 'image/jpeg'}) as response:
+                        body = await response.read()
+                        status = response.status
+                        server_timing = parse_server_timing(response.headers.get('Server-Timing'))
+                except asyncio.TimeoutError:
+                    status = 'timeout'
+                except aiohttp.ClientError as e:
+                    status = type(e).__name__
+                latency = (time.perf_counter() - start) * 1000
+                frame_index += 1
+
+                if status == 200:
+                    hops = {}
+                    if 'gateway' in server_timing:
+                        hops['client_gateway'] = latency - server_timing['gateway']
+                        hops['gateway'] = server_timing['gateway'] - server_timing.get('upstream', 0.0)
+                        hops['upstream'] = server_timing.get('upstream', 0.0)
+                    if forwarded:
+                        try:
+                            hops['backend'] = json.loads(body)['processing_time'] * 1000
+                        except (ValueError, KeyError, TypeError):
+                            pass
+                    samples.append((latency, hops))
+                else:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+                if interval:
+                    next_send += interval
+                    if time.perf_counter() > next_send:
+                        counters['late'] += 1
+                        next_send = time.perf_counter()
+                else:
+                    next_send = time.perf_counter()
+
+        deadline = time.perf_counter() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return samples, errors, counters['late'], elapsed
+
+
+def percentiles(values):
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': round(float(p50), 2), 'p95': round(float(p95), 2), 'p99': round(float(p99), 2),
+            'mean': round(float(np.mean(values)), 2), 'max': round(float(np.max(values)), 2)}
+
+
+def summarize(samples, errors, late, elapsed, concurrency, fps):
+    total = len(samples) + sum(errors.values())
+    hop_values = {hop: [hops[hop] for _, hops in samples if hop in hops] for hop in HOPS}
+    return {
+        'requests': total,
+        'ok': len(samples),
+        'errors': dict(errors),
+        'error_rate': round(sum(errors.values()) / total, 4) if total else 0.0,
+        'elapsed': round(elapsed, 2),
+        'throughput': round(len(samples) / elapsed, 2),
+        'offered_fps': fps * concurrency if fps > 0 else None,
+        'late_frames': late,
+        'latency_ms': percentiles([latency for latency, _ in samples]),
+        'hops_ms': {hop: percentiles(values) for hop, values in hop_values.items() if values}
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def format_ms(stats, key):
+    return f'{stats[key]:.1f}' if stats else '-'
+
+
+def print_row(result):
+    latency = result['latency_ms']
+    hops = result['hops_ms']
+    print(f'{result["mode"]:>6} {result["clients"]:>7} {result["fps"] or "max":>4} {result["resolution"]:>10} '
+          f'{result["requests"]:>8} {result["throughput"]:>8.1f} {result["error_rate"] * 100:>6.2f}% '
+          f'{format_ms(latency, "p50"):>8} {format_ms(latency, "p95"):>8} {format_ms(latency, "p99"):>8} '
+          f'{format_ms(hops.get("client_gateway"), "p50"):>9} {format_ms(hops.get("gateway"), "p50"):>8} '
+          f'{format_ms(hops.get("upstream"), "p50"):>9} {format_ms(hops.get("backend"), "p50"):>8}'
+          f'  {result["errors"] or ""}', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test end-to-end gateway sync vs async')
+    parser.add_argument('--modes', default='sync,async')
+    parser.add_argument('--concurrency', default='10,100,1000', help='Số client webcam đồng thời')
+    parser.add_argument('--fps', default='0', help='Frame/giây mỗi client (0 = gửi liên tục), vd 5,15')
+    parser.add_argument('--resolution', default='640x480', help='Độ phân giải frame, vd 320x240,1280x720')
+    parser.add_argument('--duration', type=float, default=10, help='Số giây chạy mỗi tổ hợp')
+    parser.add_argument('--path', default='/api/face-recognition/recognize')
+    parser.add_argument('--latency', type=float, default=0.05, help='Độ trễ stub face_recognition (giây)')
+    parser.add_argument('--deepface-latency', type=float, default=None, help='Độ trễ stub deepface (giây)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Jitter stub (giây)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Tỉ lệ lỗi stub (0-1)')
+    parser.add_argument('--port', type=int, default=5100, help='Port của gateway được đo')
+    parser.add_argument('--request-timeout', type=float, default=60)
+    parser.add_argument('--image', default=None, help='Ảnh khuôn mặt (mặc định ảnh đầu tiên trong dataset)')
+    parser.add_argument('--no-stub', action='store_true', help='Dùng service thật đang chạy ở 5001/5002')
+    parser.add_argument('--json', default=None, help='Ghi kết quả ra file JSON')
+    args = parser.parse_args()
+
+    face_path = args.image or sorted(glob.glob(os.path.join(ROOT_DIR, 'dataset', '*', '*.jpg')))[0]
+    resolutions = [tuple(int(v) for v in r.lower().split('x')) for r in args.resolution.split(',')]
+    frames = {(w, h): make_frames(face_path, w, h) for w, h in resolutions}
+    fps_levels = [float(f) for f in args.fps.split(',')]
+    concurrency_levels = [int(c) for c in args.concurrency.split(',')]
+    deepface_latency = args.latency if args.deepface_latency is None else args.deepface_latency
+
+    stub = None
+    if not args.no_stub:
+        stub = start_process([sys.executable, os.path.join('benchmarks', 'stub_backends.py'),
+                              '--latency', str(args.latency), '--deepface-latency', str(deepface_latency),
+                              '--jitter', str(args.jitter), '--error-rate', str(args.error_rate)],
+                             'loadtest_stub.log')
+    url = f'http://127.0.0.1:{args.port}'
+    backends = 'real services' if args.no_stub else \
+        f'stub {args.latency * 1000:.0f}/{deepface_latency * 1000:.0f}ms, jitter {args.jitter * 1000:.0f}ms, ' \
+        f'error rate {args.error_rate:.1%}'
+    print(f'{args.path}, {backends}, {args.duration:.0f}s mỗi tổ hợp, {os.cpu_count()} CPU')
+    print(f'{"":>50}{"latency ms":^27} {"p50 per hop ms":^37}')
+    print(f'{"mode":>6} {"clients":>7} {"fps":>4} {"resolution":>10} {"requests":>8} {"req/s":>8} {"errors":>7} '
+          f'{"p50":>8} {"p95":>8} {"p99":>8} {"cli<->gw":>9} {"gateway":>8} {"upstream":>9} {"backend":>8}')
+
+    results = []
+    try:
+        for mode in args.modes.split(','):
+            gateway = start_process(GATEWAY_COMMANDS[mode] + [str(args.port)], f'loadtest_{mode}.log')
+            try:
+                warmup_frame = frames[resolutions[0]][0]
+                if not asyncio.run(wait_until_serving(url, args.path, warmup_frame)):
+                    print(f'{mode:>6} gateway không trả lời, xem {os.path.join(tempfile.gettempdir(), f"loadtest_{mode}.log")}')
+                    continue
+                for concurrency in concurrency_levels:
+                    for fps in fps_levels:
+                        for width, height in resolutions:
+                            samples, errors, late, elapsed = asyncio.run(run_load(
+                                url, args.path, frames[(width, height)], concurrency, fps,
+                                args.duration, args.request_timeout))
+                            result = {
+                                'mode': mode,
+                                'path': args.path,
+                                'clients': concurrency,
+                                'fps': fps if fps > 0 else None,
+                                'resolution': f'{width}x{height}',
+                                'frame_bytes': int(np.mean([len(f) for f in frames[(width, height)]])),
+                                **summarize(samples, errors, late, elapsed, concurrency, fps)
+                            }
+                            results.append(result)
+                            print_row(result)
+            finally:
+                stop_process(gateway)
+    finally:
+        if stub is not None:
+            stop_process(stub)
+
+    if args.json:
+        report = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'duration': args.duration,
+                'backends': 'real' if args.no_stub else {
+                    'latency': args.latency, 'deepface_latency': deepface_latency,
+                    'jitter': args.jitter, 'error_rate': args.error_rate
+                }
+            },
+            'results': results
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'📄 Đã ghi kết quả: {args.json}')
+
+
+if __name__ == '__main__':
+    main()
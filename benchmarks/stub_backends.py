@@ -0,0 +1,130 @@
+"""
+Backend giả cho load test gateway: face_recognition_service (port 5001) và deepface_service (port 5002)
+trả lời đúng định dạng JSON của service thật sau một độ trễ giả lập (asyncio.sleep, không tốn CPU),
+nên gateway là thành phần duy nhất được đo. Không cần dlib / TensorFlow.
+Độ trễ = latency + ngẫu nhiên [0, jitter]; --error-rate trả HTTP 500 cho một tỉ lệ request.
+processing_time trong response là thời gian thật của stub (giống service thật báo thời gian xử lý nội bộ).
+Chạy:
+    python benchmarks/stub_backends.py --latency 0.05 --deepface-latency 0.2 --jitter 0.01 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from aiohttp import web
+
+BOX = [40, 140, 140, 40]  # top, right, bottom, left
+
+
+async def _delay(request):
+    """Đọc body + chờ độ trễ giả lập; trả về (thời gian xử lý, response lỗi nếu bị chọn để lỗi)"""
+    start = time.perf_counter()
+    await request.read()
+    latency = request.app['latency'] + random.uniform(0, request.app['jitter'])
+    if latency > 0:
+        await asyncio.sleep(latency)
+    processing_time = round(time.perf_counter() - start, 4)
+    if random.random() < request.app['error_rate']:
+        return processing_time, web.json_response(
+            {'success': False, 'error': 'Lỗi giả lập (stub)', 'processing_time': processing_time}, status=500)
+    return processing_time, None
+
+
+async def livez(request):
+    return web.json_response({'status': 'alive', 'service': request.app['service_name']})
+
+
+async def readyz(request):
+    return web.json_response({'ready': True, 'state': 'ready', 'service': request.app['service_name']})
+
+
+async def health(request):
+    return web.json_response({'status': 'healthy', 'service': request.app['service_name'], 'stub': True})
+
+
+async def detect(request):
+    processing_time, error = await _delay(request)
+    if error is not None:
+        return error
+    return web.json_response({'success': True, 'boxes': [BOX], 'total_faces': 1, 'processing_time': processing_time})
+
+
+async def recognize(request):
+    processing_time, error = await _delay(request)
+    if error is not None:
+        return error
+    return web.json_response({
+        'success': True,
+        'faces': [{'name': 'stub', 'confidence': 99.0, 'location': {'top': BOX[0], 'right': BOX[1],
+                                                                    'bottom': BOX[2], 'left': BOX[3]}}],
+        'total_faces': 1,
+        'processing_time': processing_time
+    })
+
+
+async def analyze(request):
+    processing_time, error = await _delay(request)
+    if error is not None:
+        return error
+    attributes = {'age': 30, 'dominant_emotion': 'neutral', 'dominant_gender': 'Man', 'cached': False}
+    if request.query.get('faces') == 'all':
+        return web.json_response({'success': True, 'faces': [attributes], 'total_faces': 1,
+                                  'processing_time': processing_time})
+    return web.json_response({'success': True, 'analysis': attributes, 'processing_time': processing_time})
+
+
+def create_backend(service_name, latency, jitter=0.0, error_rate=0.0):
+    application = web.Application(client_max_size=32 * 1024 ** 2)
+    application['service_name'] = service_name
+    application['latency'] = latency
+    application['jitter'] = jitter
+    application['error_rate'] = error_rate
+    application.router.add_get('/livez', livez)
+    application.router.add_get('/readyz', readyz)
+    application.router.add_get('/health', health)
+    application.router.add_post('/detect', detect)
+    application.router.add_post('/recognize', recognize)
+    application.router.add_post('/analyze', analyze)
+    return application
+
+
+async def serve(latency, deepface_latency, jitter, error_rate, fr_port, deepface_port, host='127.0.0.1'):
+    runners = []
+    for service_name, port, service_latency in (('face_recognition', fr_port, latency),
+                                                ('deepface', deepface_port, deepface_latency)):
+        runner = web.AppRunner(create_backend(service_name, service_latency, jitter, error_rate), access_log=None)
+        await runner.setup()
+        # backlog lớn: load test mở hàng nghìn kết nối cùng lúc
+        await web.TCPSite(runner, host, port, backlog=4096).start()
+        runners.append(runner)
+    print(f'🧪 Stub backends: face_recognition :{fr_port} ({latency * 1000:.0f}ms), '
+          f'deepface :{deepface_port} ({deepface_latency * 1000:.0f}ms), jitter {jitter * 1000:.0f}ms, '
+          f'error rate {error_rate:.1%}', flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub backends cho load test gateway')
+    parser.add_argument('--latency', type=float, default=0.05, help='Độ trễ mỗi request (giây)')
+    parser.add_argument('--deepface-latency', type=float, default=None,
+                        help='Độ trễ riêng của deepface (mặc định bằng --latency)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Cộng thêm ngẫu nhiên [0, jitter] giây')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Tỉ lệ request trả HTTP 500 (0-1)')
+    parser.add_argument('--fr-port', type=int, default=5001)
+    parser.add_argument('--deepface-port', type=int, default=5002)
+    args = parser.parse_args()
+    try:
+        deepface_latency = args.latency if args.deepface_latency is None else args.deepface_latency
+        asyncio.run(serve(args.latency, deepface_latency, args.jitter, args.error_rate,
+                          args.fr_port, args.deepface_port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+DeepFace Batch - Phân tích thuộc tính cho nhiều khuôn mặt cùng lúc
+DeepFace.analyze chạy từng model cho từng khuôn mặt (N khuôn mặt x 4 model = 4N lần gọi mạng).
+Ở đây các khuôn mặt đã cắt được ghép thành 1 tensor (N x 224 x 224 x 3) và mỗi model chỉ chạy 1 lần
+cho cả batch. Tiền xử lý và hậu xử lý giữ đúng như deepface.modules.demography để kết quả không đổi.
+"""
+import time
+
+import numpy as np
+
+from deepface_models import ACTION_MODELS
+
+# Nhãn đầu ra của các model (cùng thứ tự với deepface.models.demography.DemographyUtils)
+EMOTION_LABELS = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+GENDER_LABELS = ['Woman', 'Man']
+RACE_LABELS = ['asian', 'indian', 'black', 'white', 'middle eastern', 'latino hispanic']
+
+MODEL_INPUT_SIZE = (224, 224)
+
+
+def _get_model(model_name):
+    from deepface.modules import modeling
+    return modeling.build_model(task='facial_attribute', model_name=model_name)
+
+
+def prepare_face_batch(faces_bgr):
+    """Khuôn mặt đã cắt (BGR uint8, kích thước bất kỳ) -> tensor (N x 224 x 224 x 3) float32 trong [0, 1]"""
+    from deepface.modules import preprocessing
+    batch = np.empty((len(faces_bgr),) + MODEL_INPUT_SIZE + (3,), dtype=np.float32)
+    for i, face in enumerate(faces_bgr):
+        # Giống demography.analyze: resize giữ tỉ lệ + viền đen
+        batch[i] = preprocessing.resize_image(img=face.astype(np.float32) / 255, target_size=MODEL_INPUT_SIZE)[0]
+    return batch
+
+
+def _label_scores(predictions, labels, normalize):
+    """Dict nhãn -> phần trăm, giống cách demography.analyze đổi đầu ra model"""
+    total = predictions.sum() if normalize else 1.0
+    return {label: 100 * predictions[i] / total for i, label in enumerate(labels)}
+
+
+def analyze_face_batch(face_batch, actions, get_model=_get_model, max_batch_size=16, timings=None):
+    """
+    Chạy các model thuộc tính trên batch khuôn mặt, mỗi model 1 lần cho mỗi đoạn max_batch_size khuôn mặt.
+    Trả về list dict kết quả (cùng định dạng DeepFace.analyze, không có region) theo thứ tự khuôn mặt.
+    timings: dict (tùy chọn) được cộng thêm số giây chạy model của từng action.
+    """
+    results = [{} for _ in range(len(face_batch))]
+    if len(face_batch) == 0:
+        return results
+
+    for action in actions:
+        action_start = time.perf_counter()
+        model = get_model(ACTION_MODELS[action])
+        for start in range(0, len(face_batch), max_batch_size):
+            chunk = face_batch[start:start + max_batch_size]
+            predictions = model.predict(chunk)
+            # Batch 1 khuôn mặt -> model trả về kết quả không có chiều batch
+            if action == 'age':
+                predictions = np.atleast_1d(predictions)
+            else:
+                predictions = np.asarray(predictions).reshape(len(chunk), -1)
+
+            for offset, prediction in enumerate(predictions):
+                obj = results[start + offset]
+                if action == 'age':
+                    obj['age'] = int(prediction)
+                elif action == 'emotion':
+                    obj['emotion'] = _label_scores(prediction, EMOTION_LABELS, normalize=True)
+                    obj['dominant_emotion'] = EMOTION_LABELS[int(np.argmax(prediction))]
+                elif action == 'gender':
+                    obj['gender'] = _label_scores(prediction, GENDER_LABELS, normalize=False)
+                    obj['dominant_gender'] = GENDER_LABELS[int(np.argmax(prediction))]
+                elif action == 'race':
+                    obj['race'] = _label_scores(prediction, RACE_LABELS, normalize=True)
+                    obj['dominant_race'] = RACE_LABELS[int(np.argmax(prediction))]
+        if timings is not None:
+            timings[action] = timings.get(action, 0.0) + time.perf_counter() - action_start
+    return results
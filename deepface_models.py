@@ -0,0 +1,235 @@
+"""
+DeepFace Models - Quản lý model phân tích thuộc tính (age / gender / race / emotion) của deepface_service
+- Lazy: model chỉ được load khi có request đầu tiên cần action tương ứng
+- Memory budget: tổng bộ nhớ model vượt budget (hoặc số model vượt max_models) -> giải phóng model
+  ít dùng gần đây nhất (LRU) mà không có request nào đang dùng
+- Bộ nhớ mỗi model: số tham số nếu là Keras model, ngược lại là RSS của process tăng thêm khi load
+"""
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Action của DeepFace.analyze -> tên model facial_attribute
+ACTION_MODELS = {
+    'age': 'Age',
+    'gender': 'Gender',
+    'race': 'Race',
+    'emotion': 'Emotion'
+}
+ALL_ACTIONS = list(ACTION_MODELS)
+
+
+def _build_deepface_model(model_name):
+    from deepface import DeepFace
+    return DeepFace.build_model(model_name=model_name, task='facial_attribute')
+
+
+def _release_deepface_model(model_name):
+    """Bỏ model khỏi cache singleton của DeepFace để bộ nhớ được thu hồi"""
+    try:
+        from deepface.modules import modeling
+        cached = getattr(modeling, 'cached_models', {})
+        cached.get('facial_attribute', {}).pop(model_name, None)
+    except ImportError:
+        pass
+
+
+def _model_memory_bytes(model):
+    """Ước lượng bộ nhớ từ số tham số float32 của Keras model bên trong (0 = không biết)"""
+    keras_model = getattr(model, 'model', None)
+    if keras_model is not None and hasattr(keras_model, 'count_params'):
+        return int(keras_model.count_params()) * 4
+    return 0
+
+
+def process_rss_bytes():
+    """RSS hiện tại của process (psutil nếu có, ngược lại /proc trên Linux); None nếu không đọc được"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class AttributeModelRegistry:
+    """
+    Theo dõi model đang nằm trong RAM. Dùng:
+        with registry.use(actions):
+            DeepFace.analyze(..., actions=actions)
+    """
+
+    def __init__(self, memory_budget_mb=0, max_models=0, loader=_build_deepface_model,
+                 unloader=_release_deepface_model, memory_of=_model_memory_bytes, rss_of=process_rss_bytes):
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)  # 0 = không giới hạn
+        self.max_models = max_models  # 0 = không giới hạn số model cùng nằm trong RAM
+        self._loader = loader
+        self._unloader = unloader
+        self._memory_of = memory_of
+        self._rss_of = rss_of
+        self._resident = OrderedDict()  # action -> thông tin model, thứ tự = LRU
+        self._in_use = {}
+        self._lock = threading.RLock()
+        # Mỗi action có lock riêng để 2 request không load cùng 1 model cùng lúc
+        self._load_locks = {action: threading.Lock() for action in ACTION_MODELS}
+        self.evictions = 0
+
+    def _load(self, action):
+        with self._load_locks[action]:
+            with self._lock:
+                if action in self._resident:
+                    return
+            model_name = ACTION_MODELS[action]
+            print(f"🔄 Đang load model {model_name}...")
+            start = time.time()
+            rss_before = self._rss_of()
+            model = self._loader(model_name)
+            memory_bytes = self._memory_of(model)
+            memory_source = 'params'
+            if not memory_bytes:
+                # Backend không phải Keras: lấy phần RSS tăng thêm khi load (gần đúng nếu 2 model load cùng lúc)
+                rss_after = self._rss_of()
+                memory_source = 'rss'
+                memory_bytes = max(0, rss_after - rss_before) if rss_before is not None and rss_after is not None else 0
+                if not memory_bytes:
+                    memory_source = None
+            with self._lock:
+                self._resident[action] = {
+                    'model': model_name,
+                    'memory_bytes': memory_bytes,
+                    'memory_source': memory_source,
+                    'load_time': round(time.time() - start, 2),
+                    'loaded_at': time.time(),
+                    'last_used': time.time(),
+                    'uses': 0
+                }
+            print(f"✅ Model {model_name} sẵn sàng ({time.time() - start:.2f}s)")
+
+    def _over_limit(self):
+        if self.memory_budget and self.resident_bytes() > self.memory_budget:
+            return 'vượt memory budget'
+        if self.max_models and len(self._resident) > self.max_models:
+            return 'vượt số model tối đa'
+        return None
+
+    def _evict_over_budget(self):
+        """Giải phóng model LRU không ai đang dùng cho tới khi tổng bộ nhớ <= budget và số model <= max_models"""
+        if not self.memory_budget and not self.max_models:
+            return
+        with self._lock:
+            for action in list(self._resident):
+                reason = self._over_limit()
+                if reason is None:
+                    break
+                if self._in_use.get(action):
+                    continue
+                info = self._resident.pop(action)
+                self._unloader(info['model'])
+                self.evictions += 1
+                print(f"♻️ Giải phóng model {info['model']} ({info['memory_bytes'] / 2**20:.0f} MB) - {reason}")
+        gc.collect()
+
+    def acquire(self, actions):
+        """Đảm bảo model của các action đã load và đánh dấu đang dùng"""
+        with self._lock:
+            for action in actions:
+                self._in_use[action] = self._in_use.get(action, 0) + 1
+        try:
+            for action in actions:
+                self._load(action)
+        except Exception:
+            self.release(actions)
+            raise
+        with self._lock:
+            now = time.time()
+            for action in actions:
+                self._resident.move_to_end(action)
+                self._resident[action]['last_used'] = now
+                self._resident[action]['uses'] += 1
+        self._evict_over_budget()
+
+    def release(self, actions):
+        with self._lock:
+            for action in actions:
+                self._in_use[action] = max(0, self._in_use.get(action, 0) - 1)
+        # Model vừa hết được dùng có thể là model cần giải phóng
+        self._evict_over_budget()
+
+    def use(self, actions):
+        return _ModelLease(self, actions)
+
+    def active_leases(self):
+        """Tổng số lượt (request x action) đang dùng hoặc đang chờ load model"""
+        with self._lock:
+            return sum(self._in_use.values())
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(info['memory_bytes'] for info in self._resident.values())
+
+    def stats(self):
+        with self._lock:
+            models = [
+                {
+                    'action': action,
+                    'model': info['model'],
+                    'memory_mb': round(info['memory_bytes'] / 2**20, 1),
+                    'memory_source': info['memory_source'],
+                    'load_time': info['load_time'],
+                    'last_used': info['last_used'],
+                    'uses': info['uses'],
+                    'in_use': self._in_use.get(action, 0)
+                }
+                for action, info in self._resident.items()
+            ]
+            return {
+                'resident_models': models,
+                'resident_memory_mb': round(self.resident_bytes() / 2**20, 1),
+                'memory_budget_mb': round(self.memory_budget / 2**20, 1) if self.memory_budget else None,
+                'max_models': self.max_models or None,
+                'evictions': self.evictions
+            }
+
+
+class _ModelLease:
+    def __init__(self, registry, actions):
+        self.registry = registry
+        self.actions = list(actions)
+
+    def __enter__(self):
+        self.registry.acquire(self.actions)
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.release(self.actions)
+        return False
+
+
+def parse_actions(value):
+    """
+    Đọc danh sách action từ request ('emotion,age' hoặc list). None/rỗng = tất cả.
+    Trả về (actions, action không hợp lệ)
+    """
+    if not value:
+        return list(ALL_ACTIONS), []
+    if isinstance(value, str):
+        value = value.split(',')
+    actions = []
+    invalid = []
+    for action in value:
+        action = str(action).strip().lower()
+        if not action:
+            continue
+        if action not in ACTION_MODELS:
+            invalid.append(action)
+        elif action not in actions:
+            actions.append(action)
+    return actions or list(ALL_ACTIONS), invalid
@@ -3,15 +3,23 @@ DeepFace Service - Chạy trong môi trường deepface_recognition của Anacon
 Load models trước để đảm bảo real-time processing
 Port: 5002
 """
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
+from werkzeug.serving import WSGIRequestHandler
 from deepface import DeepFace
 import base64
 import io
+import json
 import os
 import time
-import tempfile
 from PIL import Image
 import numpy as np
+import cv2
+from deepface_models import AttributeModelRegistry, ALL_ACTIONS, parse_actions
+from analysis_cache import AnalysisCache, dhash
+from deepface_batch import analyze_face_batch, prepare_face_batch
+from service_readiness import ServiceReadiness, PROBE_PATHS
+from service_metrics import ServiceMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from service_profiler import RequestProfiler, install_profiler
 
 app = Flask(__name__)
 
@@ -19,9 +27,56 @@ app = Flask(__name__)
 _model_status = {
     'loaded': False,
     'timestamp': 0,
-    'models': ['age', 'gender', 'race', 'emotion']
+    'models': list(ALL_ACTIONS)
 }
 
+# Model thuộc tính chưa load sẵn được load khi có request đầu tiên cần tới (lazy).
+# DEEPFACE_PRELOAD_ACTIONS: các action load sẵn khi khởi động, mặc định tất cả (= action mặc định của /analyze,
+#   request đầu tiên không phải chờ load model và không vượt REQUEST_TIMEOUT của gateway); "none" = load khi cần
+# DEEPFACE_MODEL_BUDGET_MB: tổng bộ nhớ model tối đa, vượt thì giải phóng model ít dùng nhất (0 = không giới hạn)
+# DEEPFACE_MAX_MODELS: số model tối đa cùng nằm trong RAM (0 = không giới hạn), dùng khi không ước lượng được bộ nhớ
+_preload_setting = os.environ.get('DEEPFACE_PRELOAD_ACTIONS', ','.join(ALL_ACTIONS)).strip()
+PRELOAD_ACTIONS = [] if _preload_setting.lower() in ('', 'none') else parse_actions(_preload_setting)[0]
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get('DEEPFACE_MODEL_BUDGET_MB', '0'))
+MAX_RESIDENT_MODELS = int(os.environ.get('DEEPFACE_MAX_MODELS', '0'))
+_models = AttributeModelRegistry(memory_budget_mb=MODEL_MEMORY_BUDGET_MB, max_models=MAX_RESIDENT_MODELS)
+
+# Trạng thái khởi động: __main__ mở port ngay rồi warmup detector / model load sẵn ở thread nền
+_readiness = ServiceReadiness('deepface', progress_fn=lambda: {
+    'preload_actions': PRELOAD_ACTIONS,
+    'resident_models': [model['action'] for model in _models.stats()['resident_models']]
+})
+
+# Cache kết quả theo dHash của khuôn mặt đã cắt: frame webcam liên tiếp gần như giống nhau -> không chạy lại CNN
+# DEEPFACE_CACHE_SIZE: số khuôn mặt tối đa trong cache (0 = tắt cache)
+# DEEPFACE_CACHE_TTL: số giây 1 kết quả còn được dùng lại (biểu cảm thay đổi nhanh -> TTL ngắn)
+# DEEPFACE_CACHE_MAX_DISTANCE: khoảng cách Hamming tối đa (trên 64 bit) để coi 2 khuôn mặt là gần trùng
+CACHE_SIZE = int(os.environ.get('DEEPFACE_CACHE_SIZE', '256'))
+CACHE_TTL = float(os.environ.get('DEEPFACE_CACHE_TTL', '10'))
+CACHE_MAX_DISTANCE = int(os.environ.get('DEEPFACE_CACHE_MAX_DISTANCE', '4'))
+_analysis_cache = AnalysisCache(CACHE_SIZE, CACHE_TTL, CACHE_MAX_DISTANCE) if CACHE_SIZE > 0 else None
+
+# Số khuôn mặt tối đa trong 1 batch tensor đưa vào model (giới hạn bộ nhớ khi ảnh đông người)
+MAX_FACE_BATCH = int(os.environ.get('DEEPFACE_MAX_FACE_BATCH', '16'))
+
+# Box cho sẵn (?boxes=) được nới thêm % mỗi chiều: box HOG của dlib sát mặt hơn box Haar cascade của opencv
+BOX_EXPAND_PERCENT = float(os.environ.get('DEEPFACE_BOX_EXPAND_PERCENT', '10'))
+
+# Histogram thời gian từng bước (model của từng action: stage="action_<tên>") + gauge trạng thái cho /metrics
+_metrics = ServiceMetrics('deepface')
+_metrics.add_gauge('resident_models', 'Số model thuộc tính đang nằm trong RAM',
+                   lambda: len(_models.stats()['resident_models']))
+_metrics.add_gauge('resident_model_memory_bytes', 'Bộ nhớ của các model đang nằm trong RAM',
+                   lambda: _models.resident_bytes())
+_metrics.add_gauge('model_leases', 'Số lượt request đang giữ / chờ model (theo action)',
+                   lambda: _models.active_leases())
+_metrics.add_gauge('analysis_cache_entries', 'Số khuôn mặt trong cache kết quả',
+                   lambda: _analysis_cache.stats()['entries'] if _analysis_cache is not None else 0)
+_metrics.add_gauge('ready', '1 nếu service đã warmup xong', lambda: 1 if _readiness.ready else 0)
+
+# cProfile lấy mẫu 1/N request /analyze khi admin bật
+_profiler = RequestProfiler('deepface', ('/analyze',))
+
 def convert_to_serializable(obj):
     """
     Chuyển đổi numpy types thành Python native types để có thể serialize JSON
@@ -48,36 +103,33 @@ def preload_models():
         return True
     
     print("\n🔄 Đang pre-load DeepFace models...")
-    print("⏳ Quá trình này có thể mất 30-60 giây...")
+    print(f"📋 Load sẵn: {', '.join(PRELOAD_ACTIONS) or 'chỉ face detector (model thuộc tính load khi cần)'}")
     start_time = time.time()
     
     try:
-        # Tạo một ảnh dummy để force load tất cả models
+        # Tạo một ảnh dummy để force load models
         dummy_img = np.zeros((224, 224, 3), dtype=np.uint8)
         dummy_img[100:150, 100:150] = [255, 255, 255]  # white square để có "face"
         
-        # Lưu tạm
-        temp_path = os.path.join(tempfile.gettempdir(), 'deepface_warmup.jpg')
-        Image.fromarray(dummy_img).save(temp_path)
-        
-        # Chạy analyze để load models
+        # Chạy trực tiếp trên mảng numpy (không cần file tạm)
         try:
-            DeepFace.analyze(
-                img_path=temp_path,
-                actions=['age', 'gender', 'race', 'emotion'],
-                enforce_detection=False,
-                silent=True
-            )
+            if PRELOAD_ACTIONS:
+                with _models.use(PRELOAD_ACTIONS):
+                    DeepFace.analyze(
+                        img_path=dummy_img,
+                        actions=PRELOAD_ACTIONS,
+                        enforce_detection=False,
+                        silent=True
+                    )
+            else:
+                # Chỉ khởi tạo face detector
+                DeepFace.extract_faces(img_path=dummy_img, detector_backend='opencv', enforce_detection=False)
             print("✅ Models loaded successfully!")
         except Exception as e:
             # Ngay cả khi có lỗi detection, models vẫn được load
             print(f"⚠️ Warmup warning (expected): {str(e)[:100]}")
             print("✅ Models đã được load (ignore warning trên)")
         
-        # Xóa file tạm
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        
         _model_status['loaded'] = True
         _model_status['timestamp'] = time.time()
         
@@ -91,107 +143,326 @@ def preload_models():
         print(f"❌ Lỗi khi pre-load models: {str(e)}")
         return False
 
+def _read_request_image_bytes():
+    """
+    Đọc bytes ảnh từ request. Hỗ trợ:
+    - body binary (image/jpeg, image/png, application/octet-stream) - không tốn 33% base64
+    - multipart/form-data với field 'image'
+    - JSON {'image': base64 / data URL} - giữ tương thích với client cũ
+    """
+    mimetype = request.mimetype
+    if mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        return request.get_data()
+    if mimetype == 'multipart/form-data':
+        image_file = request.files.get('image')
+        return image_file.read() if image_file else None
+    
+    data = request.get_json(silent=True) or {}
+    image_data = data.get('image')
+    if not image_data:
+        return None
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
+
+def _decode_image_bgr(image_bytes):
+    """
+    Decode bytes ảnh thành mảng BGR uint8 (định dạng DeepFace dùng nội bộ) - hoàn toàn trong RAM,
+    không ghi file tạm và không nén lại JPEG
+    """
+    # PIL chỉ đọc header để biết ảnh có kênh alpha hay không
+    image_pil = Image.open(io.BytesIO(image_bytes))
+    
+    if image_pil.mode not in ('RGBA', 'LA', 'P'):
+        # Decode thẳng ra BGR; bỏ qua EXIF orientation giống đường cũ (PIL -> JPEG -> cv2.imread)
+        image_bgr = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8),
+                                 cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if image_bgr is not None:
+            return image_bgr
+    
+    # Ảnh có kênh alpha (hoặc định dạng cv2 không đọc được) -> ghép lên nền trắng bằng PIL
+    if image_pil.mode in ('RGBA', 'LA', 'P'):
+        rgb_image = Image.new('RGB', image_pil.size, (255, 255, 255))
+        if image_pil.mode == 'P':
+            image_pil = image_pil.convert('RGBA')
+        rgb_image.paste(image_pil, mask=image_pil.split()[-1] if image_pil.mode in ('RGBA', 'LA') else None)
+        image_pil = rgb_image
+    elif image_pil.mode != 'RGB':
+        image_pil = image_pil.convert('RGB')
+    
+    return cv2.cvtColor(np.asarray(image_pil), cv2.COLOR_RGB2BGR)
+
+def _request_actions():
+    """Action cần chạy: ?actions=emotion,age, field 'actions' của multipart/JSON; mặc định tất cả"""
+    value = request.args.get('actions')
+    if value is None and request.mimetype == 'multipart/form-data':
+        value = request.form.get('actions')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('actions')
+    return parse_actions(value)
+
+def _request_cache_enabled():
+    """Bỏ qua cache cho 1 request: ?cache=0, field 'cache' false của multipart/JSON hoặc header Cache-Control: no-cache"""
+    if 'no-cache' in request.headers.get('Cache-Control', ''):
+        return False
+    value = request.args.get('cache')
+    if value is None and request.mimetype == 'multipart/form-data':
+        value = request.form.get('cache')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('cache')
+    if value is None:
+        return True
+    return str(value).strip().lower() not in ('0', 'false', 'no', 'off')
+
+def _request_all_faces():
+    """Chế độ tất cả khuôn mặt: ?faces=all hoặc field 'faces' của multipart/JSON; mặc định chỉ khuôn mặt đầu tiên"""
+    value = request.args.get('faces')
+    if value is None and request.mimetype == 'multipart/form-data':
+        value = request.form.get('faces')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('faces')
+    return str(value).strip().lower() == 'all'
+
+def _request_boxes():
+    """
+    Box khuôn mặt đã detect sẵn (cùng quy ước với face_recognition_service): ?boxes=[[top, right, bottom, left], ...]
+    hoặc field 'boxes' của multipart/JSON. Trả về None nếu request không có box -> service tự detect.
+    """
+    value = request.args.get('boxes')
+    if value is None and request.mimetype == 'multipart/form-data':
+        value = request.form.get('boxes')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('boxes')
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = json.loads(value)
+    boxes = [tuple(int(v) for v in box) for box in value]
+    if any(len(box) != 4 for box in boxes):
+        raise ValueError('Mỗi box phải gồm 4 giá trị [top, right, bottom, left]')
+    return boxes
+
+def _crop_boxes(image_bgr, boxes):
+    """Cắt khuôn mặt tại các box cho sẵn - cùng định dạng kết quả với DeepFace.extract_faces (không align)"""
+    height, width = image_bgr.shape[:2]
+    faces = []
+    for top, right, bottom, left in boxes:
+        pad_x = int((right - left) * BOX_EXPAND_PERCENT / 200)
+        pad_y = int((bottom - top) * BOX_EXPAND_PERCENT / 200)
+        top, bottom = max(0, top - pad_y), min(height, bottom + pad_y)
+        left, right = max(0, left - pad_x), min(width, right + pad_x)
+        faces.append({
+            'face': image_bgr[top:bottom, left:right],
+            'facial_area': {'x': left, 'y': top, 'w': right - left, 'h': bottom - top},
+            'confidence': None
+        })
+    return faces
+
+def _analyze_faces(faces_bgr, actions, use_cache):
+    """
+    Phân tích các khuôn mặt đã cắt (BGR uint8). Trả về list (kết quả DeepFace, có lấy từ cache hay không).
+    Khuôn mặt có trong cache được trả lại ngay; các khuôn mặt còn lại chạy chung 1 batch qua mỗi model
+    """
+    results = [None] * len(faces_bgr)
+    fingerprints = [None] * len(faces_bgr)
+    if _analysis_cache is not None:
+        with _metrics.stage('cache_lookup'):
+            for i, face_bgr in enumerate(faces_bgr):
+                if not use_cache:
+                    _analysis_cache.record_bypass()
+                    continue
+                fingerprints[i] = dhash(face_bgr)
+                cached = _analysis_cache.get(fingerprints[i], actions)
+                if cached is not None:
+                    results[i] = (cached, True)
+    
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        with _metrics.stage('preprocess'):
+            face_batch = prepare_face_batch([faces_bgr[i] for i in pending])
+        timings = {}
+        # Vào lease = load model còn thiếu (lần đầu / sau khi bị giải phóng)
+        lease_start = time.perf_counter()
+        with _models.use(actions):
+            _metrics.observe_stage('model_acquire', time.perf_counter() - lease_start)
+            objs = analyze_face_batch(face_batch, actions, max_batch_size=MAX_FACE_BATCH, timings=timings)
+        for action, seconds in timings.items():
+            _metrics.observe_stage(f'action_{action}', seconds)
+        for i, obj in zip(pending, objs):
+            if fingerprints[i] is not None:
+                _analysis_cache.put(fingerprints[i], obj)
+            results[i] = (obj, False)
+    return results
+
+def _format_analysis(obj, actions):
+    """Kết quả của 1 khuôn mặt - chỉ gồm các field của action đã chạy (giá trị Python native để jsonify)"""
+    result = {}
+    if 'age' in actions:
+        result['age'] = int(obj.get('age', 0))
+    if 'gender' in actions:
+        result['gender'] = str(obj.get('dominant_gender', 'N/A'))
+        result['gender_confidence'] = float(round(float(obj.get('gender', {}).get(obj.get('dominant_gender', ''), 0)), 2))
+    if 'emotion' in actions:
+        result['emotion'] = str(obj.get('dominant_emotion', 'N/A'))
+        result['emotion_confidence'] = float(round(float(obj.get('emotion', {}).get(obj.get('dominant_emotion', ''), 0)), 2))
+        result['all_emotions'] = convert_to_serializable(obj.get('emotion', {}))
+    if 'race' in actions:
+        result['race'] = str(obj.get('dominant_race', 'N/A'))
+        result['race_confidence'] = float(round(float(obj.get('race', {}).get(obj.get('dominant_race', ''), 0)), 2))
+        result['all_races'] = convert_to_serializable(obj.get('race', {}))
+    return result
+
+@app.before_request
+def start_request_metrics():
+    """Chạy trước reject_until_ready để request bị từ chối lúc khởi động cũng được đếm"""
+    if request.path not in PROBE_PATHS and request.path != '/metrics':
+        g.metrics_started = _metrics.request_started(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def finish_request_metrics(response):
+    if 'metrics_started' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        _metrics.request_finished(g.pop('metrics_started'), endpoint, response.status_code)
+    return response
+
+@app.before_request
+def reject_until_ready():
+    """Đang warmup ở background -> chỉ trả lời probe, request phân tích nhận 503 + Retry-After"""
+    if request.path not in PROBE_PATHS and not _readiness.ready:
+        payload, status, headers = _readiness.not_ready_response()
+        return jsonify(payload), status, headers
+
+# Profile cProfile theo yêu cầu (admin): /admin/profile/start, tắt thì không tốn gì
+install_profiler(app, _profiler)
+
+@app.route('/livez', methods=['GET'])
+def liveness():
+    """Process còn sống (kể cả khi đang load model)"""
+    return jsonify(_readiness.livez())
+
+@app.route('/readyz', methods=['GET'])
+def readiness():
+    """200 khi đã warmup xong, 503 + tiến độ (model đã load) khi đang khởi động"""
+    payload, status = _readiness.readyz()
+    return jsonify(payload), status
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Thời gian từng bước + trạng thái dạng text Prometheus"""
+    return Response(_metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
         'service': 'deepface',
+        'ready': _readiness.ready,
         'models_loaded': _model_status['loaded'],
         'supported_actions': _model_status['models'],
+        **_models.stats(),
+        'analysis_cache': _analysis_cache.stats() if _analysis_cache is not None else None,
         'timestamp': _model_status['timestamp']
     })
 
 @app.route('/analyze', methods=['POST'])
 def analyze_face():
-    """API phân tích khuôn mặt từ base64 image"""
-    temp_file = None
-    
+    """API phân tích khuôn mặt - nhận ảnh binary, multipart hoặc JSON base64"""
     try:
-        data = request.json
-        image_data = data.get('image')
+        image_bytes = _read_request_image_bytes()
         
-        if not image_data:
+        if not image_bytes:
             return jsonify({
                 'success': False,
                 'error': 'Không có dữ liệu ảnh'
             }), 400
         
-        # Decode base64 image
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        image_pil = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert RGBA sang RGB nếu cần (để tránh lỗi khi lưu JPEG)
-        if image_pil.mode in ('RGBA', 'LA', 'P'):
-            # Tạo background trắng
-            rgb_image = Image.new('RGB', image_pil.size, (255, 255, 255))
-            if image_pil.mode == 'P':
-                image_pil = image_pil.convert('RGBA')
-            rgb_image.paste(image_pil, mask=image_pil.split()[-1] if image_pil.mode in ('RGBA', 'LA') else None)
-            image_pil = rgb_image
-        elif image_pil.mode != 'RGB':
-            image_pil = image_pil.convert('RGB')
-        
-        # Lưu tạm để DeepFace có thể đọc
-        temp_file = os.path.join(tempfile.gettempdir(), f'deepface_analyze_{int(time.time()*1000)}.jpg')
-        image_pil.save(temp_file, 'JPEG')
-        
-        # Phân tích ảnh
-        start_time = time.time()
-        objs = DeepFace.analyze(
-            img_path=temp_file,
-            actions=['age', 'gender', 'race', 'emotion'],
-            enforce_detection=True,
-            silent=True
-        )
-        processing_time = time.time() - start_time
+        actions, invalid_actions = _request_actions()
+        if invalid_actions:
+            return jsonify({
+                'success': False,
+                'error': f'Action không hợp lệ: {", ".join(invalid_actions)}. Hỗ trợ: {", ".join(ALL_ACTIONS)}'
+            }), 400
         
-        # Xóa file tạm
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-            temp_file = None
+        try:
+            boxes = _request_boxes()
+        except (ValueError, TypeError) as e:
+            return jsonify({
+                'success': False,
+                'error': f'Box không hợp lệ: {str(e)}'
+            }), 400
+        
+        with _metrics.stage('decode'):
+            image_bgr = _decode_image_bgr(image_bytes)
+        
+        start_time = time.time()
+        if boxes is not None:
+            # Khuôn mặt đã được detect ở nơi khác (gateway /api/recognize-analyze) -> chỉ cắt theo box
+            with _metrics.stage('crop'):
+                faces = _crop_boxes(image_bgr, boxes)
+        else:
+            # Detect 1 lần lấy các khuôn mặt đã cắt + align (BGR uint8): làm khóa cache và đầu vào batch
+            with _metrics.stage('detect'):
+                faces = DeepFace.extract_faces(
+                    img_path=image_bgr,
+                    detector_backend='opencv',
+                    enforce_detection=True,
+                    align=True,
+                    color_face='bgr',
+                    normalize_face=False
+                )
+        faces = [face for face in faces if face['face'].shape[0] and face['face'].shape[1]]
         
-        if len(objs) == 0:
+        if len(faces) == 0:
             return jsonify({
                 'success': False,
                 'error': 'Không tìm thấy khuôn mặt trong ảnh'
             })
+        total_faces = len(faces)
         
-        # Lấy kết quả khuôn mặt đầu tiên
-        obj = objs[0]
-        
-        # Convert tất cả dữ liệu thành Python native types trước
-        result = {
-            'success': True,
-            'age': int(obj.get('age', 0)),
-            'gender': str(obj.get('dominant_gender', 'N/A')),
-            'gender_confidence': float(round(float(obj.get('gender', {}).get(obj.get('dominant_gender', ''), 0)), 2)),
-            'emotion': str(obj.get('dominant_emotion', 'N/A')),
-            'emotion_confidence': float(round(float(obj.get('emotion', {}).get(obj.get('dominant_emotion', ''), 0)), 2)),
-            'race': str(obj.get('dominant_race', 'N/A')),
-            'race_confidence': float(round(float(obj.get('race', {}).get(obj.get('dominant_race', ''), 0)), 2)),
-            'all_emotions': convert_to_serializable(obj.get('emotion', {})),
-            'all_races': convert_to_serializable(obj.get('race', {})),
-            'total_faces': int(len(objs)),
-            'processing_time': float(round(processing_time, 3))
-        }
+        all_faces = _request_all_faces()
+        if not all_faces:
+            faces = faces[:1]
         
-        # Convert toàn bộ result để đảm bảo an toàn
-        result = convert_to_serializable(result)
+        # Chỉ load / chạy model của các action được yêu cầu
+        faces_bgr = [np.ascontiguousarray(face['face'], dtype=np.uint8) for face in faces]
+        analyses = _analyze_faces(faces_bgr, actions, _request_cache_enabled())
+        processing_time = time.time() - start_time
         
-        return jsonify(result)
+        if all_faces:
+            result = {
+                'success': True,
+                'faces': [
+                    {
+                        'region': {key: face['facial_area'].get(key) for key in ('x', 'y', 'w', 'h')},
+                        'face_confidence': float(face.get('confidence') or 0),
+                        **_format_analysis(obj, actions),
+                        'cached': cached
+                    }
+                    for face, (obj, cached) in zip(faces, analyses)
+                ],
+                'actions': actions,
+                'total_faces': int(total_faces),
+                'processing_time': float(round(processing_time, 3))
+            }
+        else:
+            # Convert tất cả dữ liệu thành Python native types trước
+            obj, cached = analyses[0]
+            result = {
+                'success': True,
+                **_format_analysis(obj, actions),
+                'actions': actions,
+                'total_faces': int(total_faces),
+                'cached': cached,
+                'processing_time': float(round(processing_time, 3))
+            }
         
-    except Exception as e:
-        # Cleanup temp file nếu có lỗi
-        if temp_file and os.path.exists(temp_file):
-            try:
-                os.remove(temp_file)
-            except:
-                pass
+        # Convert toàn bộ result để đảm bảo an toàn
+        with _metrics.stage('serialize'):
+            result = convert_to_serializable(result)
+            return jsonify(result)
         
+    except Exception as e:
         error_msg = str(e)
         
         # Xử lý lỗi phổ biến
@@ -206,6 +477,13 @@ def analyze_face():
                 'error': f'Lỗi phân tích: {error_msg}'
             }), 500
 
+def _startup():
+    """Warmup detector + model load sẵn (chạy ở thread nền khi service khởi động)"""
+    _readiness.set_stage(f"Pre-load {', '.join(PRELOAD_ACTIONS) or 'face detector'}")
+    if not preload_models():
+        # Warmup lỗi không chặn service: model sẽ được load khi có request đầu tiên
+        print("⚠️ Models sẽ được load khi có request đầu tiên")
+
 if __name__ == '__main__':
     print("\n" + "="*70)
     print("🚀 DEEPFACE SERVICE - Starting...")
@@ -214,21 +492,13 @@ if __name__ == '__main__':
     print("🌐 Port: 5002")
     print("="*70 + "\n")
     
-    # Pre-load models khi khởi động
-    print("🧠 Pre-loading DeepFace AI models...")
-    success = preload_models()
+    # Mở port ngay; warmup chạy ở thread nền, /readyz báo tiến độ
+    _readiness.start_background(_startup)
+    print("🌐 Listening on: http://localhost:5002 (đang load models ở background - xem /readyz)")
+    print("="*70 + "\n")
     
-    if success:
-        print("\n" + "="*70)
-        print("✅ DeepFace Service is READY!")
-        print("🌐 Listening on: http://localhost:5002")
-        print("⚡ Real-time processing enabled (models pre-loaded)")
-        print("="*70 + "\n")
-    else:
-        print("\n" + "="*70)
-        print("⚠️ Service starting with warnings...")
-        print("Models sẽ được load khi có request đầu tiên")
-        print("="*70 + "\n")
+    # HTTP/1.1 để gateway giữ kết nối keep-alive (mặc định HTTP/1.0 đóng kết nối sau mỗi request)
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
     
     # Chạy service
     app.run(host='0.0.0.0', port=5002, debug=False, threaded=True)
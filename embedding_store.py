@@ -0,0 +1,114 @@
+"""
+Embedding Store - Cache encoding khuôn mặt trên đĩa (sqlite sidecar)
+Mỗi ảnh trong dataset được key theo đường dẫn + kích thước file + mtime,
+nên khi khởi động lại chỉ những ảnh mới/đã thay đổi mới phải encode lại.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import closing
+
+import numpy as np
+
+# face_recognition trả về encoding float64 128 chiều
+ENCODING_DTYPE = np.float64
+ENCODING_SIZE = 128
+
+
+class EmbeddingStore:
+    """Lưu encoding của từng ảnh vào file sqlite, key theo (path, size, mtime)"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._initialized = False
+
+    def _connect(self):
+        """Mở connection mới (sqlite connection không dùng chung giữa các thread)"""
+        if not self._initialized:
+            self._init_db()
+        return closing(sqlite3.connect(self.db_path, timeout=30))
+
+    def _init_db(self):
+        """Tạo file và bảng nếu chưa có - chỉ chạy 1 lần"""
+        with self._lock:
+            if self._initialized:
+                return
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with closing(sqlite3.connect(self.db_path, timeout=30)) as conn, conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS embeddings ('
+                    ' path TEXT PRIMARY KEY,'
+                    ' person TEXT NOT NULL,'
+                    ' size INTEGER NOT NULL,'
+                    ' mtime_ns INTEGER NOT NULL,'
+                    ' encoding BLOB)'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_embeddings_person ON embeddings(person)')
+            self._initialized = True
+
+    @staticmethod
+    def file_key(path):
+        """Trả về (size, mtime_ns) của file - dùng để phát hiện ảnh đã thay đổi"""
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    @staticmethod
+    def _to_blob(encoding):
+        if encoding is None:
+            return None
+        return np.asarray(encoding, dtype=ENCODING_DTYPE).tobytes()
+
+    @staticmethod
+    def _from_blob(blob):
+        if blob is None:
+            return None
+        return np.frombuffer(blob, dtype=ENCODING_DTYPE)
+
+    def load_all(self):
+        """
+        Load toàn bộ cache.
+        Trả về dict: path -> (person, size, mtime_ns, encoding)
+        encoding = None nghĩa là ảnh đã được xử lý nhưng không có khuôn mặt.
+        """
+        with self._connect() as conn:
+            rows = conn.execute('SELECT path, person, size, mtime_ns, encoding FROM embeddings').fetchall()
+        return {
+            path: (person, size, mtime_ns, self._from_blob(blob))
+            for path, person, size, mtime_ns, blob in rows
+        }
+
+    def put_many(self, rows):
+        """Ghi/cập nhật nhiều ảnh: rows là list (path, person, size, mtime_ns, encoding)"""
+        rows = [
+            (path, person, int(size), int(mtime_ns), self._to_blob(encoding))
+            for path, person, size, mtime_ns, encoding in rows
+        ]
+        if not rows:
+            return
+        with self._lock, self._connect() as conn, conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (path, person, size, mtime_ns, encoding) '
+                'VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def delete_paths(self, paths):
+        """Xóa cache của các ảnh không còn tồn tại"""
+        paths = [(p,) for p in paths]
+        if not paths:
+            return
+        with self._lock, self._connect() as conn, conn:
+            conn.executemany('DELETE FROM embeddings WHERE path = ?', paths)
+
+    def delete_person(self, person):
+        """Xóa cache của tất cả ảnh thuộc 1 người"""
+        with self._lock, self._connect() as conn, conn:
+            conn.execute('DELETE FROM embeddings WHERE person = ?', (person,))
+
+    def count(self):
+        """Số ảnh đang có trong cache"""
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
@@ -5,8 +5,15 @@ Script tự động quản lý môi trường Anaconda cho Face Recognition Proj
 import subprocess
 import sys
 import os
+import glob
 import json
 import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Trạng thái môi trường (exists / packages) được cache: mỗi lần `conda` spawn mất vài giây
+ENV_STATUS_TTL = float(os.environ.get('ENV_STATUS_TTL', '300'))  # seconds, 0 = không cache
 # Mapping package: tên trong config → tên thực tế trong pip freeze
 PACKAGE_NAME_MAPPING = {
     # Face Recognition
@@ -39,6 +46,13 @@ class CondaEnvironmentManager:
             }
         }
         self.is_windows = platform.system() == 'Windows'
+        self.status_ttl = ENV_STATUS_TTL
+        # env_name -> {'status', 'checked_at', 'signature', 'prefix'}
+        self._status_cache = {}
+        self._cache_lock = threading.Lock()
+        self._probe_locks = {}  # env_name -> Lock: 1 probe / env cùng lúc (tạo khi cần, xem _probe_lock)
+        self._refreshing = set()
+        self._env_dirs = set()  # Thư mục chứa các env (vd ~/anaconda3/envs), mtime đổi khi tạo / xóa env
     
     def _run_conda(self, cmd_list, check=True, capture_output=False):
         """Hàm helper chạy lệnh hệ thống"""
@@ -82,15 +96,186 @@ class CondaEnvironmentManager:
             # Nếu lệnh lỗi (do chưa có pip hoặc env hỏng), trả về rỗng để script tự cài lại
             return set()
 
-    def check_env_exists(self, env_name):
-        """Kiểm tra môi trường tồn tại"""
+    def list_env_prefixes(self):
+        """Tên env -> đường dẫn prefix (1 lần gọi `conda env list` cho tất cả env)"""
         try:
             res = self._run_conda(['conda', 'env', 'list', '--json'], capture_output=True)
             envs = json.loads(res.stdout)['envs']
-            env_names = [os.path.basename(e) for e in envs]
-            return env_name in env_names
-        except:
-            return False
+        except Exception:
+            return {}
+        prefixes = {os.path.basename(e): e for e in envs}
+        with self._cache_lock:
+            self._env_dirs.update(os.path.dirname(e) for e in envs if os.path.basename(os.path.dirname(e)) == 'envs')
+        return prefixes
+
+    def check_env_exists(self, env_name):
+        """Kiểm tra môi trường tồn tại (qua cache trạng thái)"""
+        return self.get_env_status(env_name)['exists']
+
+    def _missing_packages(self, env_name, installed):
+        """(conda packages thiếu, pip packages thiếu) so với config"""
+        # Env ngoài self.envs (vd check_env_exists với tên bất kỳ) không yêu cầu package nào
+        config = self.envs.get(env_name, {})
+        # Lọc tên gói conda (vd: dlib=19 -> dlib)
+        missing_conda = [p for p in config.get('conda_packages', [])
+                         if p.split('=')[0].lower() not in installed]
+        # Lọc tên gói pip (vd: deepface==0.0.96 -> deepface)
+        missing_pip = [
+            p for p in config.get('pip_packages', [])
+            if PACKAGE_NAME_MAPPING.get(p.split('=')[0], p.split('=')[0]).lower() not in installed
+        ]
+        return missing_conda, missing_pip
+
+    # === CACHE TRẠNG THÁI MÔI TRƯỜNG ===
+    def _watch_paths(self, prefix):
+        """
+        Đường dẫn có mtime đổi khi môi trường đổi: conda install/remove ghi conda-meta,
+        pip install/uninstall thêm/xóa thư mục trong site-packages, tạo/xóa env đổi thư mục envs.
+        """
+        if prefix is None:
+            with self._cache_lock:
+                return sorted(self._env_dirs)
+        return [prefix, os.path.join(prefix, 'conda-meta')] + sorted(
+            glob.glob(os.path.join(prefix, 'Lib', 'site-packages')) +
+            glob.glob(os.path.join(prefix, 'lib', 'python*', 'site-packages'))
+        )
+
+    @staticmethod
+    def _signature(paths):
+        signature = []
+        for path in paths:
+            try:
+                signature.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                signature.append((path, None))
+        return tuple(signature)
+
+    def _probe_status(self, env_name, prefixes):
+        """Chạy conda / pip thật để lấy trạng thái 1 env"""
+        prefix = prefixes.get(env_name)
+        exists = prefix is not None
+        packages_ok = False
+        if exists:
+            installed = self.get_installed_packages(env_name)
+            # Không lấy được danh sách -> môi trường có vấn đề
+            packages_ok = bool(installed) and self._missing_packages(env_name, installed) == ([], [])
+        return {
+            'exists': exists,
+            'packages_installed': packages_ok,
+            'ready': exists and packages_ok
+        }, prefix
+
+    def _cached_entry(self, env_name, max_age):
+        """Entry còn hợp lệ (chưa quá TTL, mtime thư mục env không đổi) hoặc None"""
+        with self._cache_lock:
+            entry = self._status_cache.get(env_name)
+        if entry is None or time.time() - entry['checked_at'] > max_age:
+            return None
+        if self._signature(self._watch_paths(entry['prefix'])) != entry['signature']:
+            return None
+        return entry
+
+    def _format_status(self, entry, cached):
+        return dict(entry['status'], checked_at=entry['checked_at'], cached=cached)
+
+    def _probe_lock(self, env_name):
+        """Lock probe của 1 env, tạo lần đầu dùng (tên env không có trong self.envs vẫn probe được)"""
+        with self._cache_lock:
+            return self._probe_locks.setdefault(env_name, threading.Lock())
+
+    def get_env_status(self, env_name, max_age=None, prefixes=None):
+        """
+        Trạng thái env {'exists', 'packages_installed', 'ready', 'checked_at', 'cached'}.
+        Dùng cache nếu còn hợp lệ, ngược lại probe lại (request đồng thời cho cùng env chờ chung 1 lần probe).
+        prefixes: kết quả list_env_prefixes() dùng chung khi probe nhiều env.
+        """
+        max_age = self.status_ttl if max_age is None else max_age
+        entry = self._cached_entry(env_name, max_age)
+        if entry is not None:
+            return self._format_status(entry, True)
+
+        with self._probe_lock(env_name):
+            # Request khác vừa probe xong trong lúc chờ lock
+            entry = self._cached_entry(env_name, max_age)
+            if entry is not None:
+                return self._format_status(entry, True)
+            if prefixes is None:
+                prefixes = self.list_env_prefixes()
+            status, prefix = self._probe_status(env_name, prefixes)
+            entry = {
+                'status': status,
+                'checked_at': time.time(),
+                'prefix': prefix,
+                # Chụp mtime sau khi probe: thay đổi trong lúc probe sẽ làm lần sau probe lại
+                'signature': self._signature(self._watch_paths(prefix))
+            }
+            with self._cache_lock:
+                self._status_cache[env_name] = entry
+            return self._format_status(entry, False)
+
+    def get_all_env_status(self, max_age=None):
+        """Trạng thái tất cả env: 1 lần `conda env list`, các lần `pip list` chạy song song"""
+        max_age = self.status_ttl if max_age is None else max_age
+        stale = [env_name for env_name in self.envs if self._cached_entry(env_name, max_age) is None]
+        prefixes = self.list_env_prefixes() if stale else None
+        with ThreadPoolExecutor(max_workers=len(self.envs)) as executor:
+            futures = {
+                env_name: executor.submit(self.get_env_status, env_name, max_age, prefixes)
+                for env_name in self.envs
+            }
+            return {env_name: future.result() for env_name, future in futures.items()}
+
+    def refresh_in_background(self, env_name):
+        """Probe lại env trong thread nền (không chặn request), bỏ qua nếu đang probe"""
+        with self._cache_lock:
+            if env_name in self._refreshing:
+                return
+            self._refreshing.add(env_name)
+
+        def run():
+            try:
+                self.get_env_status(env_name)
+            finally:
+                with self._cache_lock:
+                    self._refreshing.discard(env_name)
+
+        threading.Thread(target=run, daemon=True, name=f'env-status-{env_name}').start()
+
+    def env_exists_fast(self, env_name):
+        """
+        Kiểm tra env tồn tại cho hot path (vd đăng ký khuôn mặt), KHÔNG spawn conda:
+        dùng kết quả cache (kể cả đã cũ, kèm probe lại ở nền), chưa có cache thì tìm thư mục env trên đĩa.
+        """
+        with self._cache_lock:
+            entry = self._status_cache.get(env_name)
+        if entry is not None:
+            if self._cached_entry(env_name, self.status_ttl) is None:
+                self.refresh_in_background(env_name)
+            return entry['status']['exists']
+        self.refresh_in_background(env_name)
+        return any(os.path.isdir(os.path.join(env_dir, env_name, 'conda-meta')) for env_dir in self._guess_env_dirs())
+
+    def _guess_env_dirs(self):
+        """Các thư mục envs có thể có (theo biến môi trường conda), dùng khi chưa có cache"""
+        env_dirs = set(self._env_dirs)
+        env_dirs.update(p for p in os.environ.get('CONDA_ENVS_PATH', '').split(os.pathsep) if p)
+        conda_exe = os.environ.get('CONDA_EXE')
+        if conda_exe:
+            env_dirs.add(os.path.join(os.path.dirname(os.path.dirname(conda_exe)), 'envs'))
+        conda_prefix = os.environ.get('CONDA_PREFIX')
+        if conda_prefix:
+            parent = os.path.dirname(conda_prefix)
+            env_dirs.add(parent if os.path.basename(parent) == 'envs' else os.path.join(conda_prefix, 'envs'))
+        env_dirs.add(os.path.join(os.path.expanduser('~'), '.conda', 'envs'))
+        return env_dirs
+
+    def invalidate_status(self, env_name=None):
+        """Xóa cache trạng thái (1 env hoặc tất cả), vd sau khi cài đặt"""
+        with self._cache_lock:
+            if env_name is None:
+                self._status_cache.clear()
+            else:
+                self._status_cache.pop(env_name, None)
 
     def create_env(self, env_name):
         """Tạo môi trường mới"""
@@ -123,40 +308,34 @@ class CondaEnvironmentManager:
         print(f"KIỂM TRA MÔI TRƯỜNG: {env_name}")
         print(f"{'='*60}")
         
-        # 1. Check/Create Environment
-        if not self.check_env_exists(env_name):
-            print(f"✗ Môi trường chưa tồn tại.")
-            self.create_env(env_name)
-        else:
-            print(f"✓ Môi trường '{env_name}' đã tồn tại.")
+        try:
+            # 1. Check/Create Environment (không dùng cache: cần trạng thái thật trước khi cài)
+            if env_name not in self.list_env_prefixes():
+                print(f"✗ Môi trường chưa tồn tại.")
+                self.create_env(env_name)
+            else:
+                print(f"✓ Môi trường '{env_name}' đã tồn tại.")
 
-        # 2. Get Installed Packages
-        installed = self.get_installed_packages(env_name)
-        
-        config = self.envs[env_name]
-        
-        # 3. Tính toán các gói thiếu (Diff)
-        # Lọc tên gói conda (vd: dlib=19 -> dlib)
-        missing_conda = [p for p in config.get('conda_packages', []) 
-                         if p.split('=')[0].lower() not in installed]
-        
-        # Lọc tên gói pip (vd: deepface==0.0.96 -> deepface)
-        missing_pip = [
-            p for p in config.get('pip_packages', [])
-            if PACKAGE_NAME_MAPPING.get(p, p).lower() not in installed
-        ]
+            # 2. Get Installed Packages
+            installed = self.get_installed_packages(env_name)
 
-        # 4. Xử lý
-        if not missing_conda and not missing_pip:
-            print(f"✓ TẤT CẢ THƯ VIỆN ĐÃ ĐẦY ĐỦ.")
-        else:
-            print(f"⚠ Phát hiện thư viện thiếu. Đang tự động bổ sung...")
-            try:
-                self.install_missing_packages(env_name, missing_conda, missing_pip)
-                print("✓ Cài đặt bổ sung hoàn tất.")
-            except Exception as e:
-                print(f"✗ Lỗi khi cài đặt: {e}")
-                return False
+            # 3. Tính toán các gói thiếu (Diff)
+            missing_conda, missing_pip = self._missing_packages(env_name, installed)
+
+            # 4. Xử lý
+            if not missing_conda and not missing_pip:
+                print(f"✓ TẤT CẢ THƯ VIỆN ĐÃ ĐẦY ĐỦ.")
+            else:
+                print(f"⚠ Phát hiện thư viện thiếu. Đang tự động bổ sung...")
+                try:
+                    self.install_missing_packages(env_name, missing_conda, missing_pip)
+                    print("✓ Cài đặt bổ sung hoàn tất.")
+                except Exception as e:
+                    print(f"✗ Lỗi khi cài đặt: {e}")
+                    return False
+        finally:
+            # Môi trường có thể đã đổi -> lần kiểm tra sau probe lại
+            self.invalidate_status(env_name)
 
         print(f"{'='*60}\n")
         return True
@@ -166,33 +345,10 @@ class CondaEnvironmentManager:
         """
         Hàm này được app.py gọi để KIỂM TRA packages đã cài đủ chưa.
         CHỈ kiểm tra, KHÔNG tự động cài đặt.
-        Trả về True nếu tất cả packages đã đầy đủ.
+        Trả về True nếu tất cả packages đã đầy đủ (cùng 1 lần probe / cache với check_env_exists).
         """
         try:
-            # Kiểm tra env có tồn tại không
-            if not self.check_env_exists(env_name):
-                return False
-            
-            # Lấy danh sách packages đã cài
-            installed = self.get_installed_packages(env_name)
-            if not installed:  # Nếu không lấy được danh sách -> môi trường có vấn đề
-                return False
-            
-            config = self.envs[env_name]
-            
-            # Kiểm tra conda packages
-            missing_conda = [p for p in config.get('conda_packages', []) 
-                             if p.split('=')[0].lower() not in installed]
-            
-            # Kiểm tra pip packages
-            missing_pip = [
-                p for p in config.get('pip_packages', [])
-                if PACKAGE_NAME_MAPPING.get(p.split('=')[0], p.split('=')[0]).lower() not in installed
-            ]
-            
-            # Trả về True nếu KHÔNG còn gói nào thiếu
-            return len(missing_conda) == 0 and len(missing_pip) == 0
-            
+            return self.get_env_status(env_name)['packages_installed']
         except Exception as e:
             print(f"Lỗi khi kiểm tra packages {env_name}: {e}")
             return False
@@ -0,0 +1,182 @@
+"""
+Face Gallery - Lưu mean encoding của các người đã đăng ký dưới dạng 1 ma trận float32 liên tục
+Norm bình phương được tính sẵn để so khớp tất cả khuôn mặt trong 1 frame bằng 1 phép nhân ma trận
+"""
+import threading
+
+import numpy as np
+
+ENCODING_SIZE = 128
+
+
+class FaceGallery:
+    """Ma trận (capacity x 128) float32 cấp phát trước + bảng tên, thread-safe"""
+
+    def __init__(self, dim=ENCODING_SIZE, capacity=1024, ann_index=None):
+        self.dim = dim
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.zeros(capacity, dtype=np.float32)
+        self._names = []
+        self._index = {}
+        self._lock = threading.RLock()
+        # Index tìm kiếm gần đúng (ann_index.py) - None = quét toàn bộ ma trận
+        self.ann_index = ann_index
+        # Gọi (ngoài lock) khi index vừa train xong ở background, vd để gửi centroid cho process worker
+        self.on_index_trained = None
+
+    @classmethod
+    def from_encodings(cls, names, encodings, dim=ENCODING_SIZE, ann_index=None):
+        """Tạo gallery từ list tên + list encoding (thường là kết quả load dataset)"""
+        gallery = cls(dim=dim, capacity=max(1024, len(names)))
+        for name, encoding in zip(names, encodings):
+            gallery.set(name, encoding)
+        if ann_index is not None:
+            gallery.attach_index(ann_index)
+        return gallery
+
+    @classmethod
+    def from_shared(cls, names, matrix):
+        """
+        Gallery bọc quanh 1 ma trận (capacity x dim) có sẵn, ví dụ memory-mapped - không copy ma trận.
+        len(names) hàng đầu đang dùng, phần còn lại là chỗ trống cho set(). Ma trận map chỉ đọc thì chỉ tìm kiếm
+        được; map copy-on-write (mmap_mode='c') thì set/remove ghi vào page riêng của process.
+        """
+        n = len(names)
+        gallery = cls(dim=matrix.shape[1], capacity=0)
+        gallery._matrix = matrix
+        gallery._sq_norms = np.zeros(matrix.shape[0], dtype=np.float32)
+        gallery._sq_norms[:n] = np.einsum('ij,ij->i', matrix[:n], matrix[:n])
+        gallery._names = list(names)
+        gallery._index = {name: i for i, name in enumerate(gallery._names)}
+        return gallery
+
+    def attach_index(self, ann_index, centroids=None):
+        """Gắn ANN index và build từ toàn bộ encoding hiện có (centroids: dùng centroid có sẵn thay vì load / train)"""
+        with self._lock:
+            ann_index.build(self._matrix[:len(self._names)], centroids=centroids)
+            self.ann_index = ann_index
+
+    def _train_index_background(self):
+        """Gallery vừa vượt ngưỡng train của index: k-means trên bản sao ở thread riêng, không chặn set / search"""
+        ann_index = self.ann_index
+        ann_index.training = True
+        snapshot = self._matrix[:len(self._names)].copy()
+
+        def run():
+            try:
+                centroids = ann_index.train(snapshot)
+                with self._lock:
+                    if self.ann_index is not ann_index:
+                        return
+                    # Gán cụm cho toàn bộ gallery hiện tại (kể cả người thêm trong lúc train)
+                    ann_index.build(self._matrix[:len(self._names)], centroids=centroids)
+            except Exception as e:
+                print(f"⚠️ Train ANN index thất bại: {str(e)}")
+                return
+            finally:
+                ann_index.training = False
+            print(f"✅ ANN index đã train: {len(ann_index.centroids)} cụm từ {len(snapshot)} người")
+            if self.on_index_trained is not None:
+                self.on_index_trained()
+
+        threading.Thread(target=run, daemon=True, name='ann-index-train').start()
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    @property
+    def names(self):
+        """Bản sao danh sách tên theo thứ tự hàng trong ma trận"""
+        with self._lock:
+            return list(self._names)
+
+    @property
+    def matrix(self):
+        """View (n x dim) chỉ gồm các hàng đang dùng"""
+        with self._lock:
+            return self._matrix[:len(self._names)]
+
+    def _ensure_capacity(self, size):
+        """Tăng gấp đôi capacity khi hết chỗ (amortized O(1) mỗi lần thêm)"""
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2)
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        sq_norms = np.zeros(new_capacity, dtype=np.float32)
+        n = len(self._names)
+        matrix[:n] = self._matrix[:n]
+        sq_norms[:n] = self._sq_norms[:n]
+        self._matrix = matrix
+        self._sq_norms = sq_norms
+
+    def set(self, name, encoding):
+        """Thêm mới hoặc cập nhật encoding của 1 người"""
+        vector = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            pos = self._index.get(name)
+            if pos is None:
+                pos = len(self._names)
+                self._ensure_capacity(pos + 1)
+                self._names.append(name)
+                self._index[name] = pos
+            self._matrix[pos] = vector
+            self._sq_norms[pos] = np.dot(vector, vector)
+            if self.ann_index is not None:
+                self.ann_index.set(pos, vector)
+                if self.ann_index.needs_training(len(self._names)):
+                    self._train_index_background()
+
+    def remove(self, name):
+        """Xóa 1 người - hàng cuối được chuyển vào chỗ trống để ma trận luôn liên tục"""
+        with self._lock:
+            pos = self._index.pop(name, None)
+            if pos is None:
+                return False
+            last = len(self._names) - 1
+            if pos != last:
+                last_name = self._names[last]
+                self._matrix[pos] = self._matrix[last]
+                self._sq_norms[pos] = self._sq_norms[last]
+                self._names[pos] = last_name
+                self._index[last_name] = pos
+            self._names.pop()
+            if self.ann_index is not None:
+                self.ann_index.remove(pos, last)
+            return True
+
+    def search_exact(self, queries):
+        """Tìm người gần nhất cho mỗi truy vấn bằng 1 phép nhân ma trận - trả về (names, distances)"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        count = len(queries)
+        with self._lock:
+            n = len(self._names)
+            if n == 0 or count == 0:
+                return [None] * count, np.full(count, np.inf, dtype=np.float32)
+            # ||q - g||^2 = ||g||^2 - 2 q.g + ||q||^2  (||q||^2 không đổi theo hàng -> cộng sau argmin)
+            partial = self._sq_norms[:n] - 2.0 * (queries @ self._matrix[:n].T)
+            best = np.argmin(partial, axis=1)
+            best_names = [self._names[i] for i in best]
+
+        best_sq = partial[np.arange(count), best] + np.einsum('ij,ij->i', queries, queries)
+        return best_names, np.sqrt(np.maximum(best_sq, 0.0))
+
+    def search(self, queries):
+        """Tìm người gần nhất - qua ANN index nếu có, ngược lại quét toàn bộ"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            if self.ann_index is not None:
+                return self.ann_index.search(self, queries)
+        return self.search_exact(queries)
+
+    def match(self, face_encodings, tolerance=0.5):
+        """
+        So khớp tất cả khuôn mặt trong 1 frame với gallery bằng 1 phép tính vector hóa.
+        Trả về (names, distances): name = None nếu khoảng cách nhỏ nhất > tolerance.
+        """
+        best_names, distances = self.search(face_encodings)
+        names = [name if distance <= tolerance else None for name, distance in zip(best_names, distances)]
+        return names, distances
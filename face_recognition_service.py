@@ -3,24 +3,137 @@ Face Recognition Service - Chạy trong môi trường face_recognition của An
 Load models trước để đảm bảo real-time processing
 Port: 5001
 """
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
+from werkzeug.serving import WSGIRequestHandler
 import face_recognition
+import dlib
 import numpy as np
 import base64
 import io
+import json
 import os
+import threading
 import time
 from PIL import Image
+from embedding_store import EmbeddingStore
+from face_gallery import FaceGallery
+from ann_index import create_index
+from face_tracker import TrackerRegistry
+from batch_scheduler import MicroBatchScheduler
+from worker_pool import RecognitionWorkerPool
+from gallery_builder import BuildProgress, encode_images, scan_dataset
+from service_readiness import ServiceReadiness, PROBE_PATHS
+from service_metrics import ServiceMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from service_profiler import RequestProfiler, install_profiler
 
 app = Flask(__name__)
 
+DATASET_DIR = 'dataset'
+# Cache encoding trên đĩa - chỉ encode lại ảnh mới hoặc đã thay đổi
+EMBEDDING_CACHE_PATH = os.path.join(DATASET_DIR, '.embeddings_cache.sqlite3')
+_embedding_store = EmbeddingStore(EMBEDDING_CACHE_PATH)
+
+# Ngưỡng khoảng cách để coi là cùng 1 người
+MATCH_TOLERANCE = 0.5
+
+# ANN index cho gallery lớn: 'brute' (chính xác, mặc định) hoặc 'ivf' (gần đúng, nhanh hơn nhiều khi > 100k người)
+ANN_INDEX = os.environ.get('FR_ANN_INDEX', 'brute')
+ANN_NLIST = int(os.environ.get('FR_ANN_NLIST', '0')) or None  # 0 = tự chọn theo kích thước gallery
+ANN_NPROBE = int(os.environ.get('FR_ANN_NPROBE', '8'))
+ANN_INDEX_PATH = os.path.join(DATASET_DIR, '.ann_index.npz')
+
+def _create_ann_index():
+    """Tạo ANN index theo cấu hình"""
+    if ANN_INDEX == 'ivf':
+        return create_index('ivf', nlist=ANN_NLIST, nprobe=ANN_NPROBE, path=ANN_INDEX_PATH)
+    return create_index(ANN_INDEX)
+
+# Độ phân giải detect: HOG chạy trên bản thu nhỏ (chi phí lớn nhất mỗi frame), landmark + encoding
+# vẫn tính trên ảnh gốc. Mặc định 1.0 = không thu nhỏ: thu nhỏ nhanh hơn nhưng HOG bỏ sót mặt nhỏ / ở xa.
+# Số thực < 1 = scale cố định; 'auto' = chọn theo kích thước từng ảnh: cạnh ngắn không nhỏ hơn
+# DETECTION_MIN_SIDE và mặt FR_MIN_FACE_SIZE px (ảnh gốc) vẫn còn >= HOG_MIN_FACE_SIZE sau khi thu nhỏ
+DETECTION_SCALE = os.environ.get('FR_DETECTION_SCALE', '1.0')
+DETECTION_MIN_SIDE = int(os.environ.get('FR_DETECTION_MIN_SIDE', '640'))
+MIN_FACE_SIZE = int(os.environ.get('FR_MIN_FACE_SIZE', '80'))
+# HOG của dlib dùng cửa sổ 80x80, face_locations mặc định upsample 1 lần -> bắt được mặt ~40px
+HOG_MIN_FACE_SIZE = 40
+
+def _detection_scale(image_shape=None):
+    """Tỉ lệ thu nhỏ ảnh (height, width, ...) trước khi detect (<= 1); 'auto' không có kích thước ảnh -> 1.0"""
+    if DETECTION_SCALE == 'auto':
+        if image_shape is None:
+            return 1.0
+        short_side = float(min(image_shape[:2]))
+        return min(1.0, max(DETECTION_MIN_SIDE / short_side, HOG_MIN_FACE_SIZE / float(MIN_FACE_SIZE)))
+    return min(1.0, float(DETECTION_SCALE))
+
+# Micro-batching: các frame tới đồng thời được gom trong BATCH_WINDOW_MS (hoặc đủ BATCH_MAX_SIZE frame)
+# rồi detect + encode + so khớp trong 1 thread thay vì mỗi request tự tranh GIL. BATCH_MAX_SIZE = 1 để tắt.
+# Chỉ chờ cửa sổ khi có frame khác đang xếp hàng: frame lẻ lúc tải thấp không bị cộng thêm BATCH_WINDOW_MS
+BATCH_WINDOW_MS = float(os.environ.get('FR_BATCH_WINDOW_MS', '5'))
+BATCH_MAX_SIZE = int(os.environ.get('FR_BATCH_MAX_SIZE', '8'))
+
+# Số process worker cho detect + encode + so khớp (0 = xử lý ngay trong process Flask).
+# Mỗi worker dùng ~1 core; gallery được broadcast từ process chính tới mọi worker
+WORKERS = int(os.environ.get('FR_WORKERS', '0'))
+# Worker dùng chung 1 gallery memory-mapped (1 bản trong page cache thay vì N bản sao), mỗi lần đổi = 1 version mới
+SHARED_GALLERY = os.environ.get('FR_SHARED_GALLERY', '1') == '1'
+# Không đặt -> thư mục tạm riêng của process (mkdtemp), 2 instance trên cùng máy không đụng file của nhau
+SHARED_GALLERY_DIR = os.environ.get('FR_SHARED_GALLERY_DIR')
+_worker_pool = None
+
+# Encode dataset khi load: ảnh mới (chưa có trong embedding cache) được chia chunk cho nhiều process
+# FR_BUILD_WORKERS: số process (0 = số CPU core, 1 = encode trong process này); tiến độ xem ở /health
+BUILD_WORKERS = int(os.environ.get('FR_BUILD_WORKERS', '0'))
+BUILD_CHUNK_SIZE = int(os.environ.get('FR_BUILD_CHUNK_SIZE', '8'))
+_build_progress = BuildProgress()
+
+# Detect-then-track cho các request có header X-Session-Id (kênh streaming realtime):
+# chỉ detect + encode đầy đủ mỗi TRACK_KEYFRAME_INTERVAL frame hoặc khi mất track
+TRACK_KEYFRAME_INTERVAL = int(os.environ.get('FR_TRACK_KEYFRAME_INTERVAL', '10'))
+TRACK_IOU_THRESHOLD = 0.3
+TRACK_SESSION_TTL = 60  # Giây không có frame -> bỏ tracker của phiên
+_trackers = TrackerRegistry(
+    keyframe_interval=TRACK_KEYFRAME_INTERVAL,
+    iou_threshold=TRACK_IOU_THRESHOLD,
+    ttl=TRACK_SESSION_TTL
+)
+
 # Global variables để cache dataset
+# gallery: ma trận float32 các mean encoding (so khớp vector hóa)
+# persons: name -> {'images': {path: encoding}, 'keys': {path: (size, mtime_ns)}, 'sum': tổng encoding} để cập nhật mean tăng dần
 _dataset_cache = {
-    'encodings': [],
-    'names': [],
+    'gallery': FaceGallery(),
+    'persons': {},
     'timestamp': 0,
     'loaded': False
 }
+_dataset_lock = threading.RLock()
+# dlib (HOG detector, encoder) không an toàn khi nhiều thread gọi cùng lúc: với threaded=True
+# các request song song có thể làm hỏng heap -> mọi lời gọi detect/encode đi qua lock này
+_dlib_lock = threading.Lock()
+
+# Trạng thái khởi động: __main__ mở port ngay rồi load gallery (+ worker) ở thread nền
+_readiness = ServiceReadiness('face_recognition', progress_fn=lambda: {
+    'gallery_build': _build_progress.snapshot(),
+    'persons_count': len(_dataset_cache['gallery'])
+})
+
+# Histogram thời gian từng bước + gauge trạng thái cho /metrics (Prometheus)
+# Khi FR_WORKERS > 0, detect / encode / so khớp chạy trong process worker: chỉ đo được cả vòng (worker_roundtrip)
+_metrics = ServiceMetrics('face_recognition')
+_metrics.add_gauge('gallery_persons', 'Số người trong gallery', lambda: len(_dataset_cache['gallery']))
+_metrics.add_gauge('batch_queue_depth', 'Frame đang chờ gom batch',
+                   lambda: _batch_scheduler.queue_depth() if _batch_scheduler else 0)
+_metrics.add_gauge('worker_in_flight', 'Frame đang xử lý ở process worker',
+                   lambda: sum(w['in_flight'] for w in _worker_pool.stats()['per_worker']) if _worker_pool else 0)
+_metrics.add_gauge('tracking_sessions', 'Số phiên streaming đang có tracker',
+                   lambda: _trackers.stats()['sessions'])
+_metrics.add_gauge('ready', '1 nếu service đã load xong gallery', lambda: 1 if _readiness.ready else 0)
+
+# cProfile lấy mẫu 1/N request của hot path khi admin bật (chỉ thấy phần chạy trong process này:
+# với FR_WORKERS > 0, detect / encode nằm ở process worker)
+_profiler = RequestProfiler('face_recognition', ('/recognize', '/detect'))
 
 def load_face_dataset():
     """Load và cache dataset - chỉ load 1 lần khi khởi động"""
@@ -28,12 +141,13 @@ def load_face_dataset():
     
     # Nếu đã load rồi và chưa quá 5 phút, dùng cache
     if _dataset_cache['loaded'] and (time.time() - _dataset_cache['timestamp'] < 300):
-        return _dataset_cache['encodings'], _dataset_cache['names']
+        gallery = _dataset_cache['gallery']
+        return gallery.matrix, gallery.names
     
     print("🔄 Đang load face recognition dataset...")
     start_time = time.time()
     
-    dataset_dir = 'dataset'
+    dataset_dir = DATASET_DIR
     known_face_encodings = []
     known_face_names = []
     
@@ -41,46 +155,319 @@ def load_face_dataset():
         print("⚠️ Dataset folder không tồn tại")
         return [], []
     
-    person_count = 0
-    total_images = 0
+    # Encoding đã tính từ lần chạy trước: path -> (person, size, mtime_ns, encoding)
+    try:
+        cached = _embedding_store.load_all()
+    except Exception as e:
+        print(f"⚠️ Không đọc được embedding cache, encode lại toàn bộ: {str(e)}")
+        cached = {}
     
-    for person_name in os.listdir(dataset_dir):
-        person_path = os.path.join(dataset_dir, person_name)
-        if not os.path.isdir(person_path):
+    # Lượt 1: ảnh không đổi dùng lại encoding đã lưu, còn lại gom để encode song song
+    images = scan_dataset(dataset_dir)
+    seen_paths = set()
+    file_keys = {}
+    image_encodings = {}
+    pending = []
+    for person_name, img_path in images:
+        seen_paths.add(img_path)
+        try:
+            file_keys[img_path] = EmbeddingStore.file_key(img_path)
+        except OSError as e:
+            print(f"⚠️ Lỗi khi load {img_path}: {str(e)}")
             continue
-        
-        person_count += 1
-        encodings = []
-        
-        for img_name in os.listdir(person_path):
-            if img_name.lower().endswith(('.jpg', '.png', '.jpeg')):
-                img_path = os.path.join(person_path, img_name)
-                try:
-                    image = face_recognition.load_image_file(img_path)
-                    face_encs = face_recognition.face_encodings(image)
-                    if len(face_encs) > 0:
-                        encodings.append(face_encs[0])
-                        total_images += 1
-                except Exception as e:
-                    print(f"⚠️ Lỗi khi load {img_path}: {str(e)}")
-                    continue
-        
-        if encodings:
+        entry = cached.get(img_path)
+        if entry is not None and entry[0] == person_name and entry[1:3] == file_keys[img_path]:
+            image_encodings[img_path] = entry[3]
+        else:
+            pending.append(img_path)
+    cache_hits = len(image_encodings)
+    
+    # Lượt 2: decode + encode ảnh mới trên nhiều process (job nhỏ chạy ngay trong process này)
+    encoded, errors = encode_images(
+        pending, workers=BUILD_WORKERS, chunk_size=BUILD_CHUNK_SIZE, lock=_dlib_lock,
+        progress=_build_progress if pending else None  # /health giữ tiến độ của lần build thật gần nhất
+    )
+    for img_path, error in errors.items():
+        print(f"⚠️ Lỗi khi load {img_path}: {error}")
+    
+    person_of = dict((img_path, person_name) for person_name, img_path in images)
+    # Lưu cả ảnh không có mặt (None) để lần sau không encode lại
+    new_rows = [
+        (img_path, person_of[img_path], *file_keys[img_path], encoding)
+        for img_path, encoding in encoded.items()
+    ]
+    image_encodings.update(encoded)
+    
+    # Gom encoding theo người (giữ thứ tự thư mục như trước)
+    person_images = {}
+    for person_name, img_path in images:
+        images_of_person = person_images.setdefault(person_name, {})
+        if image_encodings.get(img_path) is not None:
+            images_of_person[img_path] = image_encodings[img_path]
+    
+    person_count = len(person_images)
+    total_images = 0
+    persons = {}
+    for person_name, images_of_person in person_images.items():
+        if images_of_person:
+            encodings = list(images_of_person.values())
             # Tính encoding trung bình cho mỗi người
-            mean_encoding = np.mean(encodings, axis=0)
-            known_face_encodings.append(mean_encoding)
+            known_face_encodings.append(np.mean(encodings, axis=0))
             known_face_names.append(person_name)
+            persons[person_name] = {
+                'images': images_of_person,
+                'keys': {img_path: file_keys[img_path] for img_path in images_of_person},
+                'sum': np.sum(encodings, axis=0)
+            }
+            total_images += len(encodings)
+    
+    # Đồng bộ cache: thêm ảnh mới encode, xóa ảnh đã bị xóa khỏi dataset
+    try:
+        _embedding_store.put_many(new_rows)
+        _embedding_store.delete_paths([p for p in cached if p not in seen_paths])
+    except Exception as e:
+        print(f"⚠️ Không ghi được embedding cache: {str(e)}")
     
     # Update cache
-    _dataset_cache['encodings'] = known_face_encodings
-    _dataset_cache['names'] = known_face_names
-    _dataset_cache['timestamp'] = time.time()
-    _dataset_cache['loaded'] = True
+    gallery = FaceGallery.from_encodings(known_face_names, known_face_encodings, ann_index=_create_ann_index())
+    gallery.on_index_trained = lambda: _on_index_trained(gallery)
+    with _dataset_lock:
+        _dataset_cache['gallery'] = gallery
+        _dataset_cache['persons'] = persons
+        _dataset_cache['timestamp'] = time.time()
+        _dataset_cache['loaded'] = True
+        _publish_gallery_change('sync', None)
     
     elapsed = time.time() - start_time
-    print(f"✅ Dataset loaded: {person_count} người, {total_images} ảnh trong {elapsed:.2f}s")
+    print(f"✅ Dataset loaded: {person_count} người, {total_images} ảnh trong {elapsed:.2f}s "
+          f"({cache_hits} từ cache, {len(new_rows)} encode mới)")
+    
+    return gallery.matrix, gallery.names
+
+def _update_person_entry(person_name):
+    """Cập nhật mean encoding của 1 người trong gallery - O(1), không rebuild cả gallery"""
+    gallery = _dataset_cache['gallery']
+    person = _dataset_cache['persons'].get(person_name)
+    
+    if person and person['images']:
+        mean_encoding = person['sum'] / len(person['images'])
+        gallery.set(person_name, mean_encoding)
+        _publish_gallery_change('set', (person_name, mean_encoding))
+        return
     
-    return known_face_encodings, known_face_names
+    # Người không còn ảnh hợp lệ -> xóa khỏi gallery
+    _dataset_cache['persons'].pop(person_name, None)
+    gallery.remove(person_name)
+    _publish_gallery_change('remove', person_name)
+
+def _publish_gallery_change(kind, payload):
+    """
+    Đồng bộ thay đổi gallery tới các process worker (nếu chạy chế độ nhiều worker).
+    Chỉ gửi toàn bộ gallery khi reload (hoặc gallery dùng chung hết hàng dự phòng); đăng ký / xóa chỉ gửi thay đổi.
+    """
+    if _worker_pool is None:
+        return
+    gallery = _dataset_cache['gallery']
+    if kind == 'sync' or _worker_pool.needs_snapshot(len(gallery)):
+        centroids = gallery.ann_index.centroids if gallery.ann_index is not None else None
+        _worker_pool.publish_gallery(gallery.names, gallery.matrix, centroids=centroids)
+    else:
+        _worker_pool.broadcast(kind, payload)
+
+def _on_index_trained(gallery):
+    """ANN index vừa train xong ở background (gallery vượt ngưỡng) -> gửi centroid cho worker"""
+    with _dataset_lock:
+        if _dataset_cache['gallery'] is gallery:
+            _publish_gallery_change('sync', None)
+
+def add_person_images(person_name, image_names):
+    """
+    Thêm ảnh mới cho 1 người mà không reload cả dataset.
+    Chỉ encode các ảnh được truyền vào rồi cập nhật running mean của người đó.
+    Ảnh đã encode và file không đổi (size, mtime) thì bỏ qua; cùng tên nhưng file đã bị ghi đè thì encode lại.
+    Trả về dict thống kê: added / no_face / skipped / errors
+    """
+    # Đảm bảo gallery đã có (lần đầu sẽ load toàn bộ, các lần sau dùng cache)
+    load_face_dataset()
+    
+    person_path = os.path.join(DATASET_DIR, person_name)
+    result = {'added': [], 'no_face': [], 'skipped': [], 'errors': []}
+    new_rows = []
+    new_encodings = {}
+    
+    with _dataset_lock:
+        known_keys = dict(_dataset_cache['persons'].get(person_name, {}).get('keys', {}))
+    
+    for img_name in image_names:
+        img_path = os.path.join(person_path, img_name)
+        try:
+            size, mtime_ns = EmbeddingStore.file_key(img_path)
+            if known_keys.get(img_path) == (size, mtime_ns):
+                result['skipped'].append(img_name)
+                continue
+            image = face_recognition.load_image_file(img_path)
+            with _dlib_lock:
+                face_encs = face_recognition.face_encodings(image)
+            encoding = face_encs[0] if len(face_encs) > 0 else None
+            new_rows.append((img_path, person_name, size, mtime_ns, encoding))
+            # None = ảnh (bị ghi đè) không còn mặt -> bỏ encoding cũ của path này khỏi mean
+            new_encodings[img_path] = (encoding, (size, mtime_ns))
+            if encoding is None:
+                result['no_face'].append(img_name)
+            else:
+                result['added'].append(img_name)
+        except Exception as e:
+            print(f"⚠️ Lỗi khi load {img_path}: {str(e)}")
+            result['errors'].append(img_name)
+    
+    with _dataset_lock:
+        person = _dataset_cache['persons'].setdefault(
+            person_name, {'images': {}, 'keys': {}, 'sum': np.zeros(128)}
+        )
+        for img_path, (encoding, key) in new_encodings.items():
+            old_encoding = person['images'].pop(img_path, None)
+            person['keys'].pop(img_path, None)
+            if old_encoding is not None:
+                person['sum'] = person['sum'] - old_encoding
+            if encoding is not None:
+                person['images'][img_path] = encoding
+                person['keys'][img_path] = key
+                person['sum'] = person['sum'] + encoding
+        _update_person_entry(person_name)
+    
+    try:
+        _embedding_store.put_many(new_rows)
+    except Exception as e:
+        print(f"⚠️ Không ghi được embedding cache: {str(e)}")
+    
+    return result
+
+def remove_person_image(person_name, image_name):
+    """Xóa 1 ảnh khỏi gallery và cập nhật lại mean encoding của người đó"""
+    img_path = os.path.join(DATASET_DIR, person_name, image_name)
+    removed = False
+    
+    with _dataset_lock:
+        person = _dataset_cache['persons'].get(person_name)
+        if person and img_path in person['images']:
+            encoding = person['images'].pop(img_path)
+            person['keys'].pop(img_path, None)
+            person['sum'] = person['sum'] - encoding
+            _update_person_entry(person_name)
+            removed = True
+    
+    try:
+        _embedding_store.delete_paths([img_path])
+    except Exception as e:
+        print(f"⚠️ Không ghi được embedding cache: {str(e)}")
+    
+    return removed
+
+def remove_person(person_name):
+    """Xóa toàn bộ 1 người khỏi gallery"""
+    with _dataset_lock:
+        removed = person_name in _dataset_cache['persons']
+        _dataset_cache['persons'].pop(person_name, None)
+        _update_person_entry(person_name)
+    
+    try:
+        _embedding_store.delete_person(person_name)
+    except Exception as e:
+        print(f"⚠️ Không ghi được embedding cache: {str(e)}")
+    
+    return removed
+
+def _load_request_image():
+    """
+    Đọc ảnh từ request và decode thành mảng RGB. Hỗ trợ:
+    - body binary (image/jpeg, image/png, application/octet-stream) - không tốn 33% base64
+    - multipart/form-data với field 'image'
+    - JSON {'image': base64 / data URL} - giữ tương thích với client cũ
+    Trả về None nếu request không có ảnh.
+    """
+    mimetype = request.mimetype
+    if mimetype.startswith('image/') or mimetype == 'application/octet-stream':
+        image_bytes = request.get_data()
+    elif mimetype == 'multipart/form-data':
+        image_file = request.files.get('image')
+        image_bytes = image_file.read() if image_file else None
+    else:
+        data = request.get_json(silent=True) or {}
+        image_data = data.get('image')
+        if not image_data:
+            return None
+        if ',' in image_data:
+            image_data = image_data.split(',')[1]
+        image_bytes = base64.b64decode(image_data)
+    
+    if not image_bytes:
+        return None
+    
+    with _metrics.stage('decode'):
+        image_pil = Image.open(io.BytesIO(image_bytes))
+        image_pil.load()
+    with _metrics.stage('color_convert'):
+        return np.asarray(image_pil.convert('RGB'))
+
+def _request_boxes():
+    """
+    Box khuôn mặt đã detect sẵn (vd gateway gọi /detect trước): ?boxes=[[top, right, bottom, left], ...]
+    hoặc field 'boxes' của JSON. Trả về None nếu request không có box -> service tự detect.
+    """
+    value = request.args.get('boxes')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('boxes')
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = json.loads(value)
+    boxes = [tuple(int(v) for v in box) for box in value]
+    if any(len(box) != 4 for box in boxes):
+        raise ValueError('Mỗi box phải gồm 4 giá trị [top, right, bottom, left]')
+    return boxes
+
+def _is_valid_name(value):
+    """Chỉ chấp nhận tên file/thư mục đơn (không chứa đường dẫn)"""
+    return bool(value) and isinstance(value, str) and os.path.basename(value) == value and value not in ('.', '..')
+
+@app.before_request
+def start_request_metrics():
+    """Chạy trước reject_until_ready để request bị từ chối lúc khởi động cũng được đếm"""
+    if request.path not in PROBE_PATHS and request.path != '/metrics':
+        g.metrics_started = _metrics.request_started(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def finish_request_metrics(response):
+    if 'metrics_started' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        _metrics.request_finished(g.pop('metrics_started'), endpoint, response.status_code)
+    return response
+
+@app.before_request
+def reject_until_ready():
+    """Đang load gallery ở background -> chỉ trả lời probe, request xử lý ảnh nhận 503 + Retry-After"""
+    if request.path not in PROBE_PATHS and not _readiness.ready:
+        payload, status, headers = _readiness.not_ready_response()
+        return jsonify(payload), status, headers
+
+# Profile cProfile theo yêu cầu (admin): /admin/profile/start, tắt thì không tốn gì
+install_profiler(app, _profiler)
+
+@app.route('/livez', methods=['GET'])
+def liveness():
+    """Process còn sống (kể cả khi đang load gallery)"""
+    return jsonify(_readiness.livez())
+
+@app.route('/readyz', methods=['GET'])
+def readiness():
+    """200 khi đã load xong gallery (và worker nếu có), 503 + tiến độ khi đang khởi động"""
+    payload, status = _readiness.readyz()
+    return jsonify(payload), status
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Thời gian từng bước + trạng thái dạng text Prometheus"""
+    return Response(_metrics.render(), content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -88,8 +475,15 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'service': 'face_recognition',
+        'ready': _readiness.ready,
         'dataset_loaded': _dataset_cache['loaded'],
-        'persons_count': len(_dataset_cache['names']),
+        'persons_count': len(_dataset_cache['gallery']),
+        'ann_index': _dataset_cache['gallery'].ann_index.stats() if _dataset_cache['gallery'].ann_index else None,
+        'tracking': _trackers.stats(),
+        'detection_scale': DETECTION_SCALE if DETECTION_SCALE == 'auto' else round(_detection_scale(), 3),
+        'batching': _batch_scheduler.stats() if _batch_scheduler else None,
+        'worker_pool': _worker_pool.stats() if _worker_pool else None,
+        'gallery_build': _build_progress.snapshot(),
         'timestamp': _dataset_cache['timestamp']
     })
 
@@ -101,6 +495,7 @@ def reload_dataset():
     _dataset_cache['timestamp'] = 0
     
     encodings, names = load_face_dataset()
+    _trackers.clear()
     
     return jsonify({
         'success': True,
@@ -108,83 +503,291 @@ def reload_dataset():
         'persons_count': len(names)
     })
 
+@app.route('/gallery/add', methods=['POST'])
+def gallery_add():
+    """Thêm ảnh mới của 1 người vào gallery - chỉ encode ảnh mới (không reload cả dataset)"""
+    data = request.json or {}
+    name = data.get('name')
+    images = data.get('images') or []
+    
+    if not _is_valid_name(name) or not images or not all(_is_valid_name(img) for img in images):
+        return jsonify({
+            'success': False,
+            'error': 'Thiếu hoặc sai tên người dùng / tên ảnh'
+        }), 400
+    
+    result = add_person_images(name, images)
+    
+    return jsonify({
+        'success': True,
+        'message': f'Đã thêm {len(result["added"])} ảnh cho {name}',
+        'persons_count': len(_dataset_cache['gallery']),
+        **result
+    })
+
+@app.route('/gallery/remove', methods=['POST'])
+def gallery_remove():
+    """Xóa 1 người hoặc 1 ảnh của người đó khỏi gallery"""
+    data = request.json or {}
+    name = data.get('name')
+    image = data.get('image')
+    
+    if not _is_valid_name(name) or (image is not None and not _is_valid_name(image)):
+        return jsonify({
+            'success': False,
+            'error': 'Thiếu hoặc sai tên người dùng / tên ảnh'
+        }), 400
+    
+    removed = remove_person_image(name, image) if image else remove_person(name)
+    if removed:
+        _trackers.clear()  # Track đang giữ danh tính của người vừa xóa
+    
+    return jsonify({
+        'success': True,
+        'removed': removed,
+        'persons_count': len(_dataset_cache['gallery'])
+    })
+
+def _detect_faces(image_rgb, scale=None):
+    """Detect trên bản thu nhỏ rồi đổi box về tọa độ ảnh gốc"""
+    scale = _detection_scale(image_rgb.shape) if scale is None else scale
+    if scale >= 1.0:
+        with _metrics.stage('detect'):
+            return face_recognition.face_locations(image_rgb)
+    
+    height, width = image_rgb.shape[:2]
+    small_size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    with _metrics.stage('resize'):
+        small = np.asarray(Image.fromarray(image_rgb).resize(small_size, Image.BILINEAR, reducing_gap=2.0))
+    with _metrics.stage('detect'):
+        small_locations = face_recognition.face_locations(small)
+    
+    scale_x = width / float(small_size[0])
+    scale_y = height / float(small_size[1])
+    return [
+        (
+            max(0, int(round(top * scale_y))),
+            min(width, int(round(right * scale_x))),
+            min(height, int(round(bottom * scale_y))),
+            max(0, int(round(left * scale_x)))
+        )
+        for top, right, bottom, left in small_locations
+    ]
+
+def _encode_faces_batch(images, locations_list):
+    """
+    Encode mọi khuôn mặt của cả batch trong 1 lần gọi dlib
+    (cùng tham số với face_recognition.face_encodings: landmark 5 điểm, num_jitters=1)
+    """
+    batch_images = []
+    batch_landmarks = []
+    with _metrics.stage('landmarks'):
+        for image, locations in zip(images, locations_list):
+            if not locations:
+                continue
+            landmarks = dlib.full_object_detections()
+            for top, right, bottom, left in locations:
+                landmarks.append(face_recognition.api.pose_predictor_5_point(image, dlib.rectangle(left, top, right, bottom)))
+            batch_images.append(image)
+            batch_landmarks.append(landmarks)
+    
+    if not batch_images:
+        return []
+    with _metrics.stage('encode'):
+        descriptors = face_recognition.api.face_encoder.compute_face_descriptor(batch_images, batch_landmarks, 1)
+    return [np.array(descriptor) for image_descriptors in descriptors for descriptor in image_descriptors]
+
+def _detect_and_match_batch(images, gallery):
+    """Detect + encode + so khớp đầy đủ cho nhiều ảnh, mỗi ảnh trả về list (box, name hoặc None, distance)"""
+    with _dlib_lock:
+        locations_list = [_detect_faces(image) for image in images]
+        face_encodings = _encode_faces_batch(images, locations_list)
+    if not face_encodings:
+        return [[] for _ in images]
+    
+    # Nhận diện tất cả khuôn mặt của cả batch trong 1 lần tính khoảng cách (vector hóa)
+    with _metrics.stage('match'):
+        matched_names, distances = gallery.match(face_encodings, tolerance=MATCH_TOLERANCE)
+    
+    results = []
+    offset = 0
+    for locations in locations_list:
+        results.append([
+            (tuple(int(v) for v in location), matched_names[offset + i], float(distances[offset + i]))
+            for i, location in enumerate(locations)
+        ])
+        offset += len(locations)
+    return results
+
+def _match_boxes(image_rgb, boxes, gallery):
+    """Encode + so khớp các khuôn mặt tại box cho sẵn (bỏ qua detection), trả về list (box, name hoặc None, distance)"""
+    image_height, image_width = image_rgb.shape[:2]
+    boxes = [
+        (max(0, top), min(image_width, right), min(image_height, bottom), max(0, left))
+        for top, right, bottom, left in boxes
+    ]
+    with _dlib_lock:
+        face_encodings = _encode_faces_batch([image_rgb], [boxes])
+    if not face_encodings:
+        return []
+    with _metrics.stage('match'):
+        matched_names, distances = gallery.match(face_encodings, tolerance=MATCH_TOLERANCE)
+    return [(box, name, float(distance)) for box, name, distance in zip(boxes, matched_names, distances)]
+
+def _detect_and_match(image_rgb, gallery):
+    """Detect + encode + so khớp 1 ảnh, trả về list (box, name hoặc None, distance)"""
+    return _detect_and_match_batch([image_rgb], gallery)[0]
+
+# Route tạo việc cho micro-batch scheduler: /recognize vào batch, /detect (gateway gọi ngay trước /recognize) sắp có frame vào batch
+BATCHED_ENDPOINTS = ('/detect', '/recognize')
+_batch_scheduler = None
+if BATCH_MAX_SIZE > 1:
+    _batch_scheduler = MicroBatchScheduler(
+        lambda images: _detect_and_match_batch(images, _dataset_cache['gallery']),
+        window_ms=BATCH_WINDOW_MS,
+        max_batch_size=BATCH_MAX_SIZE,
+        name='recognize-batch',
+        # Chỉ tính request sẽ vào batch (đang decode ảnh -> sắp vào hàng); /gallery/*, /admin/* chạy lâu không làm frame lẻ phải chờ
+        in_flight_fn=lambda: _metrics.in_flight(BATCHED_ENDPOINTS)
+    )
+
+def _recognize_image(image_rgb):
+    """
+    Nhận diện 1 frame - qua process worker hoặc micro-batch scheduler nếu bật.
+    Request đang được profile chạy thẳng trong thread của request (bỏ qua batch) để cProfile thấy detect / encode.
+    """
+    if _worker_pool is not None:
+        with _metrics.stage('worker_roundtrip'):
+            return _worker_pool.recognize(image_rgb)
+    if _batch_scheduler is not None and 'request_profile' not in g:
+        # Chờ trong hàng + xử lý cả batch (các bước bên trong được đo ở thread của scheduler)
+        with _metrics.stage('batch_roundtrip'):
+            return _batch_scheduler.submit(image_rgb)
+    return _detect_and_match(image_rgb, _dataset_cache['gallery'])
+
+@app.route('/detect', methods=['POST'])
+def detect_faces():
+    """API chỉ detect khuôn mặt (không encode / so khớp) - gateway dùng box này cho cả 2 service"""
+    try:
+        image_rgb = _load_request_image()
+        
+        if image_rgb is None:
+            return jsonify({
+                'success': False,
+                'error': 'Không có dữ liệu ảnh'
+            }), 400
+        
+        start_time = time.time()
+        with _dlib_lock:
+            locations = _detect_faces(image_rgb)
+        processing_time = time.time() - start_time
+        
+        return jsonify({
+            'success': True,
+            'boxes': [[int(v) for v in location] for location in locations],
+            'total_faces': len(locations),
+            'processing_time': round(processing_time, 3)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Lỗi detect: {str(e)}'
+        }), 500
+
 @app.route('/recognize', methods=['POST'])
 def recognize_face():
-    """API nhận diện khuôn mặt từ base64 image"""
+    """API nhận diện khuôn mặt - nhận ảnh binary, multipart hoặc JSON base64"""
     try:
-        data = request.json
-        image_data = data.get('image')
+        image_rgb = _load_request_image()
         
-        if not image_data:
+        if image_rgb is None:
             return jsonify({
                 'success': False,
                 'error': 'Không có dữ liệu ảnh'
             }), 400
         
         # Load dataset (từ cache nếu đã load)
-        known_encodings, known_names = load_face_dataset()
+        load_face_dataset()
+        gallery = _dataset_cache['gallery']
         
-        if not known_encodings:
+        if len(gallery) == 0:
             return jsonify({
                 'success': False,
                 'error': 'Không có dữ liệu trong dataset. Vui lòng đăng ký khuôn mặt trước.'
             }), 400
         
-        # Decode base64 image
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        image_pil = Image.open(io.BytesIO(image_bytes))
-        image_rgb = np.array(image_pil.convert('RGB'))
+        try:
+            boxes = _request_boxes()
+        except (ValueError, TypeError) as e:
+            return jsonify({
+                'success': False,
+                'error': f'Box không hợp lệ: {str(e)}'
+            }), 400
         
-        # Detect và encode faces
         start_time = time.time()
-        face_locations = face_recognition.face_locations(image_rgb)
-        face_encodings = face_recognition.face_encodings(image_rgb, face_locations)
+        session_id = request.headers.get('X-Session-Id')
+        keyframe = True
+        if boxes is not None:
+            # Box đã được detect ở nơi khác -> chỉ encode + so khớp
+            tracks = [
+                {'name': name, 'distance': distance, 'location': box}
+                for box, name, distance in _match_boxes(image_rgb, boxes, gallery)
+            ]
+        elif session_id and TRACK_KEYFRAME_INTERVAL > 1:
+            # Streaming: giữa các keyframe chỉ dời box theo optical flow, giữ danh tính của track
+            tracks, keyframe = _trackers.get(session_id).process(
+                image_rgb, _recognize_image
+            )
+        else:
+            tracks = [
+                {'name': name, 'distance': distance, 'location': box}
+                for box, name, distance in _recognize_image(image_rgb)
+            ]
         processing_time = time.time() - start_time
         
-        if not face_encodings:
+        if not tracks:
             return jsonify({
                 'success': True,
                 'faces': [],
                 'total_faces': 0,
+                'keyframe': keyframe,
                 'processing_time': round(processing_time, 3),
                 'message': 'Không tìm thấy khuôn mặt'
             })
         
-        # Nhận diện từng khuôn mặt
         results = []
-        for face_encoding, face_location in zip(face_encodings, face_locations):
-            matches = face_recognition.compare_faces(known_encodings, face_encoding, tolerance=0.5)
+        for track in tracks:
             name = "Unknown"
             confidence = 0
             
-            face_distances = face_recognition.face_distance(known_encodings, face_encoding)
-            
-            if len(face_distances) > 0:
-                best_match_index = np.argmin(face_distances)
-                if matches[best_match_index]:
-                    name = known_names[best_match_index]
-                    confidence = round((1 - face_distances[best_match_index]) * 100, 2)
+            if track['name'] is not None:
+                name = track['name']
+                confidence = round((1 - float(track['distance'])) * 100, 2)
             
-            results.append({
+            top, right, bottom, left = track['location']
+            face = {
                 'name': name,
                 'confidence': confidence,
                 'location': {
-                    'top': int(face_location[0]),
-                    'right': int(face_location[1]),
-                    'bottom': int(face_location[2]),
-                    'left': int(face_location[3])
+                    'top': int(top),
+                    'right': int(right),
+                    'bottom': int(bottom),
+                    'left': int(left)
                 }
-            })
+            }
+            if 'track_id' in track:
+                face['track_id'] = track['track_id']
+            results.append(face)
         
-        return jsonify({
-            'success': True,
-            'faces': results,
-            'total_faces': len(results),
-            'processing_time': round(processing_time, 3)
-        })
+        with _metrics.stage('serialize'):
+            return jsonify({
+                'success': True,
+                'faces': results,
+                'total_faces': len(results),
+                'keyframe': keyframe,
+                'processing_time': round(processing_time, 3)
+            })
         
     except Exception as e:
         return jsonify({
@@ -192,26 +795,46 @@ def recognize_face():
             'error': f'Lỗi nhận diện: {str(e)}'
         }), 500
 
-if __name__ == '__main__':
-    print("\n" + "="*70)
-    print("🚀 FACE RECOGNITION SERVICE - Starting...")
-    print("="*70)
-    print("📦 Environment: face_recognition (Anaconda)")
-    print("🌐 Port: 5001")
-    print("="*70 + "\n")
+def _startup():
+    """Load dataset và khởi động process worker (chạy ở thread nền khi service khởi động)"""
+    global _worker_pool
     
-    # Pre-load dataset khi khởi động
-    print("📊 Pre-loading dataset...")
+    _readiness.set_stage('Load dataset')
     encodings, names = load_face_dataset()
     if len(names) > 0:
         print(f"✅ Dataset ready: {len(names)} người đã đăng ký")
     else:
         print("⚠️ Dataset trống - chưa có người dùng nào được đăng ký")
     
+    # Chế độ nhiều process: mỗi worker giữ model dlib + bản sao gallery
+    if WORKERS > 0:
+        _readiness.set_stage(f'Khởi động {WORKERS} process worker')
+        pool = RecognitionWorkerPool(
+            WORKERS, _detect_and_match, index_factory=_create_ann_index,
+            shared_gallery=SHARED_GALLERY, shared_dir=SHARED_GALLERY_DIR
+        )
+        pool.start()
+        with _dataset_lock:
+            _worker_pool = pool
+            gallery = _dataset_cache['gallery']
+            _publish_gallery_change('sync', None)
+        print(f"✅ {WORKERS} worker đã nhận gallery ({len(gallery)} người)")
+
+if __name__ == '__main__':
     print("\n" + "="*70)
-    print("✅ Face Recognition Service is READY!")
-    print("🌐 Listening on: http://localhost:5001")
+    print("🚀 FACE RECOGNITION SERVICE - Starting...")
+    print("="*70)
+    print("📦 Environment: face_recognition (Anaconda)")
+    print("🌐 Port: 5001")
+    print("="*70 + "\n")
+    
+    # Mở port ngay; dataset (+ worker) load ở thread nền, /readyz báo tiến độ
+    _readiness.start_background(_startup)
+    print("🌐 Listening on: http://localhost:5001 (đang load dataset ở background - xem /readyz)")
     print("="*70 + "\n")
     
+    # HTTP/1.1 để gateway giữ kết nối keep-alive (mặc định HTTP/1.0 đóng kết nối sau mỗi request)
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    
     # Chạy service
     app.run(host='0.0.0.0', port=5001, debug=False, threaded=True)
@@ -1,7 +1,10 @@
 import face_recognition
 import cv2
 import os
+from collections import Counter
 import numpy as np
+from face_tracker import FaceTracker
+from gallery_builder import build_gallery
 
 # ======================
 # Dataset path
@@ -11,72 +14,47 @@ DATASET_DIR = r"C:\Users\ADMIN\Desktop\FaceRecognition_RealTime\dataset"
 known_face_encodings = []
 known_face_names = []
 
-print("📂 Loading dataset...")
 
-# ======================
-# Load dataset
-# ======================
-for person_name in os.listdir(DATASET_DIR):
-    person_path = os.path.join(DATASET_DIR, person_name)
-
-    if not os.path.isdir(person_path):
-        continue
-
-    encodings = []
-
-    for img_name in os.listdir(person_path):
-        if img_name.lower().endswith((".jpg", ".png", ".jpeg")):
-            img_path = os.path.join(person_path, img_name)
-
-            image = face_recognition.load_image_file(img_path)
-            face_encs = face_recognition.face_encodings(image)
-
-            if len(face_encs) > 0:
-                encodings.append(face_encs[0])
-            else:
-                print(f"⚠️ No face in {img_path}")
-
-    if len(encodings) > 0:
-        mean_encoding = np.mean(encodings, axis=0)
-        known_face_encodings.append(mean_encoding)
-        known_face_names.append(person_name)
-        print(f"✅ Loaded {person_name} ({len(encodings)} images)")
-    else:
-        print(f"❌ No valid images for {person_name}")
+def load_dataset():
+    """Encode dataset song song trên các CPU core (gallery_builder) rồi lấy mean encoding mỗi người"""
+    print("📂 Loading dataset...")
+    names, mean_encodings, image_encodings, errors = build_gallery(DATASET_DIR)
+
+    for img_path, encoding in image_encodings.items():
+        if encoding is None:
+            print(f"⚠️ No face in {img_path}")
+    for img_path, error in errors.items():
+        print(f"⚠️ Error loading {img_path}: {error}")
+
+    known_face_names[:] = names
+    known_face_encodings[:] = mean_encodings
+    # Đếm số ảnh hợp lệ mỗi người trong 1 lượt
+    counts = Counter(os.path.basename(os.path.dirname(path))
+                     for path, encoding in image_encodings.items() if encoding is not None)
+    for person_name in os.listdir(DATASET_DIR):
+        if not os.path.isdir(os.path.join(DATASET_DIR, person_name)):
+            continue
+        if counts[person_name] > 0:
+            print(f"✅ Loaded {person_name} ({counts[person_name]} images)")
+        else:
+            print(f"❌ No valid images for {person_name}")
 
 # ======================
-# Open webcam
+# Recognize (chỉ chạy ở keyframe)
 # ======================
-video_capture = cv2.VideoCapture(0)
-
-if not video_capture.isOpened():
-    print("❌ Cannot open webcam")
-    exit()
-
-print("🎥 Webcam started (press 'q' to quit)")
-
-# ======================
-# Realtime recognition
-# ======================
-while True:
-    ret, frame = video_capture.read()
-    if not ret:
-        break
-
-    # Resize for speed
-    small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-    rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-
+def recognize_faces(rgb_small_frame):
     face_locations = face_recognition.face_locations(rgb_small_frame)
     face_encodings = face_recognition.face_encodings(
         rgb_small_frame, face_locations
     )
 
-    for (top, right, bottom, left), face_encoding in zip(face_locations, face_encodings):
+    results = []
+    for face_location, face_encoding in zip(face_locations, face_encodings):
         matches = face_recognition.compare_faces(
             known_face_encodings, face_encoding, tolerance=0.5
         )
-        name = "Unknown"
+        name = None
+        distance = 1.0
 
         face_distances = face_recognition.face_distance(
             known_face_encodings, face_encoding
@@ -84,31 +62,72 @@ while True:
 
         if len(face_distances) > 0:
             best_match = np.argmin(face_distances)
+            distance = float(face_distances[best_match])
             if matches[best_match]:
                 name = known_face_names[best_match]
 
-        # Scale back
-        top *= 4
-        right *= 4
-        bottom *= 4
-        left *= 4
+        results.append((face_location, name, distance))
+    return results
 
-        # Draw box
-        cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
 
-        # Draw label
-        cv2.rectangle(frame, (left, bottom - 35), (right, bottom),
-                      (0, 255, 0), cv2.FILLED)
-        cv2.putText(frame, name, (left + 6, bottom - 6),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+if __name__ == "__main__":
+    # Process worker của gallery_builder (spawn) import lại file này -> chỉ chạy webcam ở process chính
+    load_dataset()
 
-    cv2.imshow("Face Recognition - Dataset", frame)
+    # ======================
+    # Open webcam
+    # ======================
+    video_capture = cv2.VideoCapture(0)
 
-    if cv2.waitKey(1) & 0xFF == ord("q"):
-        break
+    if not video_capture.isOpened():
+        print("❌ Cannot open webcam")
+        exit()
 
-# ======================
-# Release
-# ======================
-video_capture.release()
-cv2.destroyAllWindows()
+    print("🎥 Webcam started (press 'q' to quit)")
+
+    # Detect + encode mỗi 10 frame (hoặc khi mất track), giữa các keyframe chỉ dời box theo optical flow
+    tracker = FaceTracker(keyframe_interval=10)
+
+    # ======================
+    # Realtime recognition
+    # ======================
+    while True:
+        ret, frame = video_capture.read()
+        if not ret:
+            break
+
+        # Resize for speed
+        small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
+        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
+
+        tracks, is_keyframe = tracker.process(rgb_small_frame, recognize_faces)
+
+        for track in tracks:
+            top, right, bottom, left = track['location']
+            name = track['name'] or "Unknown"
+
+            # Scale back
+            top *= 4
+            right *= 4
+            bottom *= 4
+            left *= 4
+
+            # Draw box
+            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+
+            # Draw label
+            cv2.rectangle(frame, (left, bottom - 35), (right, bottom),
+                          (0, 255, 0), cv2.FILLED)
+            cv2.putText(frame, name, (left + 6, bottom - 6),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+
+        cv2.imshow("Face Recognition - Dataset", frame)
+
+        if cv2.waitKey(1) & 0xFF == ord("q"):
+            break
+
+    # ======================
+    # Release
+    # ======================
+    video_capture.release()
+    cv2.destroyAllWindows()
@@ -0,0 +1,223 @@
+"""
+Face Tracker - Detect-then-track cho nhận diện realtime
+Chỉ chạy detect + encode + so khớp đầy đủ ở keyframe (mỗi N frame) hoặc khi mất track;
+giữa các keyframe, bounding box được dời theo optical flow (Lucas-Kanade) và giữ nguyên danh tính.
+Ở keyframe, khuôn mặt mới được gán vào track cũ theo IoU để track_id ổn định giữa các frame.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None  # Không có OpenCV -> box giữ nguyên giữa các keyframe (chỉ ghép track theo IoU)
+
+# Số điểm đặc trưng tối thiểu còn bám được để tin kết quả optical flow
+MIN_FLOW_POINTS = 4
+# Box sau khi cắt theo biên ảnh nhỏ hơn ngưỡng này (pixel, chiều nhỏ nhất) -> khuôn mặt đã ra khỏi khung hình
+MIN_TRACK_SIZE = 20
+
+
+def clamp_box(box, width, height):
+    """Cắt box (top, right, bottom, left) vào trong ảnh width x height"""
+    top, right, bottom, left = box
+    return (max(0, top), min(width, right), min(height, bottom), max(0, left))
+
+
+def box_iou(box_a, box_b):
+    """IoU giữa 2 box dạng (top, right, bottom, left) như face_recognition"""
+    top = max(box_a[0], box_b[0])
+    right = min(box_a[1], box_b[1])
+    bottom = min(box_a[2], box_b[2])
+    left = max(box_a[3], box_b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (box_a[1] - box_a[3]) * (box_a[2] - box_a[0])
+    area_b = (box_b[1] - box_b[3]) * (box_b[2] - box_b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    """1 khuôn mặt đang được theo dõi: vị trí hiện tại + danh tính lấy từ keyframe gần nhất"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, box, name, distance):
+        self.track_id = next(self._ids)
+        self.box = box
+        self.name = name
+        self.distance = distance
+        self.frames_since_verify = 0
+
+    def to_dict(self):
+        return {
+            'track_id': self.track_id,
+            'name': self.name,
+            'distance': self.distance,
+            'location': self.box
+        }
+
+
+class FaceTracker:
+    """
+    Tracker cho 1 phiên (1 webcam / 1 kết nối streaming).
+    recognize_fn(image_rgb) -> list (box, name, distance), với name=None nếu không khớp ai
+    """
+
+    def __init__(self, keyframe_interval=10, iou_threshold=0.3):
+        self.keyframe_interval = keyframe_interval
+        self.iou_threshold = iou_threshold
+        self.tracks = []
+        self._prev_gray = None
+        self._frames_since_keyframe = 0
+        self.frames = 0
+        self.keyframes = 0
+        self.last_used = time.time()
+        self._lock = threading.Lock()
+
+    def process(self, image_rgb, recognize_fn):
+        """Xử lý 1 frame, trả về (list track dict, is_keyframe)"""
+        with self._lock:
+            self.last_used = time.time()
+            self.frames += 1
+            gray = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY) if cv2 is not None else None
+
+            need_keyframe = (
+                not self.tracks
+                or self._frames_since_keyframe + 1 >= self.keyframe_interval
+                or self._prev_gray is None
+                or (gray is not None and gray.shape != self._prev_gray.shape)
+            )
+            if not need_keyframe and not self._propagate(gray):
+                need_keyframe = True  # Mất track -> detect lại ngay trên frame này
+
+            if need_keyframe:
+                self._keyframe(image_rgb, recognize_fn)
+            else:
+                self._frames_since_keyframe += 1
+                for track in self.tracks:
+                    track.frames_since_verify += 1
+
+            self._prev_gray = gray
+            return [track.to_dict() for track in self.tracks], need_keyframe
+
+    def _keyframe(self, image_rgb, recognize_fn):
+        """Detect + nhận diện đầy đủ, ghép kết quả vào track cũ theo IoU (greedy)"""
+        detections = recognize_fn(image_rgb)
+        self.keyframes += 1
+        self._frames_since_keyframe = 0
+
+        pairs = []
+        for det_idx, (box, _, _) in enumerate(detections):
+            for track_idx, track in enumerate(self.tracks):
+                iou = box_iou(box, track.box)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, det_idx, track_idx))
+        pairs.sort(reverse=True)
+
+        assigned = {}
+        used_tracks = set()
+        for _, det_idx, track_idx in pairs:
+            if det_idx in assigned or track_idx in used_tracks:
+                continue
+            assigned[det_idx] = self.tracks[track_idx]
+            used_tracks.add(track_idx)
+
+        tracks = []
+        for det_idx, (box, name, distance) in enumerate(detections):
+            track = assigned.get(det_idx)
+            if track is None:
+                track = Track(box, name, distance)
+            else:
+                track.box, track.name, track.distance = box, name, distance
+                track.frames_since_verify = 0
+            tracks.append(track)
+        self.tracks = tracks
+
+    def _propagate(self, gray):
+        """
+        Dời box theo optical flow (box luôn nằm trong ảnh); track ra khỏi khung hình bị bỏ.
+        False nếu 1 track bị mất (quá ít điểm bám được) -> cần keyframe.
+        """
+        if gray is None:
+            return True  # Không có OpenCV: giữ nguyên box tới keyframe tiếp theo
+
+        height, width = gray.shape
+        visible = []
+        for track in self.tracks:
+            top, right, bottom, left = track.box
+            roi = self._prev_gray[max(0, top):max(0, bottom), max(0, left):max(0, right)]
+            if roi.size == 0:
+                return False
+            points = cv2.goodFeaturesToTrack(roi, maxCorners=40, qualityLevel=0.01, minDistance=3)
+            if points is None or len(points) < MIN_FLOW_POINTS:
+                return False
+            points = points.reshape(-1, 2) + np.array([max(0, left), max(0, top)], dtype=np.float32)
+
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(
+                self._prev_gray, gray, points.reshape(-1, 1, 2), None,
+                winSize=(15, 15), maxLevel=2
+            )
+            good = status.reshape(-1) == 1
+            if good.sum() < MIN_FLOW_POINTS:
+                return False
+            dx, dy = np.median(moved.reshape(-1, 2)[good] - points[good], axis=0)
+            dx, dy = int(round(float(dx))), int(round(float(dy)))
+
+            new_box = clamp_box((top + dy, right + dx, bottom + dy, left + dx), width, height)
+            if min(new_box[1] - new_box[3], new_box[2] - new_box[0]) < MIN_TRACK_SIZE:
+                continue  # Phần còn trong ảnh quá nhỏ -> khuôn mặt đã ra khỏi khung hình
+            track.box = new_box
+            visible.append(track)
+        self.tracks = visible
+        return True
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'keyframes': self.keyframes,
+            'tracks': len(self.tracks)
+        }
+
+
+class TrackerRegistry:
+    """Giữ tracker theo session id (LRU + hết hạn sau ttl giây không dùng)"""
+
+    def __init__(self, keyframe_interval=10, iou_threshold=0.3, max_sessions=64, ttl=60):
+        self.keyframe_interval = keyframe_interval
+        self.iou_threshold = iou_threshold
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._trackers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            now = time.time()
+            for key in [k for k, t in self._trackers.items() if now - t.last_used > self.ttl]:
+                del self._trackers[key]
+
+            tracker = self._trackers.pop(session_id, None)
+            if tracker is None:
+                tracker = FaceTracker(self.keyframe_interval, self.iou_threshold)
+            self._trackers[session_id] = tracker
+            while len(self._trackers) > self.max_sessions:
+                self._trackers.popitem(last=False)
+            return tracker
+
+    def clear(self):
+        """Xóa mọi tracker (danh tính cũ không còn đúng sau khi gallery thay đổi)"""
+        with self._lock:
+            self._trackers.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._trackers),
+                'keyframe_interval': self.keyframe_interval
+            }
@@ -0,0 +1,230 @@
+"""
+Gallery Builder - Encode ảnh dataset song song trên nhiều CPU core
+Ảnh được chia thành từng chunk, mỗi chunk do 1 process worker decode + encode (mỗi worker có model dlib riêng,
+không tranh nhau 1 lock như khi encode trong 1 process). Lỗi của 1 ảnh chỉ làm hỏng ảnh đó, không làm hỏng cả lần build.
+Tiến độ (ảnh đã xong, ảnh/giây, thời gian còn lại) đọc được qua BuildProgress.snapshot().
+Chạy độc lập để build sẵn embedding cache trước khi khởi động service:
+    python gallery_builder.py --dataset dataset --workers 8
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+
+
+def scan_dataset(dataset_dir):
+    """Danh sách (tên người, đường dẫn ảnh) theo cấu trúc dataset/<tên người>/<ảnh>"""
+    images = []
+    for person_name in os.listdir(dataset_dir):
+        person_path = os.path.join(dataset_dir, person_name)
+        if not os.path.isdir(person_path):
+            continue
+        for img_name in os.listdir(person_path):
+            if img_name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((person_name, os.path.join(person_path, img_name)))
+    return images
+
+
+def encode_image_file(img_path):
+    """Encoding của khuôn mặt đầu tiên trong ảnh, None nếu không có mặt"""
+    import face_recognition
+    image = face_recognition.load_image_file(img_path)
+    face_encs = face_recognition.face_encodings(image)
+    return face_encs[0] if len(face_encs) > 0 else None
+
+
+def _encode_chunk(paths):
+    """Chạy trong process worker: encode từng ảnh, lỗi của ảnh nào ghi cho ảnh đó"""
+    results = []
+    for path in paths:
+        try:
+            results.append((path, encode_image_file(path), None))
+        except Exception as e:
+            results.append((path, None, str(e)))
+    return results
+
+
+class BuildProgress:
+    """Tiến độ 1 lần build, thread-safe (service đọc qua /health trong khi build chạy ở thread khác)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        self.state = 'idle'
+
+    def _reset(self):
+        self.state = 'running'
+        self.total = 0
+        self.done = 0
+        self.encoded = 0
+        self.no_face = 0
+        self.errors = 0
+        self.workers = 0
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def start(self, total, workers):
+        with self._lock:
+            self._reset()
+            self.total = total
+            self.workers = workers
+
+    def advance(self, results):
+        with self._lock:
+            for _, encoding, error in results:
+                self.done += 1
+                if error is not None:
+                    self.errors += 1
+                elif encoding is None:
+                    self.no_face += 1
+                else:
+                    self.encoded += 1
+
+    def finish(self):
+        with self._lock:
+            self.state = 'done'
+            self.finished_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            if self.state == 'idle':
+                return {'state': 'idle'}
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            remaining = self.total - self.done
+            return {
+                'state': self.state,
+                'total': self.total,
+                'done': self.done,
+                'encoded': self.encoded,
+                'no_face': self.no_face,
+                'errors': self.errors,
+                'workers': self.workers,
+                'percent': round(100.0 * self.done / self.total, 1) if self.total else 100.0,
+                'elapsed': round(elapsed, 2),
+                'images_per_sec': round(rate, 2),
+                'eta': round(remaining / rate, 1) if rate > 0 else (None if remaining else 0)  # None = chưa ước lượng được
+            }
+
+
+def encode_images(paths, workers=0, chunk_size=8, progress=None, lock=None):
+    """
+    Encode danh sách ảnh. workers: số process (0 = số CPU core); job nhỏ hoặc workers=1 chạy ngay trong process
+    hiện tại (dưới `lock` nếu có - model dlib không an toàn khi nhiều thread dùng chung).
+    Trả về (dict path -> encoding hoặc None nếu không có mặt, dict path -> lỗi).
+    """
+    paths = list(paths)
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if progress is not None:
+        progress.start(len(paths), max(workers, 1))
+
+    encodings = {}
+    errors = {}
+
+    def collect(results):
+        for path, encoding, error in results:
+            if error is not None:
+                errors[path] = error
+            else:
+                encodings[path] = encoding
+        if progress is not None:
+            progress.advance(results)
+
+    try:
+        if workers <= 1:
+            for chunk in chunks:
+                with lock or nullcontext():
+                    collect(_encode_chunk(chunk))
+        else:
+            # spawn: không fork process đang có thread (Flask, scheduler) và chạy được trên Windows
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = {executor.submit(_encode_chunk, chunk): chunk for chunk in chunks}
+                for future in as_completed(futures):
+                    try:
+                        collect(future.result())
+                    except Exception as e:
+                        # Worker chết (vd dlib crash) -> cả chunk tính là lỗi, lần load sau sẽ thử lại
+                        collect([(path, None, f'worker lỗi: {e}') for path in futures[future]])
+    finally:
+        if progress is not None:
+            progress.finish()
+    return encodings, errors
+
+
+def build_gallery(dataset_dir, workers=0, chunk_size=8, progress=None):
+    """Encode toàn bộ dataset, trả về (tên, mean encoding mỗi người, dict path -> encoding, dict path -> lỗi)"""
+    images = scan_dataset(dataset_dir)
+    encodings, errors = encode_images([path for _, path in images], workers, chunk_size, progress)
+
+    per_person = {}
+    for person_name, path in images:
+        if encodings.get(path) is not None:
+            per_person.setdefault(person_name, []).append(encodings[path])
+    names = list(per_person)
+    mean_encodings = [np.mean(per_person[name], axis=0) for name in names]
+    return names, mean_encodings, encodings, errors
+
+
+def main():
+    from embedding_store import EmbeddingStore
+
+    parser = argparse.ArgumentParser(description='Build embedding cache của dataset bằng nhiều process')
+    parser.add_argument('--dataset', default='dataset')
+    parser.add_argument('--workers', type=int, default=0, help='Số process (0 = số CPU core)')
+    parser.add_argument('--chunk-size', type=int, default=8, help='Số ảnh mỗi lần giao cho 1 worker')
+    parser.add_argument('--cache', default=None, help='File embedding cache (mặc định <dataset>/.embeddings_cache.sqlite3)')
+    parser.add_argument('--rebuild', action='store_true', help='Encode lại cả ảnh đã có trong cache')
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.cache or os.path.join(args.dataset, '.embeddings_cache.sqlite3'))
+    cached = {} if args.rebuild else store.load_all()
+    images = scan_dataset(args.dataset)
+    person_of = dict((path, person_name) for person_name, path in images)
+    pending = [
+        path for _, path in images
+        if not (path in cached and cached[path][0] == person_of[path]
+                and cached[path][1:3] == EmbeddingStore.file_key(path))
+    ]
+    print(f"📂 {len(images)} ảnh, {len(images) - len(pending)} đã có trong cache, encode {len(pending)} ảnh")
+
+    progress = BuildProgress()
+    result = {}
+
+    def run():
+        result['encodings'], result['errors'] = encode_images(pending, args.workers, args.chunk_size, progress)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    while thread.is_alive():
+        thread.join(1.0)
+        snap = progress.snapshot()
+        if snap['state'] != 'idle':
+            eta = f"~{snap['eta']}s" if snap['eta'] is not None else '?'
+            print(f"\r🔄 {snap['done']}/{snap['total']} ({snap['percent']}%) - "
+                  f"{snap['images_per_sec']} ảnh/s, còn {eta}   ", end='', flush=True)
+    print()
+
+    rows = [
+        (path, person_of[path], *EmbeddingStore.file_key(path), encoding)
+        for path, encoding in result['encodings'].items()
+    ]
+    store.put_many(rows)
+    for path, error in result['errors'].items():
+        print(f"⚠️ Lỗi khi load {path}: {error}")
+
+    snap = progress.snapshot()
+    print(f"✅ Encode xong {snap['done']} ảnh trong {snap['elapsed']}s ({snap['images_per_sec']} ảnh/s, "
+          f"{snap['workers']} worker): {snap['encoded']} có mặt, {snap['no_face']} không có mặt, {snap['errors']} lỗi")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Realtime Stream - Kênh WebSocket nhận diện realtime giữa browser và gateway
+Browser gửi frame binary: 4 byte frame_id (big-endian) + ảnh JPEG
+Gateway luôn xử lý frame MỚI NHẤT, frame cũ chưa kịp xử lý bị bỏ qua,
+kết quả được đẩy ngược lại dạng JSON kèm frame_id
+"""
+import asyncio
+import json
+import struct
+import threading
+
+FRAME_HEADER = struct.Struct('>I')
+
+
+class LatestFrameSlot:
+    """Giữ đúng 1 frame chờ xử lý: frame mới ghi đè frame cũ (frame cũ bị drop)"""
+
+    def __init__(self):
+        self._frame = None
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+        self._cond = threading.Condition()
+
+    def put(self, frame_id, data):
+        with self._cond:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = (frame_id, data)
+            self.received += 1
+            self._cond.notify()
+
+    def get(self):
+        """Chờ frame tiếp theo; trả về None khi kết nối đã đóng"""
+        with self._cond:
+            while self._frame is None and not self._closed:
+                self._cond.wait()
+            frame, self._frame = self._frame, None
+            return frame
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+def parse_frame_message(message):
+    """Tách (frame_id, jpeg_bytes) từ message binary; None nếu message không hợp lệ"""
+    if not isinstance(message, (bytes, bytearray)) or len(message) <= FRAME_HEADER.size:
+        return None
+    frame_id = FRAME_HEADER.unpack_from(message)[0]
+    return frame_id, memoryview(message)[FRAME_HEADER.size:]
+
+
+def run_recognition_stream(ws, process_frame):
+    """
+    Chạy 1 phiên streaming cho tới khi browser đóng kết nối.
+    process_frame(jpeg_bytes) -> dict kết quả (giống response của /recognize)
+    """
+    slot = LatestFrameSlot()
+
+    def reader():
+        try:
+            while True:
+                parsed = parse_frame_message(ws.receive())
+                if parsed is not None:
+                    slot.put(*parsed)
+        except Exception:
+            pass  # Browser đóng kết nối
+        finally:
+            slot.close()
+
+    threading.Thread(target=reader, daemon=True, name='ws-frame-reader').start()
+
+    while True:
+        frame = slot.get()
+        if frame is None:
+            break
+        frame_id, data = frame
+        try:
+            result = process_frame(bytes(data))
+        except Exception as e:
+            # Lỗi của 1 frame không được đóng cả phiên streaming
+            result = {'success': False, 'error': f'Lỗi xử lý frame: {str(e)}'}
+        result['frame_id'] = frame_id
+        result['dropped_frames'] = slot.dropped
+        try:
+            ws.send(json.dumps(result))
+        except Exception:
+            break
+    slot.close()
+
+
+class AsyncLatestFrameSlot:
+    """LatestFrameSlot cho asyncio (gateway async): chờ frame không chiếm thread"""
+
+    def __init__(self):
+        self._frame = None
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+        self._event = asyncio.Event()
+
+    def put(self, frame_id, data):
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = (frame_id, data)
+        self.received += 1
+        self._event.set()
+
+    async def get(self):
+        """Chờ frame tiếp theo; trả về None khi kết nối đã đóng"""
+        while self._frame is None and not self._closed:
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+
+async def run_recognition_stream_async(receive, send, process_frame):
+    """
+    Phiên streaming trên asyncio, cùng giao thức với run_recognition_stream.
+    receive() -> message tiếp theo (None khi browser đóng kết nối), send(text), process_frame(jpeg_bytes) -> dict
+    (đều là coroutine).
+    """
+    slot = AsyncLatestFrameSlot()
+
+    async def reader():
+        try:
+            while True:
+                message = await receive()
+                if message is None:
+                    break
+                parsed = parse_frame_message(message)
+                if parsed is not None:
+                    slot.put(*parsed)
+        except Exception:
+            pass  # Browser đóng kết nối
+        finally:
+            slot.close()
+
+    reader_task = asyncio.create_task(reader())
+    try:
+        while True:
+            frame = await slot.get()
+            if frame is None:
+                break
+            frame_id, data = frame
+            try:
+                result = await process_frame(bytes(data))
+            except Exception as e:
+                # Lỗi của 1 frame không được đóng cả phiên streaming
+                result = {'success': False, 'error': f'Lỗi xử lý frame: {str(e)}'}
+            result['frame_id'] = frame_id
+            result['dropped_frames'] = slot.dropped
+            try:
+                await send(json.dumps(result))
+            except Exception:
+                break
+    finally:
+        slot.close()
+        reader_task.cancel()
@@ -0,0 +1,124 @@
+"""
+Service Client - HTTP client keep-alive có connection pool cho gateway -> service
+Mỗi backend có 1 Session riêng: giới hạn số kết nối, timeout connect/read, retry khi không kết nối được
+và thống kê pool (đang dùng, số lần phải chờ, số kết nối mở mới) để tinh chỉnh khi chịu tải
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class PoolTimeout(requests.exceptions.Timeout):
+    """Hết thời gian chờ lấy kết nối rảnh trong pool"""
+
+
+class ServiceClient:
+    """Client keep-alive cho 1 backend"""
+
+    def __init__(self, base_url, pool_size=20, connect_timeout=2, read_timeout=30,
+                 max_retries=2, backoff_factor=0.1, pool_timeout=5):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_timeout = pool_timeout
+
+        # Chỉ retry lỗi kết nối (request chưa được gửi đi) - an toàn cho cả POST
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=0,
+            other=0,
+            backoff_factor=backoff_factor,
+            raise_on_status=False
+        )
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+
+        # Giới hạn số request đồng thời = kích thước pool, đếm số lần phải chờ
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'in_use': 0,
+            'max_in_use': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'pool_timeouts': 0,
+            'errors': 0
+        }
+
+    def _acquire(self):
+        if self._slots.acquire(blocking=False):
+            return
+        start = time.time()
+        acquired = self._slots.acquire(timeout=self.pool_timeout)
+        with self._lock:
+            self._stats['waits'] += 1
+            self._stats['wait_time_total'] += time.time() - start
+            if not acquired:
+                self._stats['pool_timeouts'] += 1
+        if not acquired:
+            raise PoolTimeout(f'Không có kết nối rảnh tới {self.base_url} sau {self.pool_timeout}s')
+
+    def request(self, method, path, **kwargs):
+        """Gửi request qua pool - timeout mặc định (connect, read) nếu không truyền"""
+        kwargs.setdefault('timeout', self.timeout)
+        self._acquire()
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['in_use'] += 1
+            self._stats['max_in_use'] = max(self._stats['max_in_use'], self._stats['in_use'])
+        try:
+            return self.session.request(method, f'{self.base_url}{path}', **kwargs)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def _connection_stats(self):
+        """Đọc số kết nối đã mở / đang rảnh từ urllib3 pool"""
+        opened = 0
+        idle = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return opened, idle
+
+    def stats(self):
+        """Thống kê pool để tinh chỉnh pool_size khi chịu tải"""
+        opened, idle = self._connection_stats()
+        with self._lock:
+            stats = dict(self._stats)
+        stats['wait_time_total'] = round(stats['wait_time_total'], 3)
+        stats.update({
+            'url': self.base_url,
+            'pool_size': self.pool_size,
+            'idle_connections': idle,
+            'connections_opened': opened,
+            # Kết nối mở thêm vượt quá mức đồng thời cao nhất = kết nối keep-alive bị đóng và phải mở lại
+            'reconnects': max(0, opened - stats['max_in_use'])
+        })
+        return stats
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,205 @@
+"""
+Service Health - Theo dõi health các service ở background + circuit breaker cho gateway
+Gateway đọc trạng thái đã cache thay vì gọi /health trước mỗi request.
+Trạng thái lấy từ /readyz: ready (200), starting (503 - process sống nhưng đang load), failed, down (không kết nối được)
+"""
+import threading
+import time
+
+import requests
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker 3 trạng thái:
+    - closed:    bình thường, cho request đi qua
+    - open:      service lỗi liên tiếp -> từ chối ngay, không chờ timeout
+    - half_open: hết thời gian chờ -> cho 1 request thử, thành công thì đóng lại
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=10):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow_request(self):
+        """True nếu request được phép gửi tới service"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.time() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            # half_open: chỉ cho 1 request thử tại 1 thời điểm
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'opened_at': self._opened_at if self._state != self.CLOSED else None
+            }
+
+
+UNKNOWN = 'unknown'
+READY = 'ready'
+STARTING = 'starting'
+FAILED = 'failed'
+DOWN = 'down'
+
+
+class ServiceHealthMonitor:
+    """Poll /readyz (+ /health khi ready) của từng service theo chu kỳ trong thread nền và giữ trạng thái trong RAM"""
+
+    def __init__(self, services, interval=5, timeout=2, failure_threshold=3, reset_timeout=10, starting_interval=1):
+        self.services = dict(services)
+        self.interval = interval
+        # Service đang khởi động được poll dày hơn để request đang chờ được xử lý ngay khi ready
+        self.starting_interval = starting_interval
+        self.timeout = timeout
+        self.breakers = {
+            name: CircuitBreaker(failure_threshold, reset_timeout) for name in self.services
+        }
+        self._status = {
+            name: {'running': False, 'state': UNKNOWN, 'info': None, 'readiness': None,
+                   'last_check': None, 'latency': None}
+            for name in self.services
+        }
+        self._ready_events = {name: threading.Event() for name in self.services}
+        self._lock = threading.Lock()
+        self._started = False
+        self._stop_event = threading.Event()
+
+    def start(self):
+        """Khởi động thread poll (gọi nhiều lần cũng chỉ chạy 1 lần)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for name in self.services:
+            thread = threading.Thread(target=self._poll_loop, args=(name,), daemon=True,
+                                      name=f'health-monitor-{name}')
+            thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _poll_loop(self, name):
+        while not self._stop_event.is_set():
+            state = self.check_now(name)
+            self._stop_event.wait(self.starting_interval if state == STARTING else self.interval)
+
+    def _probe(self, url):
+        """Trả về (state, readiness, info) của 1 service"""
+        try:
+            response = requests.get(f'{url}/readyz', timeout=self.timeout)
+        except Exception as e:
+            return DOWN, None, str(e)
+
+        if response.status_code == 404:
+            # Service bản cũ chưa có /readyz -> /health trả lời được = ready
+            readiness = None
+            state = READY
+        else:
+            try:
+                readiness = response.json()
+            except ValueError:
+                return DOWN, None, f'HTTP {response.status_code}'
+            if response.status_code == 200:
+                state = READY
+            else:
+                state = FAILED if readiness.get('state') == FAILED else STARTING
+
+        info = None
+        if state == READY:
+            try:
+                health = requests.get(f'{url}/health', timeout=self.timeout)
+                info = health.json() if health.status_code == 200 else None
+            except Exception as e:
+                return DOWN, readiness, str(e)
+        return state, readiness, info
+
+    def check_now(self, name):
+        """Probe 1 service ngay lập tức, cập nhật trạng thái và trả về state"""
+        start = time.time()
+        state, readiness, info = self._probe(self.services[name])
+
+        with self._lock:
+            self._status[name] = {
+                # running = process đang sống (kể cả khi đang khởi động)
+                'running': state in (READY, STARTING, FAILED),
+                'state': state,
+                'info': info,
+                'readiness': readiness,
+                'last_check': time.time(),
+                'latency': round(time.time() - start, 3)
+            }
+        if state == READY:
+            self.breakers[name].record_success()
+            self._ready_events[name].set()
+        else:
+            self._ready_events[name].clear()
+            # Đang khởi động không phải lỗi: không mở circuit, gateway tự chờ / từ chối theo state
+            if state != STARTING:
+                self.breakers[name].record_failure()
+        return state
+
+    def get_state(self, name):
+        with self._lock:
+            return self._status[name]['state']
+
+    def wait_until_ready(self, name, timeout):
+        """Service đang khởi động -> chờ tối đa `timeout` giây cho tới khi ready; trả về state sau khi chờ"""
+        if self.get_state(name) == STARTING:
+            self._ready_events[name].wait(timeout)
+        return self.get_state(name)
+
+    def allow_request(self, name):
+        """Forwarding path hỏi trạng thái đã cache + circuit breaker (không gọi HTTP)"""
+        return self.breakers[name].allow_request()
+
+    def record_success(self, name):
+        self.breakers[name].record_success()
+
+    def record_failure(self, name):
+        self.breakers[name].record_failure()
+
+    def get_status(self, name):
+        """Trạng thái đã cache của 1 service, kèm trạng thái circuit breaker"""
+        with self._lock:
+            status = dict(self._status[name])
+        status['url'] = self.services[name]
+        status['circuit'] = self.breakers[name].snapshot()
+        return status
@@ -0,0 +1,153 @@
+"""
+Service Metrics - Thời gian từng bước xử lý (histogram) + trạng thái (gauge) của service, xuất ra /metrics
+theo định dạng text của Prometheus (scrape trực tiếp bằng Prometheus / Grafana Agent, không cần prometheus_client).
+processing_time trong response chỉ có tổng thời gian detect + encode; ở đây mỗi bước (decode, đổi màu, detect,
+landmark, encode, so khớp, từng model DeepFace, serialize JSON...) có histogram riêng để biết latency nằm ở đâu.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Giây: từ bước rất nhanh (so khớp gallery ~0.1ms) tới model chạy lần đầu (vài giây)
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Histogram:
+    """Histogram có label, thread-safe (số đếm theo bucket cộng dồn như Prometheus)"""
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [counts theo bucket, sum, count]
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for label_values in sorted(series):
+            counts, total, count = series[label_values]
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.label_names, label_values, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {bucket_count}')
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class ServiceMetrics:
+    """
+    Metrics của 1 service (tên metric có prefix là tên service):
+    - <service>_stage_duration_seconds{stage}: thời gian từng bước
+    - <service>_request_duration_seconds{endpoint} + <service>_requests_total{endpoint,status}
+    - <service>_requests_in_flight
+    - các gauge đăng ký qua add_gauge (đọc giá trị lúc scrape: queue depth, gallery size...)
+    """
+
+    def __init__(self, service_name):
+        self.prefix = service_name
+        self.stage_seconds = Histogram(f'{service_name}_stage_duration_seconds',
+                                       'Thời gian từng bước xử lý (giây)', ('stage',))
+        self.request_seconds = Histogram(f'{service_name}_request_duration_seconds',
+                                         'Thời gian xử lý request trong service (giây)', ('endpoint',))
+        self._lock = threading.Lock()
+        self._requests_total = {}
+        self._in_flight = {}  # endpoint -> số request đang xử lý
+        self._gauges = []
+
+    @contextmanager
+    def stage(self, name):
+        """Đo 1 bước: with metrics.stage('detect'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - start, name)
+
+    def observe_stage(self, name, seconds):
+        self.stage_seconds.observe(seconds, name)
+
+    def request_started(self, endpoint):
+        with self._lock:
+            self._in_flight[endpoint] = self._in_flight.get(endpoint, 0) + 1
+        return time.perf_counter()
+
+    def request_finished(self, started, endpoint, status):
+        self.request_seconds.observe(time.perf_counter() - started, endpoint)
+        with self._lock:
+            self._in_flight[endpoint] -= 1
+            key = (endpoint, str(status))
+            self._requests_total[key] = self._requests_total.get(key, 0) + 1
+
+    def in_flight(self, endpoints=None):
+        """Số request đang xử lý (chỉ tính các endpoint trong endpoints nếu có)"""
+        with self._lock:
+            if endpoints is None:
+                return sum(self._in_flight.values())
+            return sum(self._in_flight.get(endpoint, 0) for endpoint in endpoints)
+
+    def add_gauge(self, name, help_text, value_fn):
+        """Gauge đọc giá trị lúc scrape; value_fn() trả về số (lỗi -> bỏ qua gauge đó trong lần scrape)"""
+        self._gauges.append((f'{self.prefix}_{name}', help_text, value_fn))
+
+    def render(self):
+        """Toàn bộ metrics dạng text Prometheus (exposition format 0.0.4)"""
+        lines = []
+        lines.extend(self.stage_seconds.render())
+        lines.extend(self.request_seconds.render())
+
+        with self._lock:
+            requests_total = dict(self._requests_total)
+            in_flight = sum(self._in_flight.values())
+        name = f'{self.prefix}_requests_total'
+        lines.extend([f'# HELP {name} Số request đã xử lý', f'# TYPE {name} counter'])
+        for (endpoint, status), count in sorted(requests_total.items()):
+            lines.append(f'{name}{_format_labels(("endpoint", "status"), (endpoint, status))} {count}')
+
+        name = f'{self.prefix}_requests_in_flight'
+        lines.extend([f'# HELP {name} Số request đang xử lý', f'# TYPE {name} gauge', f'{name} {in_flight}'])
+
+        for name, help_text, value_fn in self._gauges:
+            try:
+                value = value_fn()
+            except Exception:
+                continue
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {_format_value(value)}'])
+        return '\n'.join(lines) + '\n'
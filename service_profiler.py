@@ -0,0 +1,330 @@
+"""
+Service Profiler - Bật cProfile theo yêu cầu cho hot path (/recognize, /analyze) mà không cần restart service
+- Tắt: mỗi request chỉ tốn 1 lần đọc thuộc tính (profiler.active), không gắn hook profile nào
+- Bật qua POST /admin/profile/start: profile 1/N request trong 1 khoảng thời gian (hoặc tới khi đủ số mẫu),
+  cộng dồn thống kê theo hàm rồi ghi ra file .prof (định dạng pstats / marshal) để tải về
+  qua GET /admin/profile/dumps/<tên file> (mở bằng snakeviz, `python -m pstats`...)
+- Chỉ profile 1 request tại 1 thời điểm (request mẫu khác đang chạy -> bỏ qua), vì từ Python 3.12 cProfile
+  dùng sys.monitoring chung cho cả process và không cho 2 profiler chạy cùng lúc
+Các endpoint /admin/* cần header X-Admin-Token khớp biến môi trường ADMIN_TOKEN; không đặt ADMIN_TOKEN thì
+chỉ chấp nhận request từ localhost.
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+
+from flask import g, jsonify, request, send_file, Response
+
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'face_recognition_profiles')
+PROFILE_MAX_DUMPS = int(os.environ.get('PROFILE_MAX_DUMPS', '20'))  # giữ N file mới nhất mỗi service
+PROFILE_MAX_DURATION = 600.0  # giây, giới hạn 1 phiên để không quên tắt
+
+DEFAULT_SAMPLE_EVERY = 10
+DEFAULT_DURATION = 30.0
+DEFAULT_MAX_SAMPLES = 200
+TOP_FUNCTIONS = 25
+
+LOCAL_ADDRS = ('127.0.0.1', '::1', 'localhost')
+_DUMP_NAME = re.compile(r'^[A-Za-z0-9_.-]+\.prof$')
+
+
+def is_admin_request(request):
+    """ADMIN_TOKEN có đặt -> so khớp header X-Admin-Token; không đặt -> chỉ cho phép localhost"""
+    if ADMIN_TOKEN:
+        token = request.headers.get('X-Admin-Token', '')
+        return hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+    return request.remote_addr in LOCAL_ADDRS
+
+
+def top_functions(stats, limit=TOP_FUNCTIONS, sort='cumulative'):
+    """Các hàm tốn thời gian nhất trong pstats.Stats (dạng dict để trả JSON)"""
+    index = 3 if sort == 'cumulative' else 2  # (cc, nc, tottime, cumtime, callers)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][index], reverse=True)[:limit]
+    return [{
+        'function': pstats.func_std_string(func),
+        'calls': nc,
+        'primitive_calls': cc,
+        'tottime': round(tt, 6),
+        'cumtime': round(ct, 6)
+    } for func, (cc, nc, tt, ct, _) in rows]
+
+
+class RequestProfiler:
+    """
+    Profile có lấy mẫu cho các request của 1 service. Dùng với Flask:
+        before_request -> profiler.maybe_start(path) (trả về Profile hoặc None)
+        teardown_request -> profiler.finish(profile, path)
+    """
+
+    def __init__(self, service_name, paths, dump_dir=PROFILE_DIR, max_dumps=PROFILE_MAX_DUMPS):
+        self.service_name = service_name
+        self.paths = tuple(paths)  # Các path được phép lấy mẫu (hot path)
+        self.dump_dir = dump_dir
+        self.max_dumps = max_dumps
+        self.active = False  # Đọc không cần lock ở mỗi request: tắt thì gần như không tốn gì
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()  # Chỉ 1 request được profile tại 1 thời điểm
+        self._timer = None
+        self._session = None
+        self._sampling_session = None  # Phiên của request đang được profile (giữ _busy)
+        self._last_result = None
+
+    def start(self, sample_every=DEFAULT_SAMPLE_EVERY, duration=DEFAULT_DURATION, max_samples=DEFAULT_MAX_SAMPLES):
+        """Bắt đầu phiên profile mới (phiên cũ đang chạy được kết thúc và ghi file trước)"""
+        sample_every = int(sample_every)
+        duration = float(duration)
+        max_samples = int(max_samples)
+        if sample_every < 1 or max_samples < 1:
+            raise ValueError('sample_every và max_samples phải >= 1')
+        if not 0 < duration <= PROFILE_MAX_DURATION:
+            raise ValueError(f'duration phải trong khoảng (0, {PROFILE_MAX_DURATION:.0f}] giây')
+
+        self.stop()
+        with self._lock:
+            now = time.time()
+            self._session = {
+                'started_at': now,
+                'deadline': now + duration,
+                'sample_every': sample_every,
+                'max_samples': max_samples,
+                'seen': 0,
+                'sampled': 0,
+                'skipped_busy': 0,
+                'per_path': {},
+                'stats': None
+            }
+            self._timer = threading.Timer(duration, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+            self.active = True
+        print(f"🔬 [{self.service_name}] Bật profile: 1/{sample_every} request, {duration:.0f}s, "
+              f"tối đa {max_samples} mẫu")
+        return self.status()
+
+    def stop(self):
+        """Kết thúc phiên hiện tại, ghi thống kê cộng dồn ra file .prof; trả về kết quả phiên (None nếu không có)"""
+        with self._lock:
+            session, self._session = self._session, None
+            self.active = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if session is None:
+            return None
+        # Chờ request mẫu đang chạy (nếu có) cộng xong vào session
+        with self._busy:
+            pass
+
+        result = {
+            'started_at': session['started_at'],
+            'duration': round(time.time() - session['started_at'], 2),
+            'sample_every': session['sample_every'],
+            'requests_seen': session['seen'],
+            'requests_sampled': session['sampled'],
+            'skipped_busy': session['skipped_busy'],
+            'per_path': dict(session['per_path']),
+            'dump': None,
+            'top_functions': []
+        }
+        stats = session['stats']
+        if stats is not None:
+            result['dump'] = self._write_dump(stats, session['started_at'])
+            result['top_functions'] = top_functions(stats)
+        with self._lock:
+            self._last_result = result
+        print(f"🔬 [{self.service_name}] Tắt profile: {session['sampled']} mẫu"
+              + (f" -> {result['dump']}" if result['dump'] else ''))
+        return result
+
+    def maybe_start(self, path):
+        """Gọi đầu request: trả về cProfile.Profile đã enable nếu request này được lấy mẫu"""
+        if not self.active or path not in self.paths:
+            return None
+        with self._lock:
+            session = self._session
+            if session is None:
+                return None
+            if time.time() >= session['deadline'] or session['sampled'] >= session['max_samples']:
+                # Timer có thể chậm hơn deadline một chút; dừng ở thread riêng để không chặn request
+                threading.Thread(target=self.stop, daemon=True).start()
+                self.active = False
+                return None
+            session['seen'] += 1
+            if session['seen'] % session['sample_every'] != 0:
+                return None
+            if not self._busy.acquire(blocking=False):
+                session['skipped_busy'] += 1
+                return None
+            self._sampling_session = session
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Đã có profiler khác chạy trong process (vd service đang chạy dưới cProfile)
+            self._sampling_session = None
+            self._busy.release()
+            return None
+        return profile
+
+    def finish(self, profile, path):
+        """Gọi cuối request (teardown): tắt profile và cộng dồn vào phiên đã lấy mẫu request này"""
+        profile.disable()
+        try:
+            with self._lock:
+                session, self._sampling_session = self._sampling_session, None
+                if session is None:
+                    return
+                if session['stats'] is None:
+                    session['stats'] = pstats.Stats(profile)
+                else:
+                    session['stats'].add(profile)
+                session['sampled'] += 1
+                session['per_path'][path] = session['per_path'].get(path, 0) + 1
+        finally:
+            self._busy.release()
+
+    def status(self):
+        with self._lock:
+            session = self._session
+            payload = {
+                'service': self.service_name,
+                'active': session is not None,
+                'paths': list(self.paths),
+                'dump_dir': self.dump_dir,
+                'dumps': self.list_dumps(),
+                'last_session': self._last_result
+            }
+            if session is not None:
+                payload['session'] = {
+                    'sample_every': session['sample_every'],
+                    'max_samples': session['max_samples'],
+                    'remaining': round(max(0.0, session['deadline'] - time.time()), 2),
+                    'requests_seen': session['seen'],
+                    'requests_sampled': session['sampled'],
+                    'skipped_busy': session['skipped_busy']
+                }
+        return payload
+
+    def list_dumps(self):
+        if not os.path.isdir(self.dump_dir):
+            return []
+        prefix = f'{self.service_name}_'
+        names = sorted(name for name in os.listdir(self.dump_dir)
+                       if name.startswith(prefix) and name.endswith('.prof'))
+        return [{'name': name, 'size': os.path.getsize(os.path.join(self.dump_dir, name))}
+                for name in reversed(names)]
+
+    def dump_path(self, name):
+        """Đường dẫn file dump của service này; None nếu tên không hợp lệ hoặc không tồn tại"""
+        if not _DUMP_NAME.match(name) or not name.startswith(f'{self.service_name}_'):
+            return None
+        path = os.path.join(self.dump_dir, name)
+        return path if os.path.isfile(path) else None
+
+    def render_text(self, name, sort='cumulative', limit=50):
+        """Bảng pstats dạng text của 1 file dump (xem nhanh không cần tải về)"""
+        path = self.dump_path(name)
+        if path is None:
+            return None
+        output = io.StringIO()
+        stats = pstats.Stats(path, stream=output)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def _write_dump(self, stats, started_at):
+        os.makedirs(self.dump_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(started_at))
+        name = f'{self.service_name}_{stamp}_{int(started_at * 1000) % 1000:03d}.prof'
+        stats.dump_stats(os.path.join(self.dump_dir, name))
+        # Xóa file cũ, giữ max_dumps file mới nhất
+        for old in self.list_dumps()[self.max_dumps:]:
+            try:
+                os.remove(os.path.join(self.dump_dir, old['name']))
+            except OSError:
+                pass
+        return name
+
+
+def install_profiler(app, profiler):
+    """
+    Gắn profiler vào Flask app: hook lấy mẫu + các endpoint admin
+        POST /admin/profile/start   {"sample_every": 10, "duration": 30, "max_samples": 200}
+        POST /admin/profile/stop    -> kết quả phiên (file dump + hàm tốn thời gian nhất)
+        GET  /admin/profile         -> trạng thái + danh sách file dump
+        GET  /admin/profile/dumps/<name>[?format=text&sort=tottime]
+    Gọi sau khi đăng ký reject_until_ready để request bị từ chối lúc khởi động không bị lấy mẫu.
+    """
+
+    @app.before_request
+    def start_request_profile():
+        if profiler.active:
+            profile = profiler.maybe_start(request.path)
+            if profile is not None:
+                g.request_profile = profile
+
+    @app.teardown_request
+    def finish_request_profile(error=None):
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            profiler.finish(profile, request.path)
+
+    def forbidden():
+        return jsonify({'success': False, 'error': 'Không có quyền truy cập endpoint admin'}), 403
+
+    @app.route('/admin/profile', methods=['GET'])
+    def profile_status():
+        """Trạng thái profiler + danh sách file dump"""
+        if not is_admin_request(request):
+            return forbidden()
+        return jsonify({'success': True, **profiler.status()})
+
+    @app.route('/admin/profile/start', methods=['POST'])
+    def profile_start():
+        """Bật profile lấy mẫu 1/N request của hot path trong 1 khoảng thời gian"""
+        if not is_admin_request(request):
+            return forbidden()
+        data = request.get_json(silent=True) or {}
+        try:
+            status = profiler.start(
+                sample_every=data.get('sample_every', request.args.get('sample_every', DEFAULT_SAMPLE_EVERY)),
+                duration=data.get('duration', request.args.get('duration', DEFAULT_DURATION)),
+                max_samples=data.get('max_samples', request.args.get('max_samples', DEFAULT_MAX_SAMPLES))
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': f'Tham số không hợp lệ: {str(e)}'}), 400
+        return jsonify({'success': True, **status})
+
+    @app.route('/admin/profile/stop', methods=['POST'])
+    def profile_stop():
+        """Dừng phiên hiện tại và ghi file dump"""
+        if not is_admin_request(request):
+            return forbidden()
+        result = profiler.stop()
+        if result is None:
+            return jsonify({'success': False, 'error': 'Không có phiên profile nào đang chạy'}), 409
+        return jsonify({'success': True, 'result': result})
+
+    @app.route('/admin/profile/dumps/<name>', methods=['GET'])
+    def profile_dump(name):
+        """Tải file .prof (mặc định) hoặc xem bảng pstats dạng text (?format=text)"""
+        if not is_admin_request(request):
+            return forbidden()
+        if request.args.get('format') == 'text':
+            sort = request.args.get('sort', 'cumulative')
+            if sort not in ('cumulative', 'tottime', 'calls'):
+                return jsonify({'success': False, 'error': 'sort phải là cumulative, tottime hoặc calls'}), 400
+            text = profiler.render_text(name, sort=sort, limit=request.args.get('limit', 50, type=int))
+            if text is None:
+                return jsonify({'success': False, 'error': 'Không tìm thấy file dump'}), 404
+            return Response(text, content_type='text/plain; charset=utf-8')
+        path = profiler.dump_path(name)
+        if path is None:
+            return jsonify({'success': False, 'error': 'Không tìm thấy file dump'}), 404
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=name)
@@ -0,0 +1,112 @@
+"""
+Service Readiness - Trạng thái khởi động của service (liveness vs readiness)
+Service mở port ngay, load gallery / model trong thread nền:
+- /livez:  process còn sống và nhận request (luôn 200)
+- /readyz: đã load xong và xử lý được request (200) hay đang khởi động / lỗi (503), kèm tiến độ
+Các endpoint xử lý ảnh trả 503 + Retry-After cho tới khi ready.
+"""
+import threading
+import time
+import traceback
+
+STARTING = 'starting'
+READY = 'ready'
+FAILED = 'failed'
+
+# Đường dẫn luôn trả lời kể cả khi service chưa ready
+PROBE_PATHS = ('/livez', '/readyz', '/health')
+
+
+class ServiceReadiness:
+    """
+    Mặc định là ready (module được import trực tiếp, vd benchmark: load lười như trước);
+    start_background() chuyển sang starting và chạy hàm load trong thread nền.
+    """
+
+    def __init__(self, service_name, progress_fn=None):
+        self.service_name = service_name
+        self._progress_fn = progress_fn  # Hàm trả về dict tiến độ chi tiết (vd gallery_build, model đã load)
+        self._lock = threading.Lock()
+        self._state = READY
+        self._stage = None
+        self._error = None
+        self._process_started_at = time.time()
+        self._started_at = None
+        self._ready_at = None
+
+    @property
+    def ready(self):
+        with self._lock:
+            return self._state == READY
+
+    def set_stage(self, stage):
+        """Bước khởi động hiện tại (hiện trong /readyz)"""
+        with self._lock:
+            self._stage = stage
+        print(f"⏳ [{self.service_name}] {stage}...")
+
+    def start_background(self, load_fn):
+        """Chạy load_fn trong thread nền; xong -> ready, lỗi -> failed (service vẫn sống, /readyz báo lỗi)"""
+        with self._lock:
+            self._state = STARTING
+            self._started_at = time.time()
+            self._ready_at = None
+            self._error = None
+
+        def run():
+            try:
+                load_fn()
+            except Exception as e:
+                traceback.print_exc()
+                with self._lock:
+                    self._state = FAILED
+                    self._error = str(e)
+                print(f"❌ [{self.service_name}] Khởi động thất bại: {str(e)}")
+                return
+            with self._lock:
+                self._state = READY
+                self._stage = None
+                self._ready_at = time.time()
+            print(f"✅ [{self.service_name}] Sẵn sàng sau {self._ready_at - self._started_at:.2f}s")
+
+        thread = threading.Thread(target=run, daemon=True, name=f'{self.service_name}-startup')
+        thread.start()
+        return thread
+
+    def livez(self):
+        return {
+            'status': 'alive',
+            'service': self.service_name,
+            'uptime': round(time.time() - self._process_started_at, 2)
+        }
+
+    def readyz(self):
+        """(payload, HTTP status) cho /readyz"""
+        with self._lock:
+            payload = {
+                'ready': self._state == READY,
+                'state': self._state,
+                'service': self.service_name,
+                'stage': self._stage,
+                'error': self._error
+            }
+            if self._started_at is not None:
+                end = self._ready_at or time.time()
+                payload['startup_time'] = round(end - self._started_at, 2)
+        if self._progress_fn is not None:
+            payload['progress'] = self._progress_fn()
+        return payload, 200 if payload['ready'] else 503
+
+    def not_ready_response(self):
+        """(payload, HTTP status, headers) cho request xử lý ảnh tới khi service chưa ready"""
+        payload, _ = self.readyz()
+        if payload['state'] == FAILED:
+            message = f'Service khởi động thất bại: {payload["error"]}'
+        else:
+            message = 'Service đang khởi động, vui lòng thử lại sau ít giây'
+        return {
+            'success': False,
+            'starting': payload['state'] == STARTING,
+            'error': message,
+            'readiness': payload
+        }, 503, {'Retry-After': '2'}
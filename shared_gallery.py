@@ -0,0 +1,125 @@
+"""
+Shared Gallery - Gallery dùng chung giữa các process worker qua file memory-mapped
+Process chính ghi mỗi phiên bản gallery thành 1 cặp file (ma trận float32 .npy + bảng tên .json) theo số version;
+worker map ma trận copy-on-write (zero-copy, các process dùng chung page cache của OS) thay vì mỗi worker
+giữ 1 bản sao. Reload = ghi version mới rồi gửi cho worker chuyển sang (đổi tham chiếu gallery, không khóa),
+version cũ bị xóa khi mọi worker đã chuyển.
+File ma trận có sẵn hàng trống dự phòng: đăng ký / xóa người chỉ gửi (tên, vector) cho worker, worker ghi vào
+bản map của mình (chỉ page bị sửa được copy riêng). Hết hàng dự phòng mới ghi version mới (dự phòng gấp đôi
+mỗi lần -> amortized O(1) mỗi lần đăng ký). Centroid của ANN index (nếu có) được ghi kèm version.
+Tên file có pid của process ghi và mỗi writer chỉ xóa file do chính nó tạo: 2 service (hoặc service cũ còn
+đang tắt khi restart) dùng chung thư mục cũng không xóa file mà worker của nhau đang map.
+"""
+import atexit
+import itertools
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from face_gallery import FaceGallery
+
+_writer_ids = itertools.count(1)
+
+# Số hàng dự phòng tối thiểu mỗi version (thực tế = max(SPARE_ROWS, số người hiện tại))
+SPARE_ROWS = 1024
+
+
+class SharedGalleryWriter:
+    """Phía process chính: ghi các version gallery vào thư mục dùng chung"""
+
+    def __init__(self, directory=None):
+        """directory=None -> thư mục tạm riêng của process (mkdtemp), xóa khi thoát"""
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='face_recognition_gallery_')
+            self._owns_directory = True
+        else:
+            self._owns_directory = not os.path.isdir(directory)
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.version = 0
+        self._prefix = f'gallery_{os.getpid()}_{next(_writer_ids)}'
+        self._created = {}  # version -> các file đã ghi (chỉ xóa file của writer này)
+        atexit.register(self.close)
+
+    def _paths(self, version):
+        base = os.path.join(self.directory, f'{self._prefix}_v{version:06d}')
+        return base + '.npy', base + '.json'
+
+    def publish(self, names, matrix, centroids=None):
+        """Ghi 1 version mới (kèm hàng dự phòng + centroid nếu có), trả về descriptor để worker map"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        count, dim = matrix.shape
+        capacity = count + max(SPARE_ROWS, count)
+        self.version += 1
+        matrix_path, names_path = self._paths(self.version)
+        files = [matrix_path, names_path]
+
+        # Ghi file tạm rồi rename: worker không bao giờ thấy file ghi dở
+        out = np.lib.format.open_memmap(matrix_path + '.tmp.npy', mode='w+', dtype=np.float32, shape=(capacity, dim))
+        out[:count] = matrix
+        out.flush()
+        del out
+        os.replace(matrix_path + '.tmp.npy', matrix_path)
+        with open(names_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(list(names), f, ensure_ascii=False)
+        os.replace(names_path + '.tmp', names_path)
+
+        centroids_path = None
+        if centroids is not None:
+            centroids_path = matrix_path[:-len('.npy')] + '.centroids.npy'
+            np.save(centroids_path + '.tmp.npy', np.asarray(centroids, dtype=np.float32))
+            os.replace(centroids_path + '.tmp.npy', centroids_path)
+            files.append(centroids_path)
+        self._created[self.version] = files
+
+        return {
+            'version': self.version,
+            'matrix_path': matrix_path,
+            'names_path': names_path,
+            'centroids_path': centroids_path,
+            'count': int(count),
+            'capacity': int(capacity),
+            'dim': int(dim)
+        }
+
+    def release_older(self, version):
+        """Xóa các version cũ hơn `version` (Windows không cho xóa file còn đang map -> bỏ qua, xóa ở lần sau)"""
+        for file_version in [v for v in self._created if v < version]:
+            remaining = []
+            for path in self._created[file_version]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    remaining.append(path)
+            if remaining:
+                self._created[file_version] = remaining
+            else:
+                del self._created[file_version]
+
+    def close(self):
+        """Xóa mọi file do writer này tạo (và thư mục nếu chính writer tạo ra và đã trống)"""
+        self.release_older(float('inf'))
+        if self._owns_directory:
+            try:
+                os.rmdir(self.directory)
+            except OSError:
+                pass
+
+
+def attach_shared_gallery(descriptor, ann_index=None):
+    """
+    Phía worker: map version gallery copy-on-write, không copy ma trận.
+    ann_index là bản sao chỉ dùng centroid do process chính train (không tự train, không ghi file).
+    """
+    with open(descriptor['names_path'], encoding='utf-8') as f:
+        names = json.load(f)
+    matrix = np.load(descriptor['matrix_path'], mmap_mode='c')
+    gallery = FaceGallery.from_shared(names, matrix)
+    if ann_index is not None:
+        centroids = np.load(descriptor['centroids_path']) if descriptor.get('centroids_path') else None
+        gallery.attach_index(ann_index.as_replica(), centroids=centroids)
+    return gallery
@@ -29,7 +29,8 @@ echo.
 echo ================================================================
 echo HOAN THANH! Tat ca services dang khoi dong...
 echo.
-echo Vui long cho 30-60 giay de cac services load models.
+echo Services mo port ngay, load gallery / models trong nen (30-60 giay).
+echo Kiem tra: http://localhost:5001/readyz va http://localhost:5002/readyz
 echo.
 echo Cac cua so terminal:
 echo   - Face Recognition Service (port 5001)
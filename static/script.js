@@ -1,7 +1,8 @@
 // Global variables
 let registerStream = null;
 let recognizeStream = null;
-let deepfaceImageData = null; // Store uploaded/pasted image
+let deepfaceImageData = null; // Store uploaded/pasted image (data URL để preview)
+let deepfaceImageBlob = null; // File/Blob gốc - gửi binary lên server
 
 // Initialize on page load
 document.addEventListener('DOMContentLoaded', function() {
@@ -129,6 +130,19 @@ async function setupEnvironment(envName) {
     }
 }
 
+// Chuyển canvas thành Blob JPEG (gửi binary thay vì base64 data URL)
+function canvasToBlob(canvas, type = 'image/jpeg', quality = 0.92) {
+    return new Promise((resolve, reject) => {
+        canvas.toBlob(blob => {
+            if (blob) {
+                resolve(blob);
+            } else {
+                reject(new Error('Không thể chụp ảnh từ camera'));
+            }
+        }, type, quality);
+    });
+}
+
 // Loading Overlay
 function showLoading(text) {
     const overlay = document.getElementById('loading-overlay');
@@ -183,20 +197,17 @@ async function captureRegister() {
     canvas.height = video.videoHeight;
     ctx.drawImage(video, 0, 0);
     
-    const imageData = canvas.toDataURL('image/jpeg');
-    
     showLoading('Đang lưu ảnh...');
     
     try {
+        const imageBlob = await canvasToBlob(canvas);
+        const formData = new FormData();
+        formData.append('name', name);
+        formData.append('image', imageBlob, 'capture.jpg');
+        
         const response = await fetch('/api/face-recognition/register', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                name: name,
-                image: imageData
-            })
+            body: formData
         });
         
         const data = await response.json();
@@ -297,33 +308,136 @@ function stopRecognizeCamera() {
     resultDiv.innerHTML = '';
 }
 
+// Realtime streaming qua WebSocket: chỉ gửi frame tiếp theo khi đã nhận kết quả frame trước,
+// nên tốc độ tự điều chỉnh theo thời gian xử lý thực tế của server (không dùng timer cố định)
+const MIN_FRAME_INTERVAL_MS = 100; // Giới hạn tối đa ~10 frame/giây
+const HTTP_FRAME_INTERVAL_MS = 1500; // Chu kỳ khi phải fallback về HTTP
+const STALE_REPLY_WAIT_MS = 1000; // Nhận kết quả frame cũ: chờ kết quả frame đang gửi tối đa chừng này rồi gửi frame mới
+let recognitionSocket = null;
+let streamFrameId = 0;
+let streamLastSentAt = 0;
+let streamTimer = null;
+
 function startRealtimeRecognition() {
-    // Dừng interval cũ nếu đang chạy
-    if (recognitionInterval) {
-        clearInterval(recognitionInterval);
-        recognitionInterval = null;
+    // Dừng vòng lặp cũ nếu đang chạy
+    stopRealtimeRecognition();
+    
+    if (!('WebSocket' in window)) {
+        startHttpRecognition();
+        return;
     }
     
-    // Nhận diện mỗi 1.5 giây (tránh quá tải)
-    recognitionInterval = setInterval(() => {
-        recognizeFace();
-    }, 1500);
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const socket = new WebSocket(`${protocol}//${window.location.host}/ws/recognize`);
+    socket.binaryType = 'arraybuffer';
+    let opened = false;
     
-    console.log('✓ Realtime recognition started');
+    socket.onopen = () => {
+        opened = true;
+        console.log('✓ Realtime recognition started (WebSocket)');
+        sendStreamFrame();
+    };
+    
+    socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        // Bỏ qua kết quả của frame cũ (nếu có). Kết quả của frame đang gửi thường tới ngay sau đó;
+        // nếu không tới (frame bị mất) thì vẫn gửi frame tiếp theo để phiên không bị treo
+        if (data.frame_id !== undefined && data.frame_id !== streamFrameId) {
+            if (streamTimer === null) {
+                streamTimer = setTimeout(sendStreamFrame, STALE_REPLY_WAIT_MS);
+            }
+            return;
+        }
+        const canvas = document.getElementById('recognize-canvas');
+        renderRecognitionResult(canvas, data);
+        scheduleNextStreamFrame();
+    };
+    
+    socket.onclose = () => {
+        if (recognitionSocket !== socket) {
+            return;
+        }
+        recognitionSocket = null;
+        // Server không hỗ trợ WebSocket -> fallback về HTTP
+        if (recognizeStream) {
+            console.log(opened ? 'WebSocket đã đóng, chuyển sang HTTP' : 'Không có WebSocket, dùng HTTP');
+            startHttpRecognition();
+        }
+    };
+    
+    recognitionSocket = socket;
 }
 
-function stopRealtimeRecognition() {
-    if (recognitionInterval) {
-        clearInterval(recognitionInterval);
-        recognitionInterval = null;
+function scheduleNextStreamFrame() {
+    // Gửi ngay nếu server xử lý chậm hơn MIN_FRAME_INTERVAL_MS, ngược lại chờ cho đủ khoảng cách tối thiểu
+    const elapsed = performance.now() - streamLastSentAt;
+    const delay = Math.max(0, MIN_FRAME_INTERVAL_MS - elapsed);
+    // Thay timer đang chờ (nếu có) để không gửi 2 frame cùng lúc
+    if (streamTimer !== null) {
+        clearTimeout(streamTimer);
     }
+    streamTimer = setTimeout(sendStreamFrame, delay);
 }
 
-async function recognizeFace() {
-    if (!recognizeStream) {
+async function sendStreamFrame() {
+    streamTimer = null;
+    const socket = recognitionSocket;
+    if (!recognizeStream || !socket || socket.readyState !== WebSocket.OPEN) {
         return;
     }
     
+    try {
+        const canvas = captureRecognizeFrame();
+        const imageBlob = await canvasToBlob(canvas);
+        const imageBuffer = await imageBlob.arrayBuffer();
+        
+        // Message binary: 4 byte frame_id + JPEG
+        streamFrameId = (streamFrameId + 1) >>> 0;
+        const message = new Uint8Array(4 + imageBuffer.byteLength);
+        new DataView(message.buffer).setUint32(0, streamFrameId);
+        message.set(new Uint8Array(imageBuffer), 4);
+        
+        streamLastSentAt = performance.now();
+        socket.send(message);
+    } catch (error) {
+        console.error('Recognition error:', error);
+        scheduleNextStreamFrame();
+    }
+}
+
+function startHttpRecognition() {
+    // Gửi request tiếp theo sau khi request trước hoàn tất (tránh request dồn ứ khi server chậm)
+    const loop = async () => {
+        const startedAt = performance.now();
+        await recognizeFace();
+        if (recognitionInterval === null) {
+            return;
+        }
+        const delay = Math.max(0, HTTP_FRAME_INTERVAL_MS - (performance.now() - startedAt));
+        recognitionInterval = setTimeout(loop, delay);
+    };
+    recognitionInterval = setTimeout(loop, 0);
+    
+    console.log('✓ Realtime recognition started (HTTP)');
+}
+
+function stopRealtimeRecognition() {
+    if (recognitionInterval) {
+        clearTimeout(recognitionInterval);
+        recognitionInterval = null;
+    }
+    if (streamTimer) {
+        clearTimeout(streamTimer);
+        streamTimer = null;
+    }
+    if (recognitionSocket) {
+        const socket = recognitionSocket;
+        recognitionSocket = null;
+        socket.close();
+    }
+}
+
+function captureRecognizeFrame() {
     const video = document.getElementById('recognize-video');
     const canvas = document.getElementById('recognize-canvas');
     const ctx = canvas.getContext('2d');
@@ -331,78 +445,88 @@ async function recognizeFace() {
     canvas.width = video.videoWidth;
     canvas.height = video.videoHeight;
     ctx.drawImage(video, 0, 0);
+    return canvas;
+}
+
+async function recognizeFace() {
+    if (!recognizeStream) {
+        return;
+    }
     
-    const imageData = canvas.toDataURL('image/jpeg');
+    const canvas = captureRecognizeFrame();
     
     try {
+        // Gửi JPEG binary (nhỏ hơn ~33% so với base64 JSON)
+        const imageBlob = await canvasToBlob(canvas);
         const response = await fetch('/api/face-recognition/recognize', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'image/jpeg'
             },
-            body: JSON.stringify({
-                image: imageData
-            })
+            body: imageBlob
         });
         
         const data = await response.json();
+        renderRecognitionResult(canvas, data);
         
-        const resultDiv = document.getElementById('recognize-result');
+    } catch (error) {
+        console.error('Recognition error:', error);
+    }
+}
+
+function renderRecognitionResult(canvas, data) {
+    const resultDiv = document.getElementById('recognize-result');
+    
+    if (data.success) {
+        // VẼ BOUNDING BOXES lên canvas
+        drawBoundingBoxes(canvas, data.faces || []);
         
-        if (data.success) {
-            // VẼ BOUNDING BOXES lên canvas
-            drawBoundingBoxes(canvas, data.faces || []);
-            
-            // Hiển thị kết quả với timestamp
-            const now = new Date().toLocaleTimeString('vi-VN');
-            
-            if (data.faces && data.faces.length > 0) {
-                let facesHTML = '';
-                data.faces.forEach((face, index) => {
-                    const statusColor = face.name === 'Unknown' ? '#dc3545' : '#28a745';
-                    const confidenceText = face.confidence > 0 ? ` (${face.confidence}%)` : '';
-                    
-                    facesHTML += `
-                        <div style="padding: 10px; margin: 5px 0; background: #f8f9fa; border-radius: 5px; border-left: 4px solid ${statusColor};">
-                            <div style="font-size: 1.5em; color: ${statusColor}; font-weight: bold;">
-                                ${face.name}${confidenceText}
-                            </div>
-                        </div>
-                    `;
-                });
+        // Hiển thị kết quả với timestamp
+        const now = new Date().toLocaleTimeString('vi-VN');
+        
+        if (data.faces && data.faces.length > 0) {
+            let facesHTML = '';
+            data.faces.forEach((face, index) => {
+                const statusColor = face.name === 'Unknown' ? '#dc3545' : '#28a745';
+                const confidenceText = face.confidence > 0 ? ` (${face.confidence}%)` : '';
                 
-                resultDiv.innerHTML = `
-                    <h3>🔴 Đang nhận diện realtime...</h3>
-                    <div style="margin: 15px 0;">
-                        <strong>Số khuôn mặt: ${data.total_faces}</strong>
-                    </div>
-                    ${facesHTML}
-                    <div style="font-size: 0.9em; color: #6c757d; margin-top: 10px;">
-                        Cập nhật lúc: ${now}
-                    </div>
-                `;
-            } else {
-                resultDiv.innerHTML = `
-                    <h3>🔍 Đang quét...</h3>
-                    <p style="color: #6c757d;">${data.message || 'Chưa phát hiện khuôn mặt'}</p>
-                    <div style="font-size: 0.9em; color: #6c757d;">
-                        Cập nhật lúc: ${now}
+                facesHTML += `
+                    <div style="padding: 10px; margin: 5px 0; background: #f8f9fa; border-radius: 5px; border-left: 4px solid ${statusColor};">
+                        <div style="font-size: 1.5em; color: ${statusColor}; font-weight: bold;">
+                            ${face.name}${confidenceText}
+                        </div>
                     </div>
                 `;
-            }
+            });
+            
+            resultDiv.innerHTML = `
+                <h3>🔴 Đang nhận diện realtime...</h3>
+                <div style="margin: 15px 0;">
+                    <strong>Số khuôn mặt: ${data.total_faces}</strong>
+                </div>
+                ${facesHTML}
+                <div style="font-size: 0.9em; color: #6c757d; margin-top: 10px;">
+                    Cập nhật lúc: ${now}
+                </div>
+            `;
         } else {
-            const now = new Date().toLocaleTimeString('vi-VN');
             resultDiv.innerHTML = `
-                <h3>⚠️ Lỗi nhận diện</h3>
-                <p style="color: #dc3545;">${data.error}</p>
+                <h3>🔍 Đang quét...</h3>
+                <p style="color: #6c757d;">${data.message || 'Chưa phát hiện khuôn mặt'}</p>
                 <div style="font-size: 0.9em; color: #6c757d;">
-                    ${now}
+                    Cập nhật lúc: ${now}
                 </div>
             `;
         }
-        
-    } catch (error) {
-        console.error('Recognition error:', error);
+    } else {
+        const now = new Date().toLocaleTimeString('vi-VN');
+        resultDiv.innerHTML = `
+            <h3>⚠️ Lỗi nhận diện</h3>
+            <p style="color: #dc3545;">${data.error}</p>
+            <div style="font-size: 0.9em; color: #6c757d;">
+                ${now}
+            </div>
+        `;
     }
 }
 
@@ -506,6 +630,7 @@ function setupDeepfaceUpload() {
 }
 
 function handleImageFile(file) {
+    deepfaceImageBlob = file;
     const reader = new FileReader();
     
     reader.onload = (e) => {
@@ -526,6 +651,7 @@ function handleImageFile(file) {
 
 function clearImage() {
     deepfaceImageData = null;
+    deepfaceImageBlob = null;
     
     const previewContainer = document.getElementById('image-preview-container');
     const uploadArea = document.getElementById('upload-area');
@@ -548,14 +674,13 @@ async function analyzeFaceFromImage() {
     showLoading('Đang phân tích khuôn mặt...');
     
     try {
+        // Gửi file ảnh gốc dạng binary, không cần base64
         const response = await fetch('/api/deepface/analyze', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': deepfaceImageBlob.type || 'application/octet-stream'
             },
-            body: JSON.stringify({
-                image: deepfaceImageData
-            })
+            body: deepfaceImageBlob
         });
         
         const data = await response.json();
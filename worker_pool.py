@@ -0,0 +1,242 @@
+"""
+Worker Pool - N process worker cho phần detect + encode + so khớp (CPU-bound, dlib chỉ dùng ~1 core / process)
+Process chính (Flask) giữ dataset gốc và là nơi duy nhất encode ảnh đăng ký; mỗi worker giữ model dlib
+và 1 bản sao gallery. Mọi thay đổi gallery được broadcast tới tất cả worker theo cùng thứ tự
+(sync toàn bộ / set / remove), request nhận diện được gửi tới worker đang ít việc nhất.
+Với shared_gallery, gallery không được gửi qua pipe mà ghi thành file memory-mapped dùng chung
+(shared_gallery.py): mọi worker map cùng 1 ma trận; reload tạo 1 version mới, đăng ký / xóa người chỉ
+gửi thay đổi (set / remove) như chế độ bản sao.
+Dùng multiprocessing 'spawn' để chạy giống nhau trên Windows và Linux.
+"""
+import itertools
+import multiprocessing
+import threading
+
+import numpy as np
+
+from face_gallery import FaceGallery
+from shared_gallery import SharedGalleryWriter, attach_shared_gallery
+
+
+def _worker_main(conn, recognize_fn, index_factory):
+    """Vòng lặp trong process worker: xử lý lần lượt từng message của dispatcher"""
+    gallery = FaceGallery()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        kind, request_id, payload = message
+        if kind == 'stop':
+            break
+        try:
+            if kind == 'recognize':
+                result = recognize_fn(payload, gallery)
+            elif kind == 'sync':
+                names, matrix, centroids = payload
+                gallery = FaceGallery.from_encodings(names, matrix)
+                if index_factory:
+                    # Centroid do process chính train / load: worker không tự train, không ghi file index
+                    gallery.attach_index(index_factory().as_replica(), centroids=centroids)
+                result = len(gallery)
+            elif kind == 'attach':
+                # Version mới của gallery dùng chung - đổi tham chiếu, bản map cũ được giải phóng
+                ann_index = index_factory() if index_factory else None
+                gallery = attach_shared_gallery(payload, ann_index=ann_index)
+                result = len(gallery)
+            elif kind == 'set':
+                gallery.set(*payload)
+                result = len(gallery)
+            elif kind == 'remove':
+                gallery.remove(payload)
+                result = len(gallery)
+            else:
+                raise ValueError(f'Message không hợp lệ: {kind}')
+            conn.send((request_id, result, None))
+        except Exception as e:
+            conn.send((request_id, None, f'{type(e).__name__}: {e}'))
+
+
+class WorkerError(RuntimeError):
+    """Worker trả về lỗi hoặc đã dừng"""
+
+
+class _Pending:
+    __slots__ = ('result', 'error', 'done')
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Worker:
+    """Đầu dispatcher của 1 process worker: pipe + thread đọc kết quả + số request đang xử lý"""
+
+    def __init__(self, context, index, recognize_fn, index_factory):
+        self.index = index
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, recognize_fn, index_factory),
+            daemon=True,
+            name=f'fr-worker-{index}'
+        )
+        self.in_flight = 0
+        self.completed = 0
+        self.errors = 0
+        self.alive = False
+        self._pending = {}
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.process.start()
+        self.alive = True
+        threading.Thread(target=self._read_loop, daemon=True, name=f'fr-worker-{self.index}-reader').start()
+
+    def send(self, kind, request_id, payload):
+        pending = _Pending()
+        with self._lock:
+            if not self.alive:
+                raise WorkerError(f'Worker {self.index} đã dừng')
+            self._pending[request_id] = pending
+        with self._send_lock:
+            self.conn.send((kind, request_id, payload))
+        return pending
+
+    def _read_loop(self):
+        while True:
+            try:
+                request_id, result, error = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                pending = self._pending.pop(request_id, None)
+                self.completed += 1
+                if error is not None:
+                    self.errors += 1
+            if pending is not None:
+                pending.result, pending.error = result, error
+                pending.done.set()
+
+        # Worker chết -> báo lỗi cho mọi request đang chờ
+        with self._lock:
+            self.alive = False
+            pending_items = list(self._pending.values())
+            self._pending.clear()
+        for pending in pending_items:
+            pending.error = f'Worker {self.index} đã dừng'
+            pending.done.set()
+
+    def stop(self):
+        try:
+            with self._send_lock:
+                self.conn.send(('stop', None, None))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class RecognitionWorkerPool:
+    """
+    recognize_fn(image_rgb, gallery) -> kết quả, chạy trong worker (phải là hàm cấp module để pickle được)
+    index_factory() -> ANN index cho gallery của worker (hoặc None)
+    shared_gallery: worker map chung gallery memory-mapped (False = mỗi worker giữ 1 bản sao)
+    shared_dir: thư mục chứa file gallery dùng chung (None = thư mục tạm riêng của process)
+    """
+
+    def __init__(self, num_workers, recognize_fn, index_factory=None, request_timeout=30,
+                 shared_gallery=False, shared_dir=None):
+        self.num_workers = num_workers
+        self.request_timeout = request_timeout
+        context = multiprocessing.get_context('spawn')
+        self._workers = [_Worker(context, i, recognize_fn, index_factory) for i in range(num_workers)]
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        # Broadcast tuần tự để mọi worker nhận các thay đổi gallery theo cùng 1 thứ tự
+        self._broadcast_lock = threading.RLock()
+        self.gallery_version = 0
+        self.shared_gallery = SharedGalleryWriter(shared_dir) if shared_gallery else None
+        self._shared_capacity = 0  # Số hàng của version đang map (gồm hàng dự phòng)
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def _wait(self, pending, worker):
+        if not pending.done.wait(self.request_timeout):
+            raise WorkerError(f'Worker {worker.index} không phản hồi sau {self.request_timeout}s')
+        if pending.error is not None:
+            raise WorkerError(pending.error)
+        return pending.result
+
+    def recognize(self, image_rgb):
+        """Gửi 1 frame tới worker đang có ít request nhất và chờ kết quả"""
+        with self._lock:
+            alive = [w for w in self._workers if w.alive]
+            if not alive:
+                raise WorkerError('Không còn worker nào đang chạy')
+            worker = min(alive, key=lambda w: w.in_flight)
+            worker.in_flight += 1
+            request_id = next(self._ids)
+        try:
+            pending = worker.send('recognize', request_id, image_rgb)
+            return self._wait(pending, worker)
+        finally:
+            with self._lock:
+                worker.in_flight -= 1
+
+    def broadcast(self, kind, payload):
+        """Gửi thay đổi gallery ('sync' / 'set' / 'remove') tới mọi worker và chờ tất cả xác nhận"""
+        with self._broadcast_lock:
+            sent = []
+            for worker in self._workers:
+                if worker.alive:
+                    sent.append((worker, worker.send(kind, next(self._ids), payload)))
+            for worker, pending in sent:
+                self._wait(pending, worker)
+            self.gallery_version += 1
+
+    def needs_snapshot(self, size):
+        """Gallery dùng chung đã dùng hết hàng dự phòng -> thay đổi tiếp theo phải ghi version mới"""
+        return self.shared_gallery is not None and size > self._shared_capacity
+
+    def publish_gallery(self, names, matrix, centroids=None):
+        """
+        Đưa toàn bộ gallery (+ centroid ANN index nếu có) tới mọi worker: ghi version memory-mapped mới
+        nếu dùng chung, ngược lại gửi bản sao. Chỉ dùng khi reload / hết hàng dự phòng, thay đổi lẻ dùng broadcast.
+        """
+        with self._broadcast_lock:
+            if self.shared_gallery is None:
+                self.broadcast('sync', (list(names), np.array(matrix, dtype=np.float32), centroids))
+                return
+            descriptor = self.shared_gallery.publish(names, matrix, centroids=centroids)
+            self.broadcast('attach', descriptor)
+            self._shared_capacity = descriptor['capacity']
+            self.shared_gallery.release_older(descriptor['version'])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.num_workers,
+                'alive': sum(1 for w in self._workers if w.alive),
+                'gallery_version': self.gallery_version,
+                'shared_gallery': self.shared_gallery.directory if self.shared_gallery else None,
+                'per_worker': [
+                    {
+                        'pid': w.process.pid,
+                        'alive': w.alive,
+                        'in_flight': w.in_flight,
+                        'completed': w.completed,
+                        'errors': w.errors
+                    }
+                    for w in self._workers
+                ]
+            }
+
+    def close(self):
+        for worker in self._workers:
+            worker.stop()